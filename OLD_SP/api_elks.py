@@ -2,6 +2,9 @@ from elasticsearch import Elasticsearch
 from elasticsearch.exceptions import NotFoundError
 from typing import List, Tuple, Dict, Any
 import os
+
+import pandas as pd
+
 from es_module import *
 
 
@@ -40,116 +43,184 @@ def get_disctinct_applications(index_name):
     return [bucket['key'] for bucket in response['aggregations']['distinct_apps']['buckets']]
 
 
+# Groupes par page d'agrégation composite (au-delà, pages suivantes via after_key)
+COMPOSITE_PAGE_SIZE = 1000
+
+# Champ dont aggregate_flows(peers=True) compte les valeurs distinctes par groupe (sur les flux)
+PEER_FIELD = 'dst_ip'
+
+
+def rollup_interval(start_ms=None, end_ms=None):
+    """
+    Intervalle de rollup le plus grossier compatible avec une période : ses bornes (None : non bornée)
+    doivent être des multiples de la taille de l'intervalle.
+    :return: nom de l'intervalle (voir ROLLUP_INTERVALS), ou None si aucun ne convient
+    """
+    for interval, size in sorted(ROLLUP_INTERVALS.items(), key=lambda item: item[1], reverse=True):
+        if all(bound is None or int(bound) % size == 0 for bound in (start_ms, end_ms)):
+            return interval
+    return None
+
+
+def _composite_totals(client, index, group_fields, metrics, filters, page_size, count_field=None, peer_field=None):
+    """
+    Agrégations composites paginées (une par champ, restreinte par filters[champ]) des sommes de metrics.
+    :param count_field: champ sommé pour le nombre de flux (doc_count si None)
+    :param peer_field: champ dont on compte les valeurs distinctes (colonne distinct_peers)
+    """
+    sub_aggs = {metric: {"sum": {"field": metric}} for metric in metrics}
+    if count_field is not None:
+        sub_aggs['flow_count'] = {"sum": {"field": count_field}}
+    after = {}
+    pending = list(group_fields)
+    rows = []
+    while pending:
+        aggs = {}
+        for field in pending:
+            composite = {"size": page_size, "sources": [{field: {"terms": {"field": field}}}]}
+            if field in after:
+                composite["after"] = after[field]
+            field_aggs = dict(sub_aggs)
+            if peer_field:
+                field_aggs['distinct_peers'] = {"cardinality": {"field": peer_field}}
+            aggs[field] = {"filter": filters[field], "aggs": {"groups": {"composite": composite, "aggs": field_aggs}}}
+        response = client.search(index=index, size=0, aggs=aggs)
+
+        next_pending = []
+        for field in pending:
+            result = response['aggregations'][field]['groups']
+            for bucket in result['buckets']:
+                row = {
+                    'dimension': field,
+                    'key': bucket['key'][field],
+                    'flow_count': bucket['flow_count']['value'] if count_field is not None else bucket['doc_count'],
+                    **{metric: bucket[metric]['value'] or 0 for metric in metrics},
+                }
+                if peer_field:
+                    row['distinct_peers'] = bucket['distinct_peers']['value']
+                rows.append(row)
+            # Page pleine : il peut rester des groupes après after_key
+            if len(result['buckets']) == page_size and 'after_key' in result:
+                after[field] = result['after_key']
+                next_pending.append(field)
+        pending = next_pending
+
+    columns = ['dimension', 'key', 'flow_count', *metrics] + (['distinct_peers'] if peer_field else [])
+    df = pd.DataFrame(rows, columns=columns)
+    df[columns[2:]] = df[columns[2:]].round().astype('int64')
+    df.attrs['source'] = index
+    return df
+
+
+def _use_rollup(client, index, group_fields, metrics, query, start_ms, end_ms, peers):
+    """
+    Intervalle de rollup utilisable pour une agrégation, ou None s'il faut interroger les flux : pas de query
+    ni de pairs distincts, champs et metrics couverts par le rollup, période alignée sur un intervalle
+    (voir rollup_interval) et rollup couvrant tous les flux de l'index (es_module.rollup_coverage) ;
+    sur une période non bornée, aucun flux ne doit être sans date (ils ne sont dans aucun intervalle).
+    La couverture n'est lue que si les autres conditions sont remplies ; elle est en cache d'un appel à
+    l'autre (une requête _msearch au plus par index et par ROLLUP_COVERAGE_TTL_S).
+    """
+    interval = rollup_interval(start_ms, end_ms)
+    if (query is not None or peers or interval is None or not set(group_fields) <= set(ROLLUP_DIMENSIONS)
+            or not set(metrics) <= set(FLOW_METRICS)):
+        return None
+    coverage = rollup_coverage(index, client)
+    if not coverage['complete'] or (start_ms is None and end_ms is None and coverage['untimed']):
+        return None
+    return interval
+
+
+def aggregate_flows(index: str, group_fields=('protocol', 'application_name'), metrics=FLOW_METRICS, query=None,
+                    page_size=COMPOSITE_PAGE_SIZE, start_ms=None, end_ms=None, peers=False,
+                    use_rollup=True) -> pd.DataFrame:
+    """
+    Nombre de flux et totaux (sommes des metrics) par valeur de chaque champ de group_fields, en une seule
+    requête : une agrégation composite (terms + sous-agrégations sum) par champ. Les champs à forte
+    cardinalité sont paginés (after_key), seules leurs pages suivantes font l'objet de nouvelles requêtes.
+
+    Lorsque c'est possible, la requête porte sur l'index de rollup (totaux partiels par minute ou par heure,
+    voir es_module.rollup_actions) plutôt que sur les flux, avec le même résultat (conditions : voir
+    _use_rollup ; sinon, ou si la couverture du rollup est inconnue, les flux sont interrogés).
+    df.attrs['source'] indique l'index interrogé.
+
+    :param group_fields: champs de regroupement (ex. protocol, application_name)
+    :param query: filtre Elasticsearch optionnel sur les flux (tous les flux si None)
+    :param start_ms, end_ms: période [start_ms, end_ms[ sur bidirectional_first_seen_ms (non bornée si None)
+    :param peers: ajoute la colonne distinct_peers (valeurs distinctes de PEER_FIELD, calculées sur les flux)
+    :param use_rollup: False pour toujours interroger les flux
+    :return: DataFrame (dimension, key, flow_count, une colonne par metric), une ligne par (champ, valeur)
+    """
+    client = create_or_get_es()
+    interval = _use_rollup(client, index, group_fields, metrics, query, start_ms, end_ms, peers) \
+        if use_rollup else None
+    if interval is not None:
+        period = {"format": "epoch_millis"}
+        if start_ms is not None:
+            period["gte"] = int(start_ms)
+        if end_ms is not None:
+            period["lt"] = int(end_ms)
+        filters = {
+            field: {"bool": {"filter": [
+                {"term": {"interval": interval}},
+                {"term": {"dimension": field}},
+                {"range": {"bucket_start": period}},
+            ]}}
+            for field in group_fields
+        }
+        return _composite_totals(client, rollup_index_name(index), group_fields, metrics, filters, page_size,
+                                 count_field='flow_count')
+
+    flows_filter = flow_query(start_ms, end_ms)
+    if query is not None:
+        flows_filter = {"bool": {"filter": [query, flows_filter]}}
+    return _composite_totals(client, index, group_fields, metrics, {field: flows_filter for field in group_fields},
+                             page_size, peer_field=PEER_FIELD if peers else None)
+
+
+def totals_by(index: str, field: str, metrics=FLOW_METRICS, **kwargs) -> pd.DataFrame:
+    """
+    Totaux par valeur d'un seul champ (voir aggregate_flows, dont kwargs sont les options), indexés par cette valeur.
+    """
+    df = aggregate_flows(index, [field], metrics, **kwargs)
+    return df.drop(columns='dimension').set_index('key')
+
 
 def get_flows_for_protocol(index: str, protocol: str) -> List[Dict[str, Any]]:
-    query = {
-        "query": {
-            "term": {
-                "protocol.keyword": protocol
-            }
-        }
-    }
-    response = es.search(index=index, body=query)
-    return [hit['_source'] for hit in response['hits']['hits']]
+    # Tous les flux (scroll), pas seulement la première page de résultats
+    query = flow_query(protocols=[protocol])
+    return [doc for batch in iter_flow_documents(index, query, method='scan') for doc in batch]
+
+# Les fonctions suivantes s'appuient sur une seule requête d'agrégation (totals_by) au lieu d'une recherche par
+# protocole / application : les comptes et totaux portent sur tous les flux, pas sur les 10 premiers résultats
 
 def get_number_of_flows_for_protocol(index: str) -> List[Tuple[str, int]]:
-    distinct_protocols = get_protocols(index)
-    res = []
-    for protocol in distinct_protocols:
-        flows = get_flows_for_protocol(index, protocol)
-        res.append((protocol, len(flows)))
-    return res
+    totals = totals_by(index, 'protocol', [])
+    return list(zip(totals.index.tolist(), totals['flow_count'].tolist()))
 
 def get_src_dst_size_per_protocol(index: str) -> List[Tuple[str, int, int]]:
-    protocols = get_protocols(index)
-    res = []
-    for protocol in protocols:
-        flows = get_flows_for_protocol(index, protocol)
-        src_size = sum(flow['src2dst_bytes'] for flow in flows)
-        dst_size = sum(flow['dst2src_bytes'] for flow in flows)
-        res.append((protocol, src_size, dst_size))
-    return res
+    totals = totals_by(index, 'protocol', ['src2dst_bytes', 'dst2src_bytes'])
+    return list(zip(totals.index.tolist(), totals['src2dst_bytes'].tolist(), totals['dst2src_bytes'].tolist()))
 
 def get_total_src_dst_bytes_per_protocol(index: str) -> List[Tuple[str, int, int]]:
-    distinct_protocols = get_protocols(index)
-    res = []
-    for protocol in distinct_protocols:
-        query = {
-            "query": {
-                "term": {
-                    "protocol.keyword": protocol
-                }
-            },
-            "aggs": {
-                "total_src_bytes": {
-                    "sum": {
-                        "field": "src2dst_bytes"
-                    }
-                },
-                "total_dst_bytes": {
-                    "sum": {
-                        "field": "dst2src_bytes"
-                    }
-                }
-            }
-        }
-        response = es.search(index=index, body=query)
-        src_bytes = response['aggregations']['total_src_bytes']['value'] or 0
-        dst_bytes = response['aggregations']['total_dst_bytes']['value'] or 0
-        res.append((protocol, src_bytes, dst_bytes))
-    return res
+    return get_src_dst_size_per_protocol(index)
 
 def get_total_src_dst_packets_per_protocol(index: str) -> List[Tuple[str, int]]:
-    distinct_protocols = get_protocols(index)
-    res = []
-    for protocol in distinct_protocols:
-        query = {
-            "query": {
-                "term": {
-                    "protocol.keyword": protocol
-                }
-            },
-            "aggs": {
-                "total_packets": {
-                    "sum": {
-                        "field": "src2dst_packets"
-                    }
-                }
-            }
-        }
-        response = es.search(index=index, body=query)
-        packets = response['aggregations']['total_packets']['value'] or 0
-        res.append((protocol, packets))
-    return res
+    totals = totals_by(index, 'protocol', ['src2dst_packets'])
+    return list(zip(totals.index.tolist(), totals['src2dst_packets'].tolist()))
 
 def get_flows_for_application(index: str, application: str) -> List[Dict[str, Any]]:
-    query = {
-        "query": {
-            "term": {
-                "application_name.keyword": application
-            }
-        }
-    }
-    response = es.search(index=index, body=query)
-    return [hit['_source'] for hit in response['hits']['hits']]
+    # Tous les flux (scroll), pas seulement la première page de résultats
+    query = flow_query(applications=[application])
+    return [doc for batch in iter_flow_documents(index, query, method='scan') for doc in batch]
 
 def get_number_of_flows_for_application(index: str) -> List[Tuple[str, int]]:
-    distinct_applications = get_apps_list(index)
-    res = []
-    for application in distinct_applications:
-        flows = get_flows_for_application(index, application)
-        res.append((application, len(flows)))
-    return res
+    totals = totals_by(index, 'application_name', [])
+    return list(zip(totals.index.tolist(), totals['flow_count'].tolist()))
 
 def get_src_dst_size_per_application(index: str) -> List[Tuple[str, int, int]]:
-    apps = get_apps_list(index)
-    res = []
-    for app in apps:
-        flows = get_flows_for_application(index, app)
-        src_size = sum(flow['src2dst_bytes'] for flow in flows)
-        dst_size = sum(flow['dst2src_bytes'] for flow in flows)
-        res.append((app, src_size, dst_size))
-    return res
+    totals = totals_by(index, 'application_name', ['src2dst_bytes', 'dst2src_bytes'])
+    return list(zip(totals.index.tolist(), totals['src2dst_bytes'].tolist(), totals['dst2src_bytes'].tolist()))
 
 def get_total_bytes_per_application(index: str) -> List[Tuple[str, int]]:
     res = []
@@ -159,24 +230,5 @@ def get_total_bytes_per_application(index: str) -> List[Tuple[str, int]]:
     return res
 
 def get_total_packets_per_application(index: str) -> List[Tuple[str, int]]:
-    apps = get_apps_list(index)
-    res = []
-    for app in apps:
-        query = {
-            "query": {
-                "term": {
-                    "application_name.keyword": app
-                }
-            },
-            "aggs": {
-                "total_packets": {
-                    "sum": {
-                        "field": "src2dst_packets"
-                    }
-                }
-            }
-        }
-        response = es.search(index=index, body=query)
-        packets = response['aggregations']['total_packets']['value'] or 0
-        res.append((app, packets))
-    return res
+    totals = totals_by(index, 'application_name', ['src2dst_packets'])
+    return list(zip(totals.index.tolist(), totals['src2dst_packets'].tolist()))
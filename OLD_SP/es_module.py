@@ -1,17 +1,132 @@
 import os
+import threading
+import time
+import uuid
+from collections import deque
+
 from dotenv import load_dotenv
 import pandas as pd
 from elasticsearch import Elasticsearch, helpers
 from elasticsearch.helpers import scan
 
-def create_or_get_es():
+# Adresse du cluster, surchargeable par la variable d'environnement ES_HOST (ex. stand-in local, voir es_standin)
+DEFAULT_ES_HOST = "https://localhost:9200"
+
+# Champs d'un document de flux (ceux du mapping de create_or_get_index, dans le même ordre)
+FLOW_FIELDS = [
+    "id", "expiration_id",
+    "src_ip", "src_mac", "src_oui", "src_port",
+    "dst_ip", "dst_mac", "dst_oui", "dst_port",
+    "protocol", "ip_version", "vlan_id", "tunnel_id",
+    "bidirectional_first_seen_ms", "bidirectional_last_seen_ms", "bidirectional_duration_ms",
+    "bidirectional_packets", "bidirectional_bytes",
+    "src2dst_first_seen_ms", "src2dst_last_seen_ms", "src2dst_duration_ms", "src2dst_packets", "src2dst_bytes",
+    "dst2src_first_seen_ms", "dst2src_last_seen_ms", "dst2src_duration_ms", "dst2src_packets", "dst2src_bytes",
+    "application_name", "application_category_name", "application_is_guessed", "application_confidence",
+    "requested_server_name", "client_fingerprint", "server_fingerprint", "user_agent", "content_type",
+    # Statistiques de taille de paquets et fan_in/fan_out (étape 2 de SP4), utilisées par les modèles de SP4
+    "bidirectional_mean_ps", "bidirectional_max_ps", "src2dst_mean_ps", "src2dst_max_ps",
+    "dst2src_mean_ps", "dst2src_max_ps", "fan_in", "fan_out",
+]
+
+# Compteurs remplacés par 0 lorsqu'ils sont manquants (voir clean_data)
+COUNT_FIELDS = ['bidirectional_bytes', 'src2dst_bytes', 'dst2src_bytes',
+                'bidirectional_packets', 'src2dst_packets', 'dst2src_packets']
+
+# Réglages par défaut de l'indexation en masse
+CSV_CHUNK_ROWS = 50_000     # lignes lues à la fois dans un CSV (empreinte mémoire constante)
+BULK_CHUNK_SIZE = 2000      # documents par requête _bulk
+BULK_THREADS = 4            # requêtes _bulk simultanées (mode 'parallel')
+BULK_MODES = ('parallel', 'streaming')
+
+# Index de rollup : totaux partiels par intervalle de temps, écrits à l'indexation (voir rollup_actions)
+ROLLUP_SUFFIX = "-rollup"
+ROLLUP_INTERVALS = {'1m': 60_000, '1h': 3_600_000}     # nom -> taille de l'intervalle en ms
+ROLLUP_DIMENSIONS = ('application_name', 'src_ip', 'protocol')
+# Dimension des documents de couverture (flux pris en compte par le rollup, voir rollup_coverage)
+COVERAGE_DIMENSION = "coverage"
+# Durée de validité de la couverture du rollup en cache (voir rollup_coverage) : l'indexation faite par ce
+# processus l'invalide, celle d'un autre processus n'est vue qu'après ce délai
+ROLLUP_COVERAGE_TTL_S = 60
+# Totaux des flux (sommés par les rollups et par api_elks.aggregate_flows)
+FLOW_METRICS = ['src2dst_bytes', 'dst2src_bytes', 'bidirectional_bytes',
+                'src2dst_packets', 'dst2src_packets', 'bidirectional_packets']
+
+# Documents par page lors de l'export (export_flows)
+EXPORT_BATCH_SIZE = 5000
+EXPORT_KEEP_ALIVE = "2m"    # durée de vie du point-in-time / du scroll entre deux pages
+EXPORT_METHODS = ('pit', 'scan')
+
+# Nombre d'erreurs d'indexation affichées (les suivantes sont seulement comptées)
+MAX_REPORTED_ERRORS = 10
+
+
+# Réglages des clients partagés (voir create_or_get_es) :
+#   - connections_per_node : connexions HTTP gardées ouvertes (keep-alive) par nœud, réutilisées d'une requête
+#     à l'autre ; au moins autant que de threads du bulk parallèle pour qu'aucun n'attende une connexion
+#   - max_retries / retry_on_timeout / retry_on_status : nouvelles tentatives sur erreur de connexion,
+#     délai dépassé ou cluster saturé (429, 502-504) ; limitées pour _bulk (voir BULK_RETRY_OPTIONS)
+ES_CLIENT_OPTIONS = {
+    'connections_per_node': 4 * BULK_THREADS,
+    'request_timeout': 30,
+    'max_retries': 3,
+    'retry_on_timeout': True,
+    'retry_on_status': (429, 502, 503, 504),
+    'http_compress': False,
+}
+
+# Nouvelles tentatives des requêtes _bulk : une requête _bulk arrivée en délai dépassé ou en 502-504 (proxy)
+# a pu être appliquée par le cluster, la rejouer dupliquerait les flux (documents sans _id).
+# Seul un refus explicite du cluster (429) est rejoué.
+BULK_RETRY_OPTIONS = {'retry_on_timeout': False, 'retry_on_status': (429,)}
+
+# Un client par (adresse, réglages), partagé par tous les appels et tous les threads du processus
+_es_clients = {}
+_es_clients_lock = threading.Lock()
+# .env lu une seule fois, avant la première lecture de ES_HOST / ELASTIC_PASSWORD
+_dotenv_loaded = False
+
+# Couverture du rollup par index des flux : index_name -> (time.monotonic() du calcul, couverture)
+_rollup_coverage = {}
+_rollup_coverage_lock = threading.Lock()
+
+
+def create_or_get_es(hosts=None, **options):
+    """
+    Client Elasticsearch partagé : créé (avec son pool de connexions) au premier appel pour une adresse
+    et des réglages donnés, puis réutilisé. Le client est thread-safe, le bulk parallèle le partage entre
+    ses threads.
+
+    :param hosts: adresse du cluster (ES_HOST, sinon DEFAULT_ES_HOST)
+    :param options: réglages remplaçant ceux de ES_CLIENT_OPTIONS (pool, délais, nouvelles tentatives)
+    """
+    global _dotenv_loaded
+    if not _dotenv_loaded:
+        load_dotenv()
+        _dotenv_loaded = True
     # Initialiser la connexion à Elasticsearch
-    load_dotenv()
-    return Elasticsearch(
-        "https://localhost:9200",
-        basic_auth=("elastic", os.getenv("ELASTIC_PASSWORD")),
-        verify_certs=False
-    )
+    hosts = hosts or os.getenv("ES_HOST", DEFAULT_ES_HOST)
+    options = {**ES_CLIENT_OPTIONS, **options}
+    key = (str(hosts), tuple(sorted((k, str(v)) for k, v in options.items())))
+    with _es_clients_lock:
+        if key not in _es_clients:
+            _es_clients[key] = Elasticsearch(
+                hosts,
+                basic_auth=("elastic", os.getenv("ELASTIC_PASSWORD")),
+                verify_certs=False,
+                **options
+            )
+        return _es_clients[key]
+
+
+def close_es_clients():
+    """
+    Ferme les connexions de tous les clients partagés (les appels suivants en recréent).
+    """
+    with _es_clients_lock:
+        for client in _es_clients.values():
+            client.close()
+        _es_clients.clear()
 
 def clean_data(document):
     for key in ['bidirectional_bytes', 'src2dst_bytes', 'dst2src_bytes', 'bidirectional_packets', 'src2dst_packets', 'dst2src_packets']:
@@ -25,6 +140,36 @@ def clean_data(document):
 
     return document
 
+def rollup_index_name(index_name):
+    return index_name + ROLLUP_SUFFIX
+
+
+def create_or_get_rollup_index(index_name):
+    """
+    Crée (si besoin) l'index de rollup d'un index de flux : documents (intervalle, début d'intervalle,
+    dimension, valeur) avec le nombre de flux et les totaux FLOW_METRICS d'un bloc de flux, plus un document
+    de couverture par bloc. La valeur est rangée dans le champ de la dimension, avec le même type que dans
+    l'index des flux.
+    """
+    client = create_or_get_es()
+    rollup_index = rollup_index_name(index_name)
+    if not client.indices.exists(index=rollup_index):
+        properties = {
+            "interval": {"type": "keyword"},
+            "dimension": {"type": "keyword"},
+            "bucket_start": {"type": "date", "format": "epoch_millis"},
+            "application_name": {"type": "keyword"},
+            "src_ip": {"type": "ip"},
+            "protocol": {"type": "integer"},
+            "flow_count": {"type": "long"},
+            "untimed_count": {"type": "long"},
+            "totals_count": {"type": "long"},
+        }
+        properties.update({metric: {"type": "long"} for metric in FLOW_METRICS})
+        client.indices.create(index=rollup_index, mappings={"properties": properties})
+    return client.indices.get(index=rollup_index)
+
+
 def create_or_get_index(index_name):
     client = create_or_get_es()
     if not client.indices.exists(index=index_name):
@@ -68,7 +213,15 @@ def create_or_get_index(index_name):
                     "client_fingerprint": {"type": "keyword"},
                     "server_fingerprint": {"type": "keyword"},
                     "user_agent": {"type": "keyword"},
-                    "content_type": {"type": "keyword"}
+                    "content_type": {"type": "keyword"},
+                    "bidirectional_mean_ps": {"type": "float"},
+                    "bidirectional_max_ps": {"type": "float"},
+                    "src2dst_mean_ps": {"type": "float"},
+                    "src2dst_max_ps": {"type": "float"},
+                    "dst2src_mean_ps": {"type": "float"},
+                    "dst2src_max_ps": {"type": "float"},
+                    "fan_in": {"type": "integer"},
+                    "fan_out": {"type": "integer"}
                 }
             }
         }
@@ -78,75 +231,350 @@ def create_or_get_index(index_name):
 
 
 # Prepare a generator to yield documents in the bulk API format
+# (documents construits colonne par colonne, voir prepare_documents)
 def generate_data(df, index_name):
-    for _, row in df.iterrows():
-        document = {
-            "_index": index_name,
-            "_source": {
-                "id": row['id'],
-                "expiration_id": row['expiration_id'],
-                "src_ip": row['src_ip'],
-                "src_mac": row['src_mac'],
-                "src_oui": row['src_oui'],
-                "src_port": row['src_port'],
-                "dst_ip": row['dst_ip'],
-                "dst_mac": row['dst_mac'],
-                "dst_oui": row['dst_oui'],
-                "dst_port": row['dst_port'],
-                "protocol": row['protocol'],
-                "ip_version": row['ip_version'],
-                "vlan_id": row['vlan_id'],
-                "tunnel_id": row['tunnel_id'],
-                "bidirectional_first_seen_ms": row['bidirectional_first_seen_ms'],
-                "bidirectional_last_seen_ms": row['bidirectional_last_seen_ms'],
-                "bidirectional_duration_ms": row['bidirectional_duration_ms'],
-                "bidirectional_packets": row['bidirectional_packets'],
-                "bidirectional_bytes": row['bidirectional_bytes'],
-                "src2dst_first_seen_ms": row['src2dst_first_seen_ms'],
-                "src2dst_last_seen_ms": row['src2dst_last_seen_ms'],
-                "src2dst_duration_ms": row['src2dst_duration_ms'],
-                "src2dst_packets": row['src2dst_packets'],
-                "src2dst_bytes": row['src2dst_bytes'],
-                "dst2src_first_seen_ms": row['dst2src_first_seen_ms'],
-                "dst2src_last_seen_ms": row['dst2src_last_seen_ms'],
-                "dst2src_duration_ms": row['dst2src_duration_ms'],
-                "dst2src_packets": row['dst2src_packets'],
-                "dst2src_bytes": row['dst2src_bytes'],
-                "application_name": row['application_name'],
-                "application_category_name": row['application_category_name'],
-                "application_is_guessed": row['application_is_guessed'],
-                "application_confidence": row['application_confidence'],
-                "requested_server_name": row['requested_server_name'],
-                "client_fingerprint": row['client_fingerprint'],
-                "server_fingerprint": row['server_fingerprint'],
-                "user_agent": row['user_agent'],
-                "content_type": row['content_type']
-            }
-        }
-        cleaned_document = clean_data(document)
-        yield cleaned_document
+    yield from iter_actions([df], index_name)
 
 
 # Load the CSV data into a Pandas DataFrame
 def csv_to_df(_csv_file):
     df = pd.read_csv(_csv_file)
-    df = df.astype(str).map(lambda x: "NaN" if x == "" or pd.isna(x) else x)
-    return df
+    # Valeurs manquantes => "NaN", en une opération sur tout le DataFrame
+    return df.astype(str).mask(df.isna(), "NaN")
 
 
-# # Use the bulk helper to index the data and capture failed documents
-def indexer(df, index_name):
-    client = create_or_get_es()
+def prepare_documents(df: pd.DataFrame) -> list[dict]:
+    """
+    Construit les documents (_source) d'un DataFrame de flux colonne par colonne, équivalent vectorisé de
+    generate_data + clean_data : compteurs manquants à 0, application_is_guessed en booléen,
+    autres valeurs manquantes à None (champ absent pour Elasticsearch) ; colonnes manquantes à None.
+    Accepte aussi un DataFrame de csv_to_df (valeurs en texte, "NaN" pour les valeurs manquantes).
+    """
+    docs = df.reindex(columns=FLOW_FIELDS)
+    # Colonnes texte : le marqueur "NaN" de csv_to_df est une valeur manquante
+    text_cols = [col for col in FLOW_FIELDS if not pd.api.types.is_numeric_dtype(docs[col])]
+    docs[text_cols] = docs[text_cols].mask(docs[text_cols] == "NaN")
+    counts = [col for col in COUNT_FIELDS if col in df.columns]
+    # to_numeric : les compteurs d'un DataFrame de csv_to_df sont du texte ("10.0")
+    docs[counts] = docs[counts].apply(pd.to_numeric, errors='coerce').fillna(0).astype('int64')
+    docs['application_is_guessed'] = pd.to_numeric(docs['application_is_guessed'], errors='coerce') == 1
+
+    # Une liste Python par colonne (types natifs, None pour les valeurs manquantes), puis un dict par ligne :
+    # même résultat que docs.to_dict('records'), environ deux fois plus rapide
+    columns = []
+    for field in FLOW_FIELDS:
+        values = docs[field].tolist()
+        if docs[field].hasnans:
+            missing = docs[field].isna().tolist()
+            values = [None if m else v for v, m in zip(values, missing)]
+        columns.append(values)
+    return [dict(zip(FLOW_FIELDS, row)) for row in zip(*columns)]
+
+
+def iter_csv_chunks(csv_paths, chunk_rows=CSV_CHUNK_ROWS):
+    """
+    Lit une liste de CSV par blocs de chunk_rows lignes (un seul bloc en mémoire à la fois).
+    """
+    for csv_path in csv_paths:
+        yield from pd.read_csv(csv_path, chunksize=chunk_rows)
+
+
+def _native(value):
+    # Valeur numpy -> Python (un protocole lu en float à cause de valeurs manquantes redevient entier)
+    value = value.item() if hasattr(value, 'item') else value
+    return int(value) if isinstance(value, float) and value.is_integer() else value
+
+
+def rollup_documents(df: pd.DataFrame) -> list[dict]:
+    """
+    Documents de rollup d'un bloc de flux : pour chaque intervalle de ROLLUP_INTERVALS et chaque dimension de
+    ROLLUP_DIMENSIONS, nombre de flux et totaux FLOW_METRICS par (début d'intervalle, valeur).
+    Les flux sans bidirectional_first_seen_ms n'entrent dans aucun intervalle, ils sont comptés à part
+    (untimed_count du document de couverture, voir rollup_actions).
+    """
+    times = pd.to_numeric(df['bidirectional_first_seen_ms'], errors='coerce')
+    totals = df.reindex(columns=FLOW_METRICS).apply(pd.to_numeric, errors='coerce').fillna(0).astype('int64')
+    docs = []
+    for interval, size in ROLLUP_INTERVALS.items():
+        buckets = (times // size) * size
+        for dimension in ROLLUP_DIMENSIONS:
+            frame = totals.assign(bucket_start=buckets, key=df[dimension]).dropna(subset=['bucket_start', 'key'])
+            grouped = frame.groupby(['bucket_start', 'key'], sort=False)
+            sums = grouped[FLOW_METRICS].sum()
+            counts = grouped.size()
+            for (bucket_start, key), flow_count, metrics in zip(counts.index, counts.tolist(),
+                                                                sums.to_dict('records')):
+                docs.append({
+                    "interval": interval,
+                    "dimension": dimension,
+                    "bucket_start": int(bucket_start),
+                    dimension: _native(key),
+                    "flow_count": int(flow_count),
+                    **{metric: int(value) for metric, value in metrics.items()},
+                })
+    return docs
+
+
+def rollup_actions(df: pd.DataFrame, index_name, chunk_id):
+    """
+    Actions bulk de l'index de rollup pour un bloc de flux : les totaux du bloc sont des documents à part,
+    sommés à la requête (api_elks.aggregate_flows). Leurs identifiants dépendent du bloc (chunk_id) :
+    une requête _bulk rejouée réécrit les mêmes documents au lieu de compter deux fois le bloc.
+    Le document de couverture du bloc compte ses flux et ses documents de totaux (voir rollup_coverage).
+    """
+    rollup_index = rollup_index_name(index_name)
+    docs = rollup_documents(df)
+    for doc in docs:
+        doc_id = f"{chunk_id}:{doc['interval']}:{doc['dimension']}:{doc['bucket_start']}:{doc[doc['dimension']]}"
+        yield {"_index": rollup_index, "_id": doc_id, "_source": doc}
+    untimed = int(pd.to_numeric(df['bidirectional_first_seen_ms'], errors='coerce').isna().sum())
+    yield {"_index": rollup_index, "_id": f"{chunk_id}:{COVERAGE_DIMENSION}",
+           "_source": {"interval": COVERAGE_DIMENSION, "dimension": COVERAGE_DIMENSION,
+                       "flow_count": len(df), "untimed_count": untimed, "totals_count": len(docs)}}
+
+
+def rollup_coverage(index_name, client=None, max_age_s=ROLLUP_COVERAGE_TTL_S) -> dict:
+    """
+    Couverture de l'index de rollup : le rollup donne les mêmes totaux que les flux seulement si tous les
+    flux de l'index y ont été pris en compte. Ce n'est pas le cas des flux indexés avant la création de
+    l'index de rollup ou sans rollup (indexer(..., rollup=False)), ni si une partie des flux a échoué.
+    Les documents de couverture et de totaux d'un bloc sont des actions bulk indépendantes : le rollup n'est
+    complet que si les documents de totaux attendus par les documents de couverture (totals_count) sont
+    tous présents, un bloc dont une partie des totaux a échoué laisse le rollup incomplet.
+
+    Le nombre de flux et les sommes du rollup sont lus en une seule requête _msearch (un index de rollup
+    absent y est ignoré), puis gardés en cache max_age_s secondes ; index_csv_files et indexer invalident
+    le cache de l'index qu'ils alimentent (voir invalidate_rollup_coverage).
+    :param max_age_s: âge maximal de la couverture en cache (0 : toujours relue)
+    :return: dict (flows : flux de l'index, rolled_up : flux pris en compte par le rollup,
+        untimed : flux du rollup sans date, totals / expected_totals : documents de totaux présents /
+        attendus, complete) ; complete False si pas de rollup
+    """
+    with _rollup_coverage_lock:
+        cached = _rollup_coverage.get(index_name)
+    if cached is not None and time.monotonic() - cached[0] < max_age_s:
+        return dict(cached[1])
+
+    client = client or create_or_get_es()
+    computed_at = time.monotonic()
+    is_coverage = {"term": {"dimension": COVERAGE_DIMENSION}}
+    flows_response, rollup_response = client.msearch(searches=[
+        {"index": index_name},
+        {"size": 0, "track_total_hits": True},
+        {"index": rollup_index_name(index_name), "ignore_unavailable": True},
+        {"size": 0, "aggs": {
+            "coverage": {"filter": is_coverage,
+                         "aggs": {"rolled_up": {"sum": {"field": "flow_count"}},
+                                  "untimed": {"sum": {"field": "untimed_count"}},
+                                  "expected_totals": {"sum": {"field": "totals_count"}}}},
+            "totals": {"filter": {"bool": {"must_not": is_coverage}}}}},
+    ])['responses']
+    if 'error' in flows_response:
+        raise RuntimeError(f"Comptage des flux de {index_name} impossible : {flows_response['error']}")
+    coverage = {'flows': int(flows_response['hits']['total']['value']), 'rolled_up': 0, 'untimed': 0,
+                'totals': 0, 'expected_totals': 0}
+    # Pas d'agrégations : index de rollup absent
+    aggs = rollup_response.get('aggregations')
+    if aggs:
+        for key in ('rolled_up', 'untimed', 'expected_totals'):
+            coverage[key] = int(aggs['coverage'][key]['value'] or 0)
+        coverage['totals'] = int(aggs['totals']['doc_count'])
+    coverage['complete'] = (coverage['rolled_up'] > 0 and coverage['rolled_up'] == coverage['flows']
+                            and coverage['totals'] == coverage['expected_totals'])
+    with _rollup_coverage_lock:
+        _rollup_coverage[index_name] = (computed_at, coverage)
+    return dict(coverage)
+
+
+def invalidate_rollup_coverage(index_name=None):
+    """
+    Oublie la couverture du rollup en cache d'un index des flux (de tous si index_name est None).
+    """
+    with _rollup_coverage_lock:
+        if index_name is None:
+            _rollup_coverage.clear()
+        else:
+            _rollup_coverage.pop(index_name, None)
+
+
+def iter_actions(chunks, index_name, rollup=False):
+    """
+    Actions bulk des documents d'une suite de DataFrames, construits bloc par bloc au fil de la consommation.
+    :param rollup: ajoute les documents de l'index de rollup de chaque bloc (voir rollup_actions)
+    """
+    run_id = uuid.uuid4().hex
+    for chunk_number, df in enumerate(chunks):
+        for doc in prepare_documents(df):
+            yield {"_index": index_name, "_source": doc}
+        if rollup:
+            yield from rollup_actions(df, index_name, f"{run_id}-{chunk_number}")
+
+
+def bulk_index(client, actions, mode='parallel', chunk_size=BULK_CHUNK_SIZE, thread_count=BULK_THREADS,
+               queue_size=BULK_THREADS):
+    """
+    Envoie des actions bulk, avec parallel_bulk (thread_count requêtes simultanées) ou streaming_bulk
+    (une requête à la fois). Les actions sont consommées au fil de l'eau.
+
+    :param mode: 'parallel' ou 'streaming'
+    :param chunk_size: nombre de documents par requête _bulk
+    :return: dict (documents indexés, en échec, durée, documents par seconde)
+    """
+    if mode not in BULK_MODES:
+        raise ValueError(f"Mode inconnu : {mode} (modes : {list(BULK_MODES)})")
+    client = client.options(**BULK_RETRY_OPTIONS)
+    if mode == 'parallel':
+        results = helpers.parallel_bulk(client, actions, thread_count=thread_count, chunk_size=chunk_size,
+                                        queue_size=queue_size, raise_on_error=False, raise_on_exception=False)
+    else:
+        results = helpers.streaming_bulk(client, actions, chunk_size=chunk_size,
+                                         raise_on_error=False, raise_on_exception=False)
+
+    start = time.time()
+    success, failed = 0, 0
+    errors = deque(maxlen=MAX_REPORTED_ERRORS)
+    for ok, item in results:
+        if ok:
+            success += 1
+        else:
+            failed += 1
+            errors.append(item)
+    elapsed = time.time() - start
+
+    for error in errors:
+        print(error)
+    stats = {
+        'indexed': success,
+        'failed': failed,
+        'seconds': elapsed,
+        'docs_per_s': (success + failed) / elapsed if elapsed > 0 else float('nan'),
+    }
+    print(f"{success} documents indexés, {failed} en échec, {elapsed:.1f}s ({stats['docs_per_s']:.0f} docs/s)")
+    return stats
+
+
+def index_csv_files(csv_folder, index_name, client=None, chunk_rows=CSV_CHUNK_ROWS, rollup=False, **bulk_kwargs):
+    """
+    Indexe tous les CSV d'un dossier (triés par nom) en un seul flux bulk : les fichiers sont lus par blocs
+    et les documents construits au fur et à mesure de l'envoi, l'empreinte mémoire ne dépend pas
+    de la taille du dossier.
+
+    :param rollup: écrit aussi les documents de l'index de rollup (voir create_or_get_rollup_index)
+    :param bulk_kwargs: options de bulk_index (mode, chunk_size, thread_count, queue_size)
+    :return: statistiques de bulk_index
+    """
+    client = client or create_or_get_es()
+    csv_paths = [os.path.join(csv_folder, f) for f in sorted(os.listdir(csv_folder)) if f.endswith(".csv")]
+    actions = iter_actions(iter_csv_chunks(csv_paths, chunk_rows), index_name, rollup)
     try:
-        # Nettoyer le DataFrame pour remplacer les valeurs NaN
-        df.fillna(0, inplace=True)  # Remplacer NaN par 0
-        # Après avoir chargé le DataFrame
-        df['application_is_guessed'] = df['application_is_guessed'].astype(bool)
-
-        success, failed = helpers.bulk(client, generate_data(df, index_name), stats_only=False, raise_on_error=False)
-        if failed:
-            print(f"{failed} documents failed to index.")
-    except helpers.BulkIndexError as e:
-        print(f"Error during indexing: {e}")
-        for error in e.errors:
-            print(error)
+        return bulk_index(client, actions, **bulk_kwargs)
+    finally:
+        invalidate_rollup_coverage(index_name)
+
+
+# Indexation d'un DataFrame déjà chargé (documents construits colonne par colonne, voir prepare_documents)
+def indexer(df, index_name, client=None, rollup=False, **bulk_kwargs):
+    client = client or create_or_get_es()
+    try:
+        return bulk_index(client, iter_actions([df], index_name, rollup), **bulk_kwargs)
+    finally:
+        invalidate_rollup_coverage(index_name)
+
+
+def flow_query(start_ms=None, end_ms=None, applications=None, protocols=None):
+    """
+    Filtre des flux : bidirectional_first_seen_ms dans [start_ms, end_ms[, application_name et protocol
+    parmi les listes données (aucun filtre pour les paramètres à None).
+    """
+    filters = []
+    if start_ms is not None or end_ms is not None:
+        bounds = {"format": "epoch_millis"}
+        if start_ms is not None:
+            bounds["gte"] = int(start_ms)
+        if end_ms is not None:
+            bounds["lt"] = int(end_ms)
+        filters.append({"range": {"bidirectional_first_seen_ms": bounds}})
+    if applications is not None:
+        filters.append({"terms": {"application_name": list(applications)}})
+    if protocols is not None:
+        filters.append({"terms": {"protocol": list(protocols)}})
+    return {"bool": {"filter": filters}} if filters else {"match_all": {}}
+
+
+def iter_flow_documents(index_name, query=None, batch_size=EXPORT_BATCH_SIZE, columns=None, method='pit',
+                        keep_alive=EXPORT_KEEP_ALIVE, client=None):
+    """
+    Parcourt tous les flux d'un index correspondant à query, page par page, sans la limite des 10 000
+    résultats d'une recherche simple :
+      - 'pit' : point-in-time + search_after, flux triés par bidirectional_first_seen_ms (ordre nécessaire au
+        calcul de fan_in/fan_out par blocs, voir SP4 pcapLoader.stream_fan_features)
+      - 'scan' : helpers.scan (scroll), sans ordre garanti
+
+    :param columns: champs à renvoyer (tous si None)
+    :return: générateur de listes de documents (_source), au plus batch_size par liste
+    """
+    if method not in EXPORT_METHODS:
+        raise ValueError(f"Méthode inconnue : {method} (méthodes : {list(EXPORT_METHODS)})")
+    client = client or create_or_get_es()
+    query = query or {"match_all": {}}
+
+    if method == 'scan':
+        batch = []
+        for hit in scan(client, index=index_name, query={"query": query}, size=batch_size, scroll=keep_alive,
+                        source=columns if columns is not None else True):
+            batch.append(hit['_source'])
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+        return
+
+    pit_id = client.open_point_in_time(index=index_name, keep_alive=keep_alive)['id']
+    try:
+        search_after = None
+        while True:
+            page = {"search_after": search_after} if search_after is not None else {}
+            response = client.search(
+                pit={"id": pit_id, "keep_alive": keep_alive},
+                query=query,
+                size=batch_size,
+                sort=[{"bidirectional_first_seen_ms": "asc"}, {"_shard_doc": "asc"}],
+                source=columns if columns is not None else True,
+                track_total_hits=False,
+                **page
+            )
+            # L'identifiant du point-in-time peut changer d'une page à l'autre
+            pit_id = response.get('pit_id', pit_id)
+            hits = response['hits']['hits']
+            if not hits:
+                break
+            yield [hit['_source'] for hit in hits]
+            if len(hits) < batch_size:
+                break
+            search_after = hits[-1]['sort']
+    finally:
+        client.close_point_in_time(id=pit_id)
+
+
+def documents_to_df(documents, columns=None) -> pd.DataFrame:
+    """
+    DataFrame de flux au format des CSV nfstream (colonnes de FLOW_FIELDS, application_is_guessed en 0/1),
+    inverse de prepare_documents.
+    """
+    df = pd.DataFrame.from_records(documents, columns=columns or FLOW_FIELDS)
+    if 'application_is_guessed' in df.columns:
+        df['application_is_guessed'] = df['application_is_guessed'].fillna(False).astype(bool).astype(int)
+    return df
+
+
+def export_flows(index_name, start_ms=None, end_ms=None, applications=None, protocols=None,
+                 batch_size=EXPORT_BATCH_SIZE, columns=None, method='pit', client=None):
+    """
+    Export en flux des flux indexés, par DataFrames de batch_size lignes au format nfstream (voir documents_to_df),
+    filtrés par période et application (voir flow_query) : les DataFrames peuvent être passés directement à
+    la vectorisation et aux évaluateurs de SP4, sans passer par des CSV.
+    """
+    query = flow_query(start_ms, end_ms, applications, protocols)
+    for documents in iter_flow_documents(index_name, query, batch_size, columns, method, client=client):
+        yield documents_to_df(documents, columns)
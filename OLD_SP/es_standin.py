@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+import es_module
+
+# Stand-in local d'Elasticsearch pour mesurer l'indexation en masse sans cluster : il répond aux requêtes
+# d'index (HEAD/PUT/GET/DELETE) et à _bulk en comptant les documents reçus, sans les stocker.
+# Les recherches (_search, _count) répondent comme sur un index vide.
+# Usage : python es_standin.py --serve, puis ES_HOST=http://localhost:9201 python main.py
+
+DEFAULT_PORT = 9201
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=None):
+        payload = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        # En-tête vérifié par le client elasticsearch
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(payload)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _index_name(self) -> str:
+        return self.path.split("?")[0].strip("/").split("/")[0]
+
+    def do_HEAD(self):
+        self._reply(200 if self._index_name() in self.server.indices else 404)
+
+    def do_GET(self):
+        name = self._index_name()
+        if not name:
+            self._reply(200, {"version": {"number": "8.0.0"}, "tagline": "You Know, for Search"})
+        elif name in self.server.indices:
+            self._reply(200, {name: self.server.indices[name]})
+        else:
+            self._reply(404, {"error": {"type": "index_not_found_exception"}, "status": 404})
+
+    def _is_bulk(self) -> bool:
+        return self.path.split("?")[0].endswith("_bulk")
+
+    def _endpoint(self) -> str:
+        return self.path.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+
+    def _query_params(self) -> dict:
+        return parse_qs(urlsplit(self.path).query)
+
+    def do_PUT(self):
+        # Le client envoie _bulk en PUT ou en POST selon sa version
+        if self._is_bulk():
+            self.do_POST()
+            return
+        name = self._index_name()
+        self.server.indices[name] = json.loads(self._body() or b"{}")
+        self._reply(200, {"acknowledged": True, "index": name})
+
+    def do_DELETE(self):
+        self._body()
+        found = self.server.indices.pop(self._index_name(), None) is not None
+        # Comme Elasticsearch : un index absent n'est pas une erreur avec ignore_unavailable=true
+        ignored = self._query_params().get("ignore_unavailable", ["false"])[0] == "true"
+        self._reply(200 if found or ignored else 404, {"acknowledged": found or ignored})
+
+    def _search(self):
+        body = json.loads(self._body() or b"{}")
+        aggs = body.get("aggs", body.get("aggregations", {}))
+        self._reply(200, {"took": 1, "timed_out": False, "hits": {"total": {"value": 0, "relation": "eq"},
+                                                                  "max_score": None, "hits": []},
+                          "aggregations": _empty_aggregations(aggs)})
+
+    def do_POST(self):
+        if self._endpoint() == "_search":
+            self._search()
+            return
+        if self._endpoint() == "_count":
+            self._body()
+            self._reply(200, {"count": 0})
+            return
+        if not self._is_bulk():
+            self._body()
+            self._reply(404, {"error": "non supporté par le stand-in"})
+            return
+        lines = [line for line in self._body().split(b"\n") if line.strip()]
+        # Lignes action / document alternées (actions index ou create uniquement)
+        items = []
+        for line in lines[0::2]:
+            op, meta = next(iter(json.loads(line).items()))
+            items.append({op: {"_index": meta.get("_index"), "status": 201, "result": "created"}})
+            self.server.doc_counts[meta.get("_index")] = self.server.doc_counts.get(meta.get("_index"), 0) + 1
+        if self.server.latency_s:
+            # Temps de traitement simulé d'une requête _bulk par le cluster
+            time.sleep(self.server.latency_s)
+        self._reply(200, {"took": 1, "errors": False, "items": items})
+
+
+def _empty_aggregations(aggs: dict) -> dict:
+    # Résultat d'agrégations sur un index vide (sous-agrégations comprises)
+    return {name: {"doc_count": 0, "buckets": [], "value": None, **_empty_aggregations(spec.get("aggs", {}))}
+            for name, spec in aggs.items()}
+
+
+def start_standin(port=0, latency_ms=0.0):
+    """
+    Démarre le stand-in dans un thread (port 0 : port libre choisi par le système).
+    :return: (serveur, url) ; serveur.doc_counts donne le nombre de documents reçus par index
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StandinHandler)
+    server.daemon_threads = True
+    server.indices = {}
+    server.doc_counts = {}
+    server.latency_s = latency_ms / 1000
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def generate_flow_csvs(folder, n_rows=200_000, n_files=4, seed=42):
+    """
+    Écrit n_files CSV de flux synthétiques (colonnes de es_module.FLOW_FIELDS) dans folder.
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({field: rng.integers(0, 10_000, n_rows) for field in es_module.FLOW_FIELDS})
+    for field in ["src_ip", "dst_ip"]:
+        df[field] = [f"10.0.{i % 256}.{i % 251}" for i in rng.integers(0, 1 << 16, n_rows)]
+    for field in ["src_mac", "dst_mac", "src_oui", "dst_oui", "requested_server_name", "client_fingerprint",
+                  "server_fingerprint", "user_agent", "content_type", "application_category_name"]:
+        df[field] = np.where(rng.random(n_rows) < 0.3, None, f"{field}-x")
+    df["application_name"] = rng.choice(["HTTP", "DNS", "TLS.Google", "SSH"], n_rows)
+    df["application_is_guessed"] = rng.integers(0, 2, n_rows)
+    df.loc[rng.random(n_rows) < 0.01, "src2dst_bytes"] = np.nan
+    for i, part in enumerate(np.array_split(np.arange(n_rows), n_files)):
+        df.iloc[part].to_csv(os.path.join(folder, f"trace_{i}.csv"), index=False)
+    return folder
+
+
+def benchmark_indexer(csv_folder=None, n_rows=200_000, modes=es_module.BULK_MODES, thread_counts=(1, 4, 8),
+                      chunk_sizes=(500, 2000), latency_ms=5.0, index_name="pcap-flows-bench"):
+    """
+    Mesure le débit (docs/s) de es_module.index_csv_files contre le stand-in, pour chaque mode,
+    nombre de threads et taille de requête _bulk.
+    :param csv_folder: dossier de CSV à indexer (CSV synthétiques de n_rows flux si None)
+    :param latency_ms: temps de traitement simulé de chaque requête _bulk
+    :return: DataFrame des mesures
+    """
+    server, url = start_standin(latency_ms=latency_ms)
+    client = es_module.create_or_get_es(url)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_folder = csv_folder or generate_flow_csvs(tmp, n_rows)
+        for mode in modes:
+            for thread_count in (thread_counts if mode == 'parallel' else (1,)):
+                for chunk_size in chunk_sizes:
+                    server.doc_counts.clear()
+                    stats = es_module.index_csv_files(csv_folder, index_name, client, mode=mode,
+                                                      chunk_size=chunk_size, thread_count=thread_count,
+                                                      queue_size=thread_count)
+                    results.append({'mode': mode, 'threads': thread_count, 'chunk_size': chunk_size,
+                                    'received': server.doc_counts.get(index_name, 0), **stats})
+    server.shutdown()
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stand-in local de l'API _bulk d'Elasticsearch")
+    parser.add_argument("csv_folder", nargs="?", default=None, help="CSV à indexer (synthétiques si absent)")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="temps simulé d'une requête _bulk")
+    parser.add_argument("--serve", action="store_true", help="sert le stand-in sur --port sans mesurer")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    if args.serve:
+        server, url = start_standin(args.port, args.latency_ms)
+        print(f"Stand-in Elasticsearch : {url} (Ctrl-C pour arrêter)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.shutdown()
+    else:
+        print(benchmark_indexer(args.csv_folder, args.rows, latency_ms=args.latency_ms).to_string(index=False))
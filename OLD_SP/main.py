@@ -18,32 +18,21 @@ if __name__ == '__main__':
     # create the index
     client = es_module.create_or_get_es()
     client.indices.delete(index='pcap-flows', ignore_unavailable=True)  # Supprime l'index existant pour refaire depuis le début
+    client.indices.delete(index=es_module.rollup_index_name(index_name), ignore_unavailable=True)
     es_module.create_or_get_index(index_name)
+    # rollup par minute / par heure, écrit pendant l'indexation (requêtes de api_elks.aggregate_flows)
+    es_module.create_or_get_rollup_index(index_name)
 
     all_protocols = {}
     all_apps = {}
 
-    # read the csv files
-    for csv_file in os.listdir(csv_folder):
-        csv_file_path = os.path.join(csv_folder, csv_file)
-        df = pd.read_csv(csv_file_path)
-        # bulk insert the data
-        es_module.indexer(df, index_name)
-        # get the list of all the (distinct) protocols contained in elastic search with the index pcap-flows
-        #protocols = get_disctinct_protocols("pcap-flows")
-        # add the protocols to the all_protocols dictionary
-        applications = get_disctinct_applications("pcap-flows")
-        # for protocol in protocols:
-        #     if protocol['key'] in all_protocols:
-        #         all_protocols[protocol['key']] += protocol['doc_count']
-        #     else:
-        #         all_protocols[protocol['key']] = protocol['doc_count']
-        for application in applications:
-            if application in all_apps:
-                all_apps[application] += 1
-            else:
-                all_apps[application] = 1
-
+    # read the csv files : tout le dossier en un seul flux bulk, lu par blocs (mémoire constante)
+    es_module.index_csv_files(csv_folder, index_name, client,
+                              chunk_rows=es_module.CSV_CHUNK_ROWS, rollup=True, mode='parallel',
+                              chunk_size=es_module.BULK_CHUNK_SIZE, thread_count=es_module.BULK_THREADS)
+    # get the list of all the (distinct) applications contained in elastic search with the index pcap-flows
+    for application in get_disctinct_applications(index_name):
+        all_apps[application] = all_apps.get(application, 0) + 1
 
     for protocol in all_protocols:
         print(f"{protocol}: {all_protocols[protocol]}")
@@ -0,0 +1,562 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from pcapLoader import add_fan_features, csv_cleaner, OLD_add_fan_features
+from labeling import label_flows
+from tools import get_app_list, get_categorical_cols, get_numeric_cols, subset_divizor
+from vectorization import vectorize_flows
+from cross_validation_setup import train_rf, train_naive_bayes, train_knn
+from evaluation import evaluate_flows
+from compiled_forest import CompiledForest, check_parity
+from model_bundle import clear_bundles, get_bundle
+from neighbors import ApproxKNeighborsClassifier
+from storage import read_table
+
+# Colonnes écrites par nfstream (voir pcap_to_csv), plus les statistiques de taille de paquets
+# ajoutées par statistical_analysis=True et utilisées par get_numeric_cols
+NFSTREAM_COLUMNS = [
+    'id', 'expiration_id', 'src_ip', 'src_mac', 'src_oui', 'src_port', 'dst_ip', 'dst_mac', 'dst_oui', 'dst_port',
+    'protocol', 'ip_version', 'vlan_id', 'tunnel_id',
+    'bidirectional_first_seen_ms', 'bidirectional_last_seen_ms', 'bidirectional_duration_ms',
+    'bidirectional_packets', 'bidirectional_bytes',
+    'src2dst_first_seen_ms', 'src2dst_last_seen_ms', 'src2dst_duration_ms', 'src2dst_packets', 'src2dst_bytes',
+    'dst2src_first_seen_ms', 'dst2src_last_seen_ms', 'dst2src_duration_ms', 'dst2src_packets', 'dst2src_bytes',
+    'bidirectional_min_ps', 'bidirectional_mean_ps', 'bidirectional_stddev_ps', 'bidirectional_max_ps',
+    'src2dst_min_ps', 'src2dst_mean_ps', 'src2dst_stddev_ps', 'src2dst_max_ps',
+    'dst2src_min_ps', 'dst2src_mean_ps', 'dst2src_stddev_ps', 'dst2src_max_ps',
+    'application_name', 'application_category_name', 'application_is_guessed', 'application_confidence',
+    'requested_server_name', 'client_fingerprint', 'server_fingerprint', 'user_agent', 'content_type'
+]
+
+# Mélange d'applications par défaut (noms nDPI) : application -> proportion
+DEFAULT_APP_MIX = {
+    'HTTP': 0.30, 'TLS': 0.15, 'DNS': 0.20, 'HTTP.Google': 0.05, 'SSH': 0.05, 'IMAP': 0.05,
+    'SMTP': 0.05, 'ICMP': 0.04, 'FTP_CONTROL': 0.04, 'Unknown': 0.07,
+}
+
+# Protocole, port destination et catégorie de chaque application synthétique (protocole maître nDPI)
+APP_PROFILES = {
+    'HTTP': (6, 80, 'Web'),
+    'TLS': (6, 443, 'Web'),
+    'DNS': (17, 53, 'Network'),
+    'SSH': (6, 22, 'RemoteAccess'),
+    'IMAP': (6, 143, 'Email'),
+    'SMTP': (6, 25, 'Email'),
+    'ICMP': (1, 0, 'Network'),
+    'FTP_CONTROL': (6, 21, 'Download'),
+    'Unknown': (17, 0, 'Unspecified'),
+}
+
+START_MS = 1421927414000
+
+# Fichier de référence des performances (voir compare_to_baseline)
+DEFAULT_BASELINE = "benchmark_baseline.json"
+
+
+def generate_flow_table(n_rows: int, n_ips: int = 500, duration_s: int = 3600, seed: int = 42) -> pd.DataFrame:
+    """
+    Génère une table de flux synthétique minimale (src_ip, dst_ip, bidirectional_first_seen_ms).
+
+    :param n_rows: nombre de flux
+    :param n_ips: nombre d'adresses IP distinctes
+    :param duration_s: durée de la capture simulée en secondes
+    :param seed: graine du générateur aléatoire
+    :return: DataFrame des flux
+    """
+    rng = np.random.default_rng(seed)
+    ips = np.array([f"10.0.{i // 256}.{i % 256}" for i in range(n_ips)])
+    start_ms = 1421927414000
+    return pd.DataFrame({
+        'src_ip': ips[rng.integers(0, n_ips, n_rows)],
+        'dst_ip': ips[rng.integers(0, n_ips, n_rows)],
+        'bidirectional_first_seen_ms': start_ms + rng.integers(0, duration_s * 1000, n_rows),
+    })
+
+
+def benchmark_fan_features(sizes=(10_000, 100_000, 1_000_000), time_window: int = 60, max_rows_old: int = 10_000):
+    """
+    Compare l'ancienne (OLD_add_fan_features) et la nouvelle version (add_fan_features) du calcul de fan_in/fan_out.
+    L'ancienne version est quadratique : elle n'est lancée que jusqu'à max_rows_old lignes.
+    Quand les deux versions tournent, on vérifie aussi que les colonnes produites sont identiques.
+
+    :return: liste de dict (taille, temps ancienne version, temps nouvelle version, identique)
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_dir = os.path.join(tmp_dir, "src")
+        new_dir = os.path.join(tmp_dir, "new")
+        old_dir = os.path.join(tmp_dir, "old")
+        for d in (src_dir, new_dir, old_dir):
+            os.makedirs(d)
+
+        for n_rows in sizes:
+            csv_path = os.path.join(src_dir, f"synth_{n_rows}.csv")
+            generate_flow_table(n_rows).to_csv(csv_path, index=False)
+
+            start = time.perf_counter()
+            new_csv = add_fan_features(csv_path, new_dir, time_window=time_window)
+            new_time = time.perf_counter() - start
+
+            old_time = None
+            identical = None
+            if n_rows <= max_rows_old:
+                start = time.perf_counter()
+                old_csv = OLD_add_fan_features(csv_path, old_dir, time_window=time_window)
+                old_time = time.perf_counter() - start
+
+                new_df = pd.read_csv(new_csv)
+                old_df = pd.read_csv(old_csv)
+                identical = new_df[['fan_out', 'fan_in']].equals(old_df[['fan_out', 'fan_in']])
+
+            results.append({
+                'rows': n_rows,
+                'old_s': old_time,
+                'new_s': new_time,
+                'identical': identical,
+            })
+            old_txt = f"{old_time:.2f}s" if old_time is not None else "non lancé"
+            print(f"{n_rows} flux : ancienne = {old_txt}, nouvelle = {new_time:.2f}s, identique = {identical}")
+
+    return results
+
+
+def generate_nfstream_flows(n_rows: int, n_ips: int = 500, app_mix: dict = None, flows_per_s: float = 50.0,
+                            seed: int = 42) -> pd.DataFrame:
+    """
+    Génère des flux synthétiques au schéma nfstream (NFSTREAM_COLUMNS).
+
+    :param n_rows: nombre de flux
+    :param n_ips: nombre d'adresses IP distinctes (cardinalité des src_ip/dst_ip)
+    :param app_mix: dict application_name -> proportion (DEFAULT_APP_MIX si None)
+    :param flows_per_s: densité temporelle (flux par seconde de capture simulée)
+    :param seed: graine du générateur aléatoire
+    :return: DataFrame trié par bidirectional_first_seen_ms
+    """
+    rng = np.random.default_rng(seed)
+    app_mix = app_mix or DEFAULT_APP_MIX
+    app_names = np.array(list(app_mix))
+    weights = np.array(list(app_mix.values()), dtype=float)
+    apps = app_names[rng.choice(len(app_names), n_rows, p=weights / weights.sum())]
+    master = np.array([name.split('.')[0] if name.split('.')[0] in APP_PROFILES else 'Unknown' for name in apps])
+    profiles = pd.DataFrame([APP_PROFILES[m] for m in master], columns=['protocol', 'dst_port', 'category'])
+
+    ips = np.array([f"10.{i // 65536}.{(i // 256) % 256}.{i % 256}" if i % 4 else f"192.168.{(i // 256) % 256}.{i % 256}"
+                    for i in range(n_ips)])
+    duration_ms = int(n_rows / flows_per_s * 1000) + 1
+    first_seen = START_MS + np.sort(rng.integers(0, duration_ms, n_rows))
+    duration = rng.exponential(2000, n_rows).astype(np.int64)
+    s2d_packets = rng.integers(1, 50, n_rows)
+    d2s_packets = rng.integers(0, 50, n_rows)
+    s2d_bytes = s2d_packets * rng.integers(40, 1500, n_rows)
+    d2s_bytes = d2s_packets * rng.integers(40, 1500, n_rows)
+    dst_port = np.where(profiles['dst_port'] > 0, profiles['dst_port'], rng.integers(1024, 65535, n_rows))
+
+    df = pd.DataFrame({
+        'id': np.arange(n_rows),
+        'expiration_id': 0,
+        'src_ip': ips[rng.integers(0, n_ips, n_rows)],
+        'src_mac': '00:00:00:00:00:01',
+        'src_oui': '00:00:00',
+        'src_port': rng.integers(1024, 65535, n_rows),
+        'dst_ip': ips[rng.integers(0, n_ips, n_rows)],
+        'dst_mac': '00:00:00:00:00:02',
+        'dst_oui': '00:00:00',
+        'dst_port': dst_port,
+        'protocol': profiles['protocol'].to_numpy(),
+        'ip_version': 4,
+        'vlan_id': 0,
+        'tunnel_id': 0,
+        'bidirectional_first_seen_ms': first_seen,
+        'bidirectional_last_seen_ms': first_seen + duration,
+        'bidirectional_duration_ms': duration,
+        'bidirectional_packets': s2d_packets + d2s_packets,
+        'bidirectional_bytes': s2d_bytes + d2s_bytes,
+        'src2dst_first_seen_ms': first_seen,
+        'src2dst_last_seen_ms': first_seen + duration,
+        'src2dst_duration_ms': duration,
+        'src2dst_packets': s2d_packets,
+        'src2dst_bytes': s2d_bytes,
+        'dst2src_first_seen_ms': np.where(d2s_packets > 0, first_seen + 1, 0),
+        'dst2src_last_seen_ms': np.where(d2s_packets > 0, first_seen + duration, 0),
+        'dst2src_duration_ms': np.where(d2s_packets > 0, duration - 1, 0),
+        'dst2src_packets': d2s_packets,
+        'dst2src_bytes': d2s_bytes,
+    })
+    for direction, packets, nb_bytes in (('bidirectional', s2d_packets + d2s_packets, s2d_bytes + d2s_bytes),
+                                         ('src2dst', s2d_packets, s2d_bytes),
+                                         ('dst2src', d2s_packets, d2s_bytes)):
+        mean = np.where(packets > 0, nb_bytes / np.maximum(packets, 1), 0)
+        df[f'{direction}_min_ps'] = np.where(packets > 0, 40, 0)
+        df[f'{direction}_mean_ps'] = mean.round(3)
+        df[f'{direction}_stddev_ps'] = (mean / 4).round(3)
+        df[f'{direction}_max_ps'] = np.where(packets > 0, np.minimum(1500, 2 * mean).astype(int), 0)
+
+    df['application_name'] = apps
+    df['application_category_name'] = profiles['category'].to_numpy()
+    df['application_is_guessed'] = rng.integers(0, 2, n_rows)
+    df['application_confidence'] = rng.integers(0, 7, n_rows)
+    df['requested_server_name'] = np.where(master == 'HTTP', 'www.example.com', '')
+    df['client_fingerprint'] = ''
+    df['server_fingerprint'] = ''
+    df['user_agent'] = np.where(master == 'HTTP', 'Mozilla/5.0', '')
+    df['content_type'] = ''
+    return df[NFSTREAM_COLUMNS]
+
+
+def dirty_copy(df: pd.DataFrame, missing_ratio: float = 0.01, seed: int = 42) -> pd.DataFrame:
+    """
+    Copie « sale » d'un export nfstream pour csv_cleaner : quelques champs vides,
+    et quelques lignes tronquées (plus d'un tiers de champs manquants, supprimées au nettoyage).
+    """
+    rng = np.random.default_rng(seed)
+    df = df.astype(object)
+    values = df.to_numpy()
+    values[rng.random(values.shape) < missing_ratio] = None
+    truncated = rng.random(len(df)) < missing_ratio
+    values[np.ix_(truncated, np.arange(len(df.columns) // 2, len(df.columns)))] = None
+    return pd.DataFrame(values, columns=df.columns)
+
+
+def generate_ground_truth(flows: pd.DataFrame, attack_ratio: float = 0.1, decoy_ratio: float = 0.05,
+                          seed: int = 42) -> pd.DataFrame:
+    """
+    Génère une vérité terrain au format de TRAIN.gt.csv correspondant à des flux synthétiques :
+    attack_ratio des flux sont couverts par un intervalle de la GT (label 1),
+    plus decoy_ratio de lignes sur des 5-tuples absents des flux.
+    """
+    rng = np.random.default_rng(seed)
+    attacks = flows.sample(frac=attack_ratio, random_state=seed)
+    gt = pd.DataFrame({
+        'first_timestamp_ms': (attacks['bidirectional_first_seen_ms'] - rng.integers(0, 1000, len(attacks))).astype(float),
+        'last_timestamp_ms': (attacks['bidirectional_last_seen_ms'] + rng.integers(0, 1000, len(attacks))).astype(float),
+        'src_ip': attacks['src_ip'],
+        'src_port': attacks['src_port'],
+        'dst_ip': attacks['dst_ip'],
+        'dst_port': attacks['dst_port'],
+        'protocol': attacks['protocol'],
+    })
+    decoys = flows.sample(frac=decoy_ratio, random_state=seed + 1)
+    gt = pd.concat([gt, pd.DataFrame({
+        'first_timestamp_ms': decoys['bidirectional_first_seen_ms'].astype(float),
+        'last_timestamp_ms': decoys['bidirectional_last_seen_ms'].astype(float),
+        'src_ip': '175.45.176.1',
+        'src_port': decoys['src_port'],
+        'dst_ip': decoys['dst_ip'],
+        'dst_port': decoys['dst_port'],
+        'protocol': decoys['protocol'],
+    })], ignore_index=True)
+    gt['label'] = 1
+    return gt.sort_values('first_timestamp_ms', kind='stable').reset_index(drop=True)
+
+
+def _measure(stage: str, n_rows: int, func, *args, measure_memory: bool = True, **kwargs):
+    """
+    Chronomètre func(*args, **kwargs), puis (si measure_memory) la relance sous tracemalloc pour le pic mémoire :
+    les deux mesures sont séparées pour que le suivi des allocations ne fausse pas le temps.
+    :return: (résultat, mesures de l'étape)
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+
+    peak_mb = None
+    if measure_memory:
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+
+    metrics = {
+        'stage': stage,
+        'rows': n_rows,
+        'seconds': seconds,
+        'flows_per_s': n_rows / seconds if seconds > 0 else None,
+        'peak_mem_mb': peak_mb,
+    }
+    mem_txt = f"{peak_mb:.1f} Mo" if peak_mb is not None else "-"
+    print(f"{stage:<16} {n_rows:>9} flux  {seconds:>8.2f}s  {metrics['flows_per_s'] or 0:>12.0f} flux/s  {mem_txt}")
+    return result, metrics
+
+
+def benchmark_stages(n_rows: int = 100_000, n_ips: int = 500, app_mix: dict = None, flows_per_s: float = 50.0,
+                     time_window: int = 60, train_rows: int = 2000, model_type: str = 'rf',
+                     measure_memory: bool = True, seed: int = 42) -> list[dict]:
+    """
+    Benchmark des étapes du pipeline sur un jeu synthétique : csv_cleaner, add_fan_features, label_flows,
+    subset_divizor, vectorize_flows, entraînement (train_rf / train_naive_bayes / train_knn) et evaluate_flows.
+    Chaque étape consomme la sortie de la précédente, comme dans pipeline().
+
+    :param train_rows: nombre maximum de flux d'entraînement par application (la recherche d'hyperparamètres domine)
+    :return: liste de dict (étape, flux, secondes, flux/s, pic mémoire en Mo)
+    """
+    trainers = {'rf': train_rf, 'nb': train_naive_bayes, 'knn': train_knn}
+    categorical_cols = get_categorical_cols()
+    numeric_cols = get_numeric_cols()
+    results = []
+
+    flows = generate_nfstream_flows(n_rows, n_ips, app_mix, flows_per_s, seed)
+    gt = generate_ground_truth(flows, seed=seed)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dirs = {name: os.path.join(tmp_dir, name) for name in ('pur', 'fan', 'labeled', 'vectorized', 'models')}
+        for d in dirs.values():
+            os.makedirs(d)
+        raw_csv = os.path.join(dirs['pur'], "synth.csv.temp")
+        dirty_copy(flows, seed=seed).to_csv(raw_csv, index=False)
+        gt_path = os.path.join(tmp_dir, "synth.gt.csv")
+        gt.to_csv(gt_path, index=False)
+
+        pur_csv, m = _measure("csv_cleaner", n_rows, csv_cleaner, raw_csv, measure_memory=measure_memory)
+        results.append(m)
+        fan_csv, m = _measure("add_fan_features", n_rows, add_fan_features, pur_csv, dirs['fan'], time_window,
+                              measure_memory=measure_memory)
+        results.append(m)
+        labeled_csv, m = _measure("label_flows", n_rows, label_flows, fan_csv, dirs['labeled'], gt_path,
+                                  measure_memory=measure_memory)
+        results.append(m)
+
+        labeled = read_table(labeled_csv)
+        apps = get_app_list()
+        subsets, m = _measure("subset_divizor", len(labeled), subset_divizor, labeled, apps, 'application_name',
+                              measure_memory=measure_memory)
+        results.append(m)
+
+        # Vectorisation de chaque application (fit du scaler et de l'encodeur comme en entraînement)
+        subsets = {app: sub for app, sub in subsets.items() if len(sub) > 0}
+
+        def vectorize_all():
+            vectorized = {}
+            for app, sub in subsets.items():
+                app_dir = os.path.join(dirs['vectorized'], app)
+                os.makedirs(app_dir, exist_ok=True)
+                vectorized[app] = vectorize_flows(
+                    sub.copy(), categorical_cols, numeric_cols, label_col='label',
+                    scaler_path=os.path.join(app_dir, 'scaler.joblib'),
+                    one_hot_encoder_path=os.path.join(app_dir, 'ohe.joblib')
+                )
+            return vectorized
+
+        vectorized, m = _measure("vectorize_flows", sum(len(sub) for sub in subsets.values()), vectorize_all,
+                                 measure_memory=measure_memory)
+        results.append(m)
+
+        # Entraînement sur au plus train_rows flux par application (sans relance sous tracemalloc : trop long)
+        def train_all():
+            for app, vec in vectorized.items():
+                sample = vec.sample(n=min(train_rows, len(vec)), random_state=seed)
+                save_path = os.path.join(dirs['models'], app)
+                os.makedirs(save_path, exist_ok=True)
+                model, _, _ = trainers[model_type](sample, save_path)
+                joblib.dump(model, os.path.join(save_path, f"model_{app}.joblib"))
+
+        nb_train = sum(min(train_rows, len(vec)) for vec in vectorized.values())
+        _, m = _measure(f"train_{model_type}", nb_train, train_all, measure_memory=False)
+        results.append(m)
+
+        def evaluate_all():
+            clear_bundles()
+            evaluate_flows(fan_csv, dirs['vectorized'], dirs['models'], apps, os.path.join(tmp_dir, "eval.csv"),
+                           categorical_cols, numeric_cols)
+
+        _, m = _measure("evaluate_flows", n_rows, evaluate_all, measure_memory=measure_memory)
+        results.append(m)
+
+    return results
+
+
+def benchmark_knn_index(n_train: int = 20_000, n_queries: int = 20_000, n_ips: int = 500, n_neighbors: int = 5,
+                        n_probes=(1, 2, 4, 8, 16), oversample: int = 4, sparse: bool = False,
+                        seed: int = 42) -> list[dict]:
+    """
+    Débit de scoring du k-NN selon l'index de voisinage, comparé à la Random Forest, sur des flux synthétiques
+    vectorisés comme en entraînement (one-hot compris). Le rappel est la part des k plus proches voisins exacts
+    (index 'brute') retrouvés par l'index approché.
+
+    :param n_probes: valeurs de n_probes testées pour l'index 'ivf'
+    :param oversample: oversample de l'index 'ball_tree'
+    :return: liste de dict (modèle, flux/s, rappel, accuracy relative au k-NN exact)
+    """
+    rng = np.random.default_rng(seed)
+    flows = generate_nfstream_flows(n_train + n_queries, n_ips, seed=seed)
+    # Le fan n'influe pas sur le coût du scoring : valeurs tirées au hasard plutôt que add_fan_features
+    flows['fan_in'] = rng.integers(1, 50, len(flows))
+    flows['fan_out'] = rng.integers(1, 50, len(flows))
+    flows['label'] = rng.integers(0, 2, len(flows))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        vectorized = vectorize_flows(flows, get_categorical_cols(), get_numeric_cols(), label_col='label',
+                                     scaler_path=os.path.join(tmp_dir, 'scaler.joblib'),
+                                     one_hot_encoder_path=os.path.join(tmp_dir, 'ohe.joblib'), sparse=sparse)
+    if sparse:
+        X, _, y = vectorized
+    else:
+        y = vectorized['label'].to_numpy()
+        X = vectorized.drop(columns=['label']).to_numpy(dtype=np.float32)
+    X_train, X_query, y_train = X[:n_train], X[n_train:], y[:n_train]
+    print(f"k-NN : {X.shape[1]} colonnes, {n_train} flux d'entraînement, {n_queries} flux à scorer")
+
+    def score(name, model, reference=None):
+        start = time.perf_counter()
+        if isinstance(model, ApproxKNeighborsClassifier):
+            _, indices = model.kneighbors(X_query)
+            preds = model.classes_[np.argmax(model.predict_proba(X_query), axis=1)]
+        else:
+            indices = None
+            preds = model.predict(X_query)
+        seconds = time.perf_counter() - start
+        row = {'model': name, 'flows_per_s': n_queries / seconds, 'recall': None, 'agreement': None}
+        if reference is not None and indices is not None:
+            ref_indices, ref_preds = reference
+            row['recall'] = float(np.mean([len(np.intersect1d(a, b)) / len(a) for a, b in zip(ref_indices, indices)]))
+            row['agreement'] = float(np.mean(preds == ref_preds))
+        recall = f"{row['recall']:.3f}" if row['recall'] is not None else "-"
+        print(f"{name:<28} {row['flows_per_s']:>12.0f} flux/s  rappel {recall}")
+        return row, indices, preds
+
+    results = []
+    rf = RandomForestClassifier(n_estimators=100, max_depth=20, random_state=seed).fit(X_train, y_train)
+    results.append(score("rf", rf)[0])
+    exact = ApproxKNeighborsClassifier(n_neighbors, index='brute').fit(X_train, y_train)
+    row, ref_indices, ref_preds = score("knn brute", exact)
+    results.append(row)
+    approx = ApproxKNeighborsClassifier(n_neighbors, index='ivf').fit(X_train, y_train)
+    for n_probe in n_probes:
+        approx.set_params(n_probes=n_probe)
+        results.append(score(f"knn ivf n_probes={n_probe}", approx, (ref_indices, ref_preds))[0])
+    approx = ApproxKNeighborsClassifier(n_neighbors, index='ball_tree', oversample=oversample).fit(X_train, y_train)
+    results.append(score(f"knn ball_tree x{oversample}", approx, (ref_indices, ref_preds))[0])
+    return results
+
+
+def benchmark_forest_inference(test_csv: str = None, train_vectorized_dir: str = None, models_dir: str = None,
+                               n_rows: int = 20_000, batch_sizes=(1, 16, 256, 4096), seed: int = 42) -> list[dict]:
+    """
+    Débit de scoring de la Random Forest compilée (compiled_forest) comparé à sklearn (predict_proba en un appel),
+    par taille de lot, avec test de parité des labels et probabilités.
+
+    Sur une trace de test (test_csv, avec les dossiers vectorisé et modèles rf de l'entraînement), les flux de chaque
+    application sont vectorisés par son ModelBundle ; sinon, flux synthétiques et forêt entraînée sur place.
+
+    :param n_rows: nombre maximum de flux scorés par application et par taille de lot
+    :return: liste de dict (application, taille de lot, flux/s sklearn, flux/s compilé, parité)
+    """
+    cases = []
+    if test_csv is not None:
+        test_df = pd.read_csv(test_csv, on_bad_lines='skip')
+        for app_name, subset_df in test_df.groupby('application_name', sort=False):
+            bundle = get_bundle(app_name, train_vectorized_dir, models_dir, get_categorical_cols(), get_numeric_cols())
+            if bundle is None or bundle.forest is None or len(bundle.model.classes_) < 2:
+                continue
+            X = bundle.vectorize(subset_df.head(n_rows).copy())
+            cases.append((app_name, bundle.model, bundle.forest, X))
+    else:
+        rng = np.random.default_rng(seed)
+        X = pd.DataFrame(rng.normal(size=(2 * n_rows, 40)), columns=[f"f{i}" for i in range(40)])
+        y = (X['f0'] + X['f1'] * X['f2'] > 0).astype(int)
+        model = RandomForestClassifier(n_estimators=100, max_depth=20, random_state=seed).fit(X[:n_rows], y[:n_rows])
+        cases.append(("synthétique", model, CompiledForest.from_sklearn(model), X[n_rows:]))
+
+    results = []
+    for app_name, model, forest, X in cases:
+        parity = check_parity(model, X, forest)
+        print(f"{app_name} : {len(X)} flux, parité {'ok' if parity['ok'] else 'ÉCHEC'} "
+              f"({parity['label_mismatches']} labels différents, écart max des probas {parity['max_proba_diff']:.2e})")
+        for batch_size in batch_sizes:
+            # DataFrames, comme dans ModelBundle.predict
+            batches = [X.iloc[start:start + batch_size] for start in range(0, len(X), batch_size)]
+            timings = {}
+            for name, predict in (('sklearn', model.predict_proba), ('compiled', forest.predict_with_proba)):
+                start = time.perf_counter()
+                for batch in batches:
+                    predict(batch)
+                timings[name] = len(X) / (time.perf_counter() - start)
+            print(f"  lots de {batch_size:>5} : sklearn {timings['sklearn']:>10.0f} flux/s, "
+                  f"compilé {timings['compiled']:>10.0f} flux/s")
+            results.append({'application': app_name, 'batch_size': batch_size, 'sklearn_flows_per_s': timings['sklearn'],
+                            'compiled_flows_per_s': timings['compiled'], 'parity': parity['ok']})
+    return results
+
+
+def save_baseline(results: list[dict], path: str = DEFAULT_BASELINE, params: dict = None):
+    """
+    Enregistre les mesures comme référence (JSON : étape -> mesures).
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'params': params or {}, 'stages': {r['stage']: r for r in results}}, f, indent=1)
+    print(f"Référence enregistrée : {path}")
+
+
+def compare_to_baseline(results: list[dict], path: str = DEFAULT_BASELINE, tolerance: float = 0.2) -> list[dict]:
+    """
+    Compare les mesures à la référence : une étape régresse si son débit baisse, ou si son pic mémoire
+    augmente, de plus de tolerance (en proportion).
+
+    :return: liste des régressions (étape, métrique, référence, mesure)
+    """
+    with open(path, encoding='utf-8') as f:
+        baseline = json.load(f)['stages']
+
+    regressions = []
+    for r in results:
+        ref = baseline.get(r['stage'])
+        if ref is None:
+            continue
+        if ref['flows_per_s'] and r['flows_per_s'] is not None and r['flows_per_s'] < ref['flows_per_s'] * (1 - tolerance):
+            regressions.append({'stage': r['stage'], 'metric': 'flows_per_s',
+                                'baseline': ref['flows_per_s'], 'value': r['flows_per_s']})
+        if ref['peak_mem_mb'] and r['peak_mem_mb'] is not None and r['peak_mem_mb'] > ref['peak_mem_mb'] * (1 + tolerance):
+            regressions.append({'stage': r['stage'], 'metric': 'peak_mem_mb',
+                                'baseline': ref['peak_mem_mb'], 'value': r['peak_mem_mb']})
+
+    for reg in regressions:
+        print(f"RÉGRESSION {reg['stage']} {reg['metric']} : {reg['baseline']:.1f} -> {reg['value']:.1f}")
+    if not regressions:
+        print(f"Aucune régression par rapport à {path} (tolérance {tolerance:.0%})")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks des étapes du pipeline sur des flux synthétiques")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--ips", type=int, default=500, help="nombre d'adresses IP distinctes")
+    parser.add_argument("--flows-per-s", type=float, default=50.0, help="densité temporelle des flux")
+    parser.add_argument("--train-rows", type=int, default=2000)
+    parser.add_argument("--model", default="rf", choices=["rf", "nb", "knn"])
+    parser.add_argument("--no-memory", action="store_true", help="ne mesure pas le pic mémoire (tracemalloc)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="enregistre les mesures comme référence")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--fan", action="store_true", help="compare aussi l'ancien et le nouveau calcul du fan")
+    parser.add_argument("--knn", action="store_true",
+                        help="compare aussi le débit de scoring du k-NN (exact et approché) à celui de la RF")
+    parser.add_argument("--forest", action="store_true",
+                        help="compare aussi la Random Forest compilée à sklearn (sur --trace si renseignée)")
+    parser.add_argument("--trace", default=None, help="trace de test (CSV 2.fan) pour --forest")
+    parser.add_argument("--vectorized-dir", default="../dataset_train/csv/5.vectorized")
+    parser.add_argument("--models-dir", default="../models/rf")
+    args = parser.parse_args()
+
+    if args.fan:
+        benchmark_fan_features()
+    if args.knn:
+        benchmark_knn_index()
+    if args.forest:
+        benchmark_forest_inference(args.trace, args.vectorized_dir, args.models_dir)
+    results = benchmark_stages(args.rows, args.ips, flows_per_s=args.flows_per_s, train_rows=args.train_rows,
+                               model_type=args.model, measure_memory=not args.no_memory)
+    if args.save_baseline:
+        save_baseline(results, args.baseline, vars(args))
+    elif os.path.exists(args.baseline):
+        regressions = compare_to_baseline(results, args.baseline, args.tolerance)
+        if regressions:
+            raise SystemExit(1)
@@ -1,23 +1,83 @@
-import os
-
 import numpy as np
 import pandas as pd
-from joblib import load
 
-from SP4.tools import get_app_list, get_categorical_cols, get_numeric_cols, subset_divizor
-from SP4.vectorization import vectorize_flows
+from SP4.storage import list_tables, read_table
+from SP4.tools import get_app_list, get_categorical_cols, get_numeric_cols, split_by_application
+from SP4.model_bundle import get_bundle
+
+# Clé de jointure flow_file <-> flux du dossier 2.fan
+FLOW_KEY_COLS = [
+    "first_seen_ms", "last_seen_ms",
+    "src_ip", "src_port", "dst_ip", "dst_port",
+    "protocol"
+]
+FLOW_IP_COLS = ("src_ip", "dst_ip")
+
+# Valeur d'une composante de clé manquante (colonne absente, texte non numérique...)
+MISSING_KEY = -1
+
+
+def read_fan_flows(flows_folder: str) -> pd.DataFrame:
+    """
+    Lit tous les fichiers de flux d'un dossier (csv ou parquet, triés par nom) et les concatène en une seule fois.
+    """
+    tables = list_tables(flows_folder)
+    if not tables:
+        return pd.DataFrame(columns=FLOW_KEY_COLS)
+    return pd.concat([read_table(path) for path in tables], ignore_index=True)
+
 
+def normalize_flow_keys(df: pd.DataFrame, keys=FLOW_KEY_COLS) -> pd.MultiIndex:
+    """
+    Clé de jointure normalisée de chaque ligne : horodatages arrondis à la milliseconde (1.6e12 lu en float
+    et 1600000000000 lu en int donnent la même clé), ports et protocole en entiers (MISSING_KEY si manquants),
+    IP en texte sans espaces ("" si manquantes). Les IP ne sont pas converties par ip_tools : la jointure
+    n'a besoin que de l'égalité des textes, hachés une seule fois par valeur distincte par le MultiIndex.
+    :return: MultiIndex (une entrée par ligne de df, dans l'ordre)
+    """
+    arrays = []
+    for col in keys:
+        if col not in df.columns:
+            arrays.append(np.full(len(df), MISSING_KEY, dtype=np.int64))
+        elif col in FLOW_IP_COLS:
+            arrays.append(df[col].where(df[col].notna(), "").astype(str).str.strip().to_numpy())
+        else:
+            values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64)
+            arrays.append(np.where(np.isnan(values), MISSING_KEY, np.round(values)).astype(np.int64))
+    return pd.MultiIndex.from_arrays(arrays, names=list(keys))
+
+
+def match_flows(flow_keys: pd.MultiIndex, fan_keys: pd.MultiIndex, priority=None) -> tuple[np.ndarray, int]:
+    """
+    Index de hachage des clés des flux 2.fan, interrogé pour chaque ligne du flow_file.
+    Une clé présente plusieurs fois côté 2.fan n'est indexée qu'une fois (la première ligne, après tri
+    stable par priority décroissante) : chaque ligne du flow_file correspond à au plus un flux,
+    la jointure ne peut donc pas multiplier les lignes.
 
-def match_and_predict_flowfile():
+    :param priority: booléens par ligne de 2.fan, les lignes True sont préférées en cas de doublon
+    :return: (position du flux correspondant dans 2.fan ou -1, nombre de doublons ignorés)
     """
-    Lis un flow_file (FLOW_FILE_1.csv), fait un merge avec
-    les CSV du dossier 2.fan, applique la pipeline de séparation
+    order = np.arange(len(fan_keys))
+    if priority is not None:
+        order = order[np.argsort(~np.asarray(priority, dtype=bool), kind='stable')]
+    fan_keys = fan_keys[order]
+    first = ~fan_keys.duplicated(keep='first')
+    positions = fan_keys[first].get_indexer(flow_keys)
+    return np.where(positions >= 0, order[first][positions], -1), int((~first).sum())
+
+
+def match_and_predict_flowfile(multi_match='first'):
+    """
+    Lis un flow_file (FLOW_FILE_1.csv), l'associe aux flux du dossier 2.fan
+    (une correspondance au plus par ligne, voir match_flows), applique la pipeline de séparation
     + vectorisation + prédiction, puis réinjecte les résultats
-    (lab, proba_1) dans le flow_file initial.
+    (lab, proba_suspicious) dans le flow_file initial (même nombre de lignes, même ordre).
 
     On suppose que:
       - La séparation (étape 4) se base sur "application_name".
       - On a un fallback "unknown" si la 'application_name' est manquante.
+      - Un flux correspondant à plusieurs applications est affecté selon multi_match
+        (voir tools.MULTI_MATCH_RULES), il n'est donc scoré qu'une fois.
     """
 
     flow_file_path = "../FLOW_FILE_1.csv"
@@ -34,148 +94,92 @@ def match_and_predict_flowfile():
     print("[INFO] Lecture de", flow_file_path)
     flow_file_df = pd.read_csv(flow_file_path)
 
-    # 2) Concaténer tous les CSV du dossier flows_folder
+    # 2) Concaténer tous les fichiers du dossier flows_folder, en une seule fois
     #    On suppose qu'ils partagent le même format de colonnes.
-    print("[INFO] Concaténation des CSV de", flows_folder)
-    big_flows_df = pd.DataFrame()
-    for csv_name in os.listdir(flows_folder):
-        if csv_name.endswith(".csv"):
-            temp_path = os.path.join(flows_folder, csv_name)
-            temp_df = pd.read_csv(temp_path)
-            big_flows_df = pd.concat([big_flows_df, temp_df], ignore_index=True)
-
-    # 3) Merge (ou join) sur les colonnes clés
-    #    => adaptables selon l'entête que tu utilises vraiment
-    merge_keys = [
-        "first_seen_ms", "last_seen_ms",
-        "src_ip", "src_port", "dst_ip", "dst_port",
-        "protocol"
-    ]
-    # On s'assure que ces colonnes existent dans les 2 DataFrames
-    for mk in merge_keys:
-        if mk not in flow_file_df.columns:
-            flow_file_df[mk] = np.nan
-        if mk not in big_flows_df.columns:
-            big_flows_df[mk] = np.nan
-
-    print("[INFO] Fusion des données (merge) sur les clefs :", merge_keys)
-    merged_df = flow_file_df.merge(
-        big_flows_df,
-        how="left",  # ou "inner" si on veut uniquement les matches
-        on=merge_keys
-    )
-    dict_of_separated_df = {}
+    print("[INFO] Concaténation des fichiers de", flows_folder)
+    big_flows_df = read_fan_flows(flows_folder)
+
+    # 3) Correspondance sur la clé normalisée (FLOW_KEY_COLS) : position du flux 2.fan de chaque ligne
+    #    du flow_file. En cas de doublon côté 2.fan, les flux dont l'application est connue sont préférés
+    print("[INFO] Correspondance des flux sur les clefs :", FLOW_KEY_COLS)
+    has_app = big_flows_df["application_name"].notna() if "application_name" in big_flows_df.columns else None
+    fan_positions, nb_duplicates = match_flows(normalize_flow_keys(flow_file_df), normalize_flow_keys(big_flows_df),
+                                               priority=has_app)
+    matched = fan_positions >= 0
+    print(f"[INFO] {int(matched.sum())}/{len(flow_file_df)} flux retrouvés ({nb_duplicates} doublons 2.fan ignorés)")
+
+    # merged_df : ligne i = ligne i du flow_file, complétée par les colonnes de son flux 2.fan
+    # (valeurs manquantes pour les flux sans correspondance, position -1)
+    fan_cols = [col for col in big_flows_df.columns if col not in FLOW_KEY_COLS]
+    fan_rows = big_flows_df[fan_cols].reset_index(drop=True).reindex(fan_positions).reset_index(drop=True)
+    own_cols = [col for col in flow_file_df.columns if col not in fan_cols]
+    merged_df = pd.concat([flow_file_df[own_cols].reset_index(drop=True), fan_rows], axis=1)
+
     # 4) Gérer l'application_name manquante => "unknown"
     if "application_name" not in merged_df.columns:
         merged_df["application_name"] = "unknown"
-    else:
-        dict_of_separated_df = subset_divizor(merged_df, app_names, "application_name", True)
-
-    # 5) Prédiction pour chaque application
-    result_records = []
+    # Découpage en une passe : positions des lignes de chaque application (+ "unknown")
+    split = split_by_application(merged_df, app_names, "application_name", multi_match, with_unknown=True)
 
-    # On ajoute la classe "unknown" pour tout flux non matché
+    # 5) Prédiction pour chaque application, écrite directement à la position de chaque ligne
+    #    (avec multi_match='all', la dernière application scorée l'emporte)
+    label_pred = np.full(len(merged_df), np.nan)
+    proba_1 = np.full(len(merged_df), np.nan)
 
     for app_name in full_app_list:
-        subset_app = dict_of_separated_df.get(app_name)
-        if subset_app.empty:
+        positions = split[app_name]
+        if len(positions) == 0:
             continue
+        subset_app = merged_df.iloc[positions]
 
-        # Indices
-        subset_idx = subset_app.index
-
-        # Fichier(s) model + scaler + encoder
+        # Bundle model + scaler + encoder, chargé une seule fois par application
         # => S'il n'y en a pas pour "unknown", on met par défaut
-        app_dir = os.path.join(train_vectorized_dir, app_name)
-        model_path = os.path.join(models_dir, app_name, f"model_{app_name}.joblib")
-        scaler_path = os.path.join(app_dir, "scaler.joblib")
-        encoder_path = os.path.join(app_dir, "ohe.joblib")
+        try:
+            bundle = get_bundle(app_name, train_vectorized_dir, models_dir, categorical_cols, numeric_cols)
+        except Exception as load_e:
+            print("[ERROR] Model loading failed for", app_name, ":", load_e)
+            label_pred[positions], proba_1[positions] = -3, 0.0
+            continue
 
-        if not os.path.exists(model_path):
+        if bundle is None:
             # pas de modèle => on met un label et proba par défaut
-            for idx in subset_idx:
-                # -1 => inconnu, 0.0 => proba nulle, ou comme tu veux
-                result_records.append((idx, -1, 0.0))
+            # -1 => inconnu, 0.0 => proba nulle
+            label_pred[positions], proba_1[positions] = -1, 0.0
             continue
 
-        # 6) Vectorisation : is_test=True
+        # 6) Vectorisation : is_test=True, alignée sur les features du modèle (correspondance précalculée)
         try:
-            X = vectorize_flows(
-                df=subset_app,
-                categorical_cols=categorical_cols,
-                numeric_cols=numeric_cols,
-                label_col=None,
-                scaler_path=scaler_path,
-                one_hot_encoder_path=encoder_path,
-                is_test=True
-            )
+            X = bundle.vectorize(subset_app.copy())
         except Exception as vec_e:
             print("[ERROR] Vectorization failed for", app_name, ":", vec_e)
             # On met un label par défaut
-            for idx in subset_idx:
-                result_records.append((idx, -2, 0.0))
+            label_pred[positions], proba_1[positions] = -2, 0.0
             continue
 
-        # B0) On aligne X sur le modèle
         try:
-            model = load(model_path)
-            train_features = model.feature_names_in_
-            # Ajouter colonnes manquantes
-            missing_features = [col for col in train_features if col not in X.columns]
-            for col in missing_features:
-                X[col] = 0
-            # Retirer colonnes en trop
-            extra_features = [col for col in X.columns if col not in train_features]
-            if extra_features:
-                X.drop(columns=extra_features, inplace=True)
-            # Réordonner
-            X = X[train_features]
-
-            # 7) Prédiction
-            preds = model.predict(X)
-            if len(model.classes_) == 1:
-                # Modèle entraîné sur une seule classe
-                # => predict_proba => shape (N,1)
-                # Choix : forcer la proba = 0 ou 1
-                # (Ajuste selon la classe = 0 ou 1)
-                probas = np.zeros(len(X))
-            else:
-                probas = model.predict_proba(X)[:, 1]
-
-            # 8) Stockage
-            for row_idx, label_pred, proba_pred in zip(subset_idx, preds, probas):
-                result_records.append((row_idx, int(label_pred), float(proba_pred)))
+            # 7) Prédiction (label et proba en un seul passage)
+            preds, probas = bundle.predict(X)
+
+            # 8) Stockage : l'index de X est la position dans merged_df (lignes écartées par le nettoyage : NaN)
+            label_pred[X.index.to_numpy()] = preds
+            proba_1[X.index.to_numpy()] = probas
 
         except Exception as model_e:
             print("[ERROR] Prediction failed for", app_name, ":", model_e)
-            for idx in subset_idx:
-                result_records.append((idx, -3, 0.0))
-
-    # 9) Rassembler tous les résultats dans l'ordre du merged_df
-    results_df = pd.DataFrame(result_records, columns=["idx", "label_pred", "proba_1"])
-    results_df.set_index("idx", inplace=True)
-
-    merged_df = merged_df.join(results_df, how="left")
+            label_pred[positions], proba_1[positions] = -3, 0.0
 
-    # 10) Revenir au flow_file_df (même nombre de lignes, même ordre),
-    #     on recopie label_pred et proba_1
-    flow_file_df = flow_file_df.join(
-        merged_df[["label_pred", "proba_1"]],
-        how="left"
-    )
+    # 9) Revenir au flow_file_df (même nombre de lignes, même ordre), on recopie label_pred et proba_1
+    flow_file_df["label_pred"] = pd.array(label_pred, dtype="Int64")
+    flow_file_df["proba_1"] = proba_1
 
-    # On complète 'lab' uniquement si c'était '?'
+    # 10) On complète 'lab' uniquement si c'était '?'
     if "lab" not in flow_file_df.columns:
         flow_file_df["lab"] = flow_file_df["label_pred"]
     else:
-        flow_file_df["lab"] = flow_file_df.apply(
-            lambda row: row["label_pred"]
-            if (str(row["lab"]) == "?" and not pd.isna(row["label_pred"]))
-            else row["lab"],
-            axis=1
-        )
+        to_fill = (flow_file_df["lab"].astype(str) == "?") & flow_file_df["label_pred"].notna()
+        flow_file_df["lab"] = flow_file_df["lab"].astype(object).mask(to_fill, flow_file_df["label_pred"].astype(object))
 
     # 11) Sauvegarde finale
     flow_file_df.rename(columns={"proba_1": "proba_suspicious"}, inplace=True)
     flow_file_df.to_csv(output_file, index=False)
-    print(f"[DONE] Fichier de sortie généré : {output_file}")
\ No newline at end of file
+    print(f"[DONE] Fichier de sortie généré : {output_file}")
@@ -0,0 +1,241 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from joblib import load
+
+# Extension du modèle compilé, écrit à côté de model_<APP>.joblib (voir export_forest)
+COMPILED_EXT = '.forest.npz'
+
+# Nombre de flux parcourus ensemble (taille des tableaux (flux x arbres) d'un lot)
+BATCH_SIZE = 8192
+
+# Au-delà de ce nombre de flux, le parcours compilé de sklearn (predict_proba en un appel) reprend l'avantage :
+# le parcours vectorisé supprime le surcoût fixe d'un appel sklearn (~3 à 20 ms selon la forêt), décisif
+# pour les petits lots (micro-batching, scoring_service), mais coûte plus cher par flux
+# (mesures : benchmark.benchmark_forest_inference)
+COMPILED_MAX_ROWS = 256
+
+# Fréquence (en niveaux) à laquelle les couples (flux, arbre) arrivés sur une feuille sont retirés du parcours
+COMPACT_EVERY = 3
+
+
+def _float32_floor(threshold: np.ndarray) -> np.ndarray:
+    """
+    Plus grand float32 inférieur ou égal à chaque seuil (float64) : pour une feature float32 x,
+    x <= seuil équivaut à x <= _float32_floor(seuil), la comparaison se fait donc entièrement en float32.
+    """
+    threshold32 = threshold.astype(np.float32)
+    above = threshold32.astype(np.float64) > threshold
+    threshold32[above] = np.nextafter(threshold32[above], np.float32(-np.inf))
+    return threshold32
+
+
+class CompiledForest:
+    """
+    Forêt aléatoire sklearn aplatie en tableaux NumPy (feature, seuil, fils gauche/droit de tous les nœuds
+    de tous les arbres), évaluée par parcours vectorisé : à chaque niveau, tous les couples (flux, arbre)
+    encore en cours avancent d'un nœud en une seule opération. Les feuilles bouclent sur elles-mêmes,
+    le parcours s'arrête quand tous les couples ont atteint une feuille.
+
+    Label et probabilité sont obtenus en un seul parcours (predict_with_proba), avec les mêmes résultats que
+    predict / predict_proba de sklearn. Expose classes_ et feature_names_in_ comme le modèle d'origine.
+    """
+
+    def __init__(self, feature, threshold, left, right, leaf_proba, roots, classes, n_features, feature_names=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        # Fils entrelacés : children[2 * nœud] à gauche, children[2 * nœud + 1] à droite (une seule lecture par niveau)
+        self.children = np.empty(2 * len(left), dtype=np.int32)
+        self.children[0::2] = left
+        self.children[1::2] = right
+        self.is_leaf = left == np.arange(len(left))
+        self.leaf_proba = leaf_proba
+        self.roots = roots
+        self.classes_ = classes
+        self.n_features_in_ = n_features
+        if feature_names is not None:
+            self.feature_names_in_ = np.asarray(feature_names, dtype=object)
+
+    @classmethod
+    def from_sklearn(cls, model) -> 'CompiledForest':
+        """
+        Compile une forêt sklearn entraînée (RandomForestClassifier, ExtraTreesClassifier) à une sortie.
+        """
+        if getattr(model, 'n_outputs_', 1) != 1:
+            raise ValueError("Seules les forêts à une sortie peuvent être compilées")
+        features, thresholds, lefts, rights, probas, roots = [], [], [], [], [], []
+        offset = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left < 0
+            # Feuilles : bouclent sur elles-mêmes (feature 0, seuil quelconque)
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(_float32_floor(np.where(is_leaf, np.inf, tree.threshold)))
+            lefts.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+            value = tree.value[:, 0, :]
+            normalizer = value.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0] = 1
+            probas.append(value / normalizer)
+            roots.append(offset)
+            offset += tree.node_count
+
+        return cls(
+            feature=np.concatenate(features).astype(np.int32),
+            threshold=np.concatenate(thresholds),
+            left=np.concatenate(lefts).astype(np.int32),
+            right=np.concatenate(rights).astype(np.int32),
+            leaf_proba=np.concatenate(probas),
+            roots=np.array(roots, dtype=np.int32),
+            classes=model.classes_,
+            n_features=model.n_features_in_,
+            feature_names=getattr(model, 'feature_names_in_', None),
+        )
+
+    def _leaves(self, X: np.ndarray) -> np.ndarray:
+        """
+        :return: feuille atteinte dans chaque arbre, tableau (flux, arbres)
+        """
+        n_rows, n_trees = X.shape[0], len(self.roots)
+        x_flat = X.ravel()
+        leaves = np.empty(n_rows * n_trees, dtype=np.int32)
+        # Couples (flux, arbre) encore en cours de parcours : position dans leaves, nœud courant, début de la ligne
+        positions = np.arange(n_rows * n_trees, dtype=np.int32)
+        nodes = np.tile(self.roots, n_rows)
+        row_starts = np.repeat(np.arange(n_rows, dtype=np.int32) * X.shape[1], n_trees)
+        level = 0
+        while len(positions):
+            go_right = x_flat[row_starts + self.feature[nodes]] > self.threshold[nodes]
+            nodes = self.children[2 * nodes + go_right]
+            level += 1
+            # Les feuilles bouclant sur elles-mêmes, les couples terminés ne sont retirés que tous les COMPACT_EVERY
+            # niveaux (retirer à chaque niveau coûte plus cher que de les faire avancer sur place)
+            if level % COMPACT_EVERY == 0:
+                done = self.is_leaf[nodes]
+                if done.any():
+                    leaves[positions[done]] = nodes[done]
+                    active = ~done
+                    positions, nodes, row_starts = positions[active], nodes[active], row_starts[active]
+        return leaves.reshape(n_rows, n_trees)
+
+    def predict_proba(self, X) -> np.ndarray:
+        # float32 : comme sklearn, les features sont comparées aux seuils après conversion en float32
+        X = np.asarray(X.to_numpy() if isinstance(X, pd.DataFrame) else X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"{self.n_features_in_} features attendues, {X.shape} reçu")
+        proba = np.empty((X.shape[0], len(self.classes_)))
+        for start in range(0, X.shape[0], BATCH_SIZE):
+            leaves = self._leaves(X[start:start + BATCH_SIZE])
+            proba[start:start + BATCH_SIZE] = self.leaf_proba[leaves].mean(axis=1)
+        return proba
+
+    def predict_with_proba(self, X) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Label et probabilités de toutes les classes, en un seul parcours des arbres.
+        :return: (labels, probas (flux x classes))
+        """
+        proba = self.predict_proba(X)
+        return self.classes_[np.argmax(proba, axis=1)], proba
+
+    def predict(self, X) -> np.ndarray:
+        return self.predict_with_proba(X)[0]
+
+    def save(self, path: str) -> str:
+        arrays = {
+            'feature': self.feature,
+            'threshold': self.threshold,
+            'left': self.left,
+            'right': self.right,
+            'leaf_proba': self.leaf_proba,
+            'roots': self.roots,
+            'classes': self.classes_,
+            'n_features': np.array(self.n_features_in_),
+        }
+        if hasattr(self, 'feature_names_in_'):
+            arrays['feature_names'] = np.asarray(self.feature_names_in_, dtype=str)
+        np.savez(path, **arrays)
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> 'CompiledForest':
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(
+                feature=arrays['feature'],
+                threshold=arrays['threshold'],
+                left=arrays['left'],
+                right=arrays['right'],
+                leaf_proba=arrays['leaf_proba'],
+                roots=arrays['roots'],
+                classes=arrays['classes'],
+                n_features=int(arrays['n_features']),
+                feature_names=arrays['feature_names'] if 'feature_names' in arrays else None,
+            )
+
+
+def is_forest(model) -> bool:
+    return hasattr(model, 'estimators_') and all(hasattr(e, 'tree_') for e in model.estimators_) \
+        and hasattr(model, 'classes_')
+
+
+def compiled_path(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + COMPILED_EXT
+
+
+def export_forest(model_path: str) -> str | None:
+    """
+    Compile la forêt model_<APP>.joblib en model_<APP>.forest.npz (ignoré si le modèle n'est pas une forêt).
+    :return: chemin du fichier compilé, ou None
+    """
+    model = load(model_path)
+    if not is_forest(model):
+        return None
+    return CompiledForest.from_sklearn(model).save(compiled_path(model_path))
+
+
+def load_compiled(model_path: str, model=None):
+    """
+    Forêt compilée d'un modèle : model_<APP>.forest.npz s'il est plus récent que le .joblib,
+    sinon compilée depuis model (chargé depuis model_path si None).
+    :return: CompiledForest, ou None si le modèle n'est pas une forêt
+    """
+    export = compiled_path(model_path)
+    if os.path.exists(export) and os.path.getmtime(export) >= os.path.getmtime(model_path):
+        return CompiledForest.load(export)
+    if model is None:
+        model = load(model_path)
+    return CompiledForest.from_sklearn(model) if is_forest(model) else None
+
+
+def check_parity(model, X, compiled: CompiledForest = None, atol=1e-9) -> dict:
+    """
+    Test de parité : compare la forêt compilée aux sorties de sklearn (predict et predict_proba) sur les flux X.
+    :param model: forêt sklearn d'origine
+    :param compiled: forêt compilée à vérifier (compilée depuis model si None)
+    :return: dict (nombre de flux, labels différents, écart maximal des probabilités, parité)
+    """
+    compiled = compiled or CompiledForest.from_sklearn(model)
+    labels, proba = compiled.predict_with_proba(X)
+    ref_labels, ref_proba = model.predict(X), model.predict_proba(X)
+    result = {
+        'rows': len(labels),
+        'label_mismatches': int(np.sum(labels != ref_labels)),
+        'max_proba_diff': float(np.max(np.abs(proba - ref_proba))) if len(labels) else 0.0,
+    }
+    result['ok'] = result['label_mismatches'] == 0 and result['max_proba_diff'] <= atol
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compile les Random Forest models/rf/<APP>/model_<APP>.joblib")
+    parser.add_argument("models_dir", nargs="?", default="../models/rf")
+    args = parser.parse_args()
+
+    for app_name in sorted(os.listdir(args.models_dir)):
+        path = os.path.join(args.models_dir, app_name, f"model_{app_name}.joblib")
+        if os.path.exists(path):
+            print(f"{app_name} : {export_forest(path)}")
@@ -1,6 +1,7 @@
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from sklearn.model_selection import train_test_split, KFold, GridSearchCV
-from sklearn.neighbors import KNeighborsClassifier
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score, recall_score, precision_score, f1_score, roc_auc_score, roc_curve
@@ -9,6 +10,18 @@ import os
 import matplotlib.pyplot as plt
 from sklearn.preprocessing import MinMaxScaler
 
+from hyperparameter_search import RF_PARAM_DISTRIBUTIONS, refit_apps, search_apps
+from neighbors import DEFAULT_KNN_INDEX, ApproxKNeighborsClassifier
+
+# Grille de la Random Forest (search='grid')
+RF_PARAM_GRID = {
+    'n_estimators': [50, 100],  # Réduit le nombre d'arbres
+    'max_depth': [10, 20],  # Réduit la profondeur maximale
+    'min_samples_split': [2, 5],
+    'min_samples_leaf': [1, 2],
+    'bootstrap': [True]
+}
+
 
 def train(model, vectorized_df, label_col='label', save_path='trained_model.joblib'):
     """
@@ -31,14 +44,81 @@ def train(model, vectorized_df, label_col='label', save_path='trained_model.jobl
     # Sauvegarde du modèle
     dump(model, save_path)
 
-def train_knn(vectorized_df, save_path, label_col='label'):
+def split_features_labels(vectorized, label_col='label'):
+    """
+    Sépare features et labels d'un jeu vectorisé :
+    un DataFrame (colonne label_col), ou le tuple (X creux, feature_names, y) du mode sparse de vectorize_flows.
+    :return: (X, y, feature_names)
+    """
+    if isinstance(vectorized, tuple):
+        X, feature_names, y = vectorized
+        if y is None:
+            raise KeyError(f"Column '{label_col}' not found in the dataset.")
+        return X, np.asarray(y), list(feature_names)
+
+    if label_col not in vectorized.columns:
+        raise KeyError(f"Column '{label_col}' not found in the dataset.")
+    y = vectorized[label_col].values
+    X = vectorized.drop(columns=[label_col])
+    return X, y, list(X.columns)
+
+
+def set_feature_names(model, feature_names):
+    """
+    Un modèle entraîné sur une matrice creuse n'a pas de feature_names_in_ :
+    on les renseigne pour que l'évaluation puisse aligner les colonnes (voir model_bundle).
+    """
+    if not hasattr(model, 'feature_names_in_'):
+        model.feature_names_in_ = np.asarray(feature_names, dtype=object)
+
+
+def minmax_negative_columns(X):
+    """
+    Ramène dans [0, 1] les colonnes contenant des valeurs négatives (MultinomialNB n'accepte que des valeurs positives).
+    Sur une matrice creuse, seules ces colonnes (numériques) sont densifiées ; le one-hot reste creux.
+    """
+    if not sp.issparse(X):
+        if (X < 0).any().any():
+            X = MinMaxScaler().fit_transform(X)
+        return X
+
+    X = X.tocsc()
+    neg_idx = np.flatnonzero(X.min(axis=0).toarray().ravel() < 0)
+    if len(neg_idx) == 0:
+        return X.tocsr()
+    keep_idx = np.setdiff1d(np.arange(X.shape[1]), neg_idx)
+    scaled = MinMaxScaler().fit_transform(X[:, neg_idx].toarray())
+    combined = sp.hstack([X[:, keep_idx], sp.csc_matrix(scaled)], format='csc')
+    # Remettre les colonnes dans leur ordre d'origine
+    order = np.argsort(np.concatenate([keep_idx, neg_idx]))
+    return combined[:, order].tocsr()
+
+
+def train_knn(vectorized_df, save_path, label_col='label', knn_index=None):
     """
     Entraîne un classificateur k-NN sur les données vectorisées en utilisant une recherche d'hyperparamètres.
     - Utilise une validation croisée avec KFold.
     - Effectue une Grid Search pour trouver la meilleure valeur de k.
     - Sauvegarde le modèle avec les meilleurs hyperparamètres.
+    - knn_index : index de voisinage (voir neighbors.ApproxKNeighborsClassifier), DEFAULT_KNN_INDEX si None.
+    """
+    X, y, feature_names = split_features_labels(vectorized_df, label_col)
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    split_save_path = os.path.join(save_path, 'train_test_split_knn.joblib')
+    dump((X_train, X_test, y_train, y_test), split_save_path)
+    print(f"Ensembles train/test sauvegardés à : {split_save_path}")
+
+    return fit_knn(X_train, X_test, y_train, y_test, feature_names, save_path, knn_index)
+
+
+def fit_knn(X_train, X_test, y_train, y_test, feature_names, save_path, knn_index=None):
+    """
+    Grid Search du k-NN sur un découpage train/test déjà calculé (voir train_knn et training_session).
+    Le même index de voisinage sert pendant la Grid Search et dans le modèle sauvegardé.
+    :return: (modèle, meilleurs paramètres, meilleur score)
     """
-    knn = KNeighborsClassifier()
+    knn = ApproxKNeighborsClassifier(**(DEFAULT_KNN_INDEX if knn_index is None else knn_index))
 
     param_grid = {
         'n_neighbors': [9, 5],
@@ -46,17 +126,6 @@ def train_knn(vectorized_df, save_path, label_col='label'):
         'metric': ['euclidean']
     }
 
-    if label_col not in vectorized_df.columns:
-        raise KeyError(f"Column '{label_col}' not found in the dataset.")
-
-    y = vectorized_df[label_col].values
-    X = vectorized_df.drop(columns=[label_col])
-
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-    split_save_path = os.path.join(save_path, 'train_test_split_knn.joblib')
-    dump((X_train, X_test, y_train, y_test), split_save_path)
-    print(f"Ensembles train/test sauvegardés à : {split_save_path}")
-
     kf = KFold(n_splits=5, shuffle=True, random_state=42)
 
     grid_search = GridSearchCV(estimator=knn, param_grid=param_grid,
@@ -73,6 +142,7 @@ def train_knn(vectorized_df, save_path, label_col='label'):
         best_model = grid_search.best_estimator_
 
         evaluate(best_model, X_test, y_test, save_path)
+        set_feature_names(best_model, feature_names)
 
         return best_model, best_params, best_score
 
@@ -81,19 +151,8 @@ def train_knn(vectorized_df, save_path, label_col='label'):
         raise e
 
 def train_naive_bayes(vectorized_df, save_path, label_col='label'):
-    if label_col not in vectorized_df.columns:
-        raise KeyError(f"Column '{label_col}' not found in the dataset.")
-
-    y = vectorized_df[label_col].values
-    X = vectorized_df.drop(columns=[label_col])
-
-    if X.isnull().any().any():
-        raise ValueError("Données manquantes détectées.")
-
-    if (X < 0).any().any():
-        # transformation des données pour éliminer les valeurs négatives
-        scaler = MinMaxScaler()
-        X = scaler.fit_transform(X)
+    X, y, feature_names = split_features_labels(vectorized_df, label_col)
+    X = prepare_naive_bayes(X)
 
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
@@ -101,6 +160,26 @@ def train_naive_bayes(vectorized_df, save_path, label_col='label'):
 
     dump((X_train, X_test, y_train, y_test), os.path.join(save_path, 'train_test_split_nb.joblib'))
 
+    return fit_naive_bayes(X_train, X_test, y_train, y_test, feature_names, save_path)
+
+
+def prepare_naive_bayes(X):
+    """
+    Vérifie l'absence de valeurs manquantes et élimine les valeurs négatives (avant le découpage train/test).
+    """
+    if (np.isnan(X.data).any() if sp.issparse(X)
+            else X.isnull().any().any() if isinstance(X, pd.DataFrame) else np.isnan(X).any()):
+        raise ValueError("Données manquantes détectées.")
+
+    # transformation des données pour éliminer les valeurs négatives
+    return minmax_negative_columns(X)
+
+
+def fit_naive_bayes(X_train, X_test, y_train, y_test, feature_names, save_path):
+    """
+    Grid Search du Naive Bayes sur un découpage train/test déjà calculé (données passées par prepare_naive_bayes).
+    :return: (modèle, meilleurs paramètres, meilleur score)
+    """
     kf = KFold(n_splits=5, shuffle=True, random_state=42)
     param_grid = {'alpha': [0.5, 1.0, 2.0]}
     grid_search = GridSearchCV(estimator=MultinomialNB(), param_grid=param_grid,
@@ -111,39 +190,30 @@ def train_naive_bayes(vectorized_df, save_path, label_col='label'):
     best_model = grid_search.best_estimator_
 
     evaluate(best_model, X_test, y_test, save_path)
+    set_feature_names(best_model, feature_names)
     print(f"Meilleurs hyperparamètres : {grid_search.best_params_}")
     return best_model, grid_search.best_params_, grid_search.best_score_
 
 
 
-def train_rf(vectorized_df, save_path, label_col='label'):
+def train_rf(vectorized_df, save_path, label_col='label', search='grid', n_jobs=-1, budget_s=None,
+             max_samples=None, n_candidates=16):
     """
     Entraîne une Random Forest sur les données vectorisées en utilisant une recherche d'hyperparamètres.
     - Utilise une validation croisée avec KFold.
-    - Effectue une Grid Search pour trouver les meilleurs hyperparamètres.
+    - Effectue une Grid Search (search='grid') ou une recherche aléatoire / successive halving
+      avec budget de temps ou d'échantillons (search='random' / 'halving', voir hyperparameter_search).
     - Sauvegarde le modèle avec les meilleurs hyperparamètres.
     - Sauvegarde les ensembles d'entraînement et de test.
     """
+    if search != 'grid':
+        models = train_rf_apps({'app': vectorized_df}, {'app': save_path}, label_col, search, n_jobs, budget_s,
+                               max_samples, n_candidates)
+        model, best_params, best_score, _ = models['app']
+        return model, best_params, best_score
 
-    # Initialisation du modèle Random Forest
-    rf = RandomForestClassifier(random_state=42)
-
-    # Paramètres pour la recherche d'hyperparamètres
-    param_grid = {
-        'n_estimators': [50, 100],  # Réduit le nombre d'arbres
-        'max_depth': [10, 20],  # Réduit la profondeur maximale
-        'min_samples_split': [2, 5],
-        'min_samples_leaf': [1, 2],
-        'bootstrap': [True]
-    }
-
-    # Vérifier la présence de la colonne label
-    if label_col not in vectorized_df.columns:
-        raise KeyError(f"Column '{label_col}' not found in the dataset.")
-
-    # Séparation des features et des labels
-    y = vectorized_df[label_col].values
-    X = vectorized_df.drop(columns=[label_col])
+    # Séparation des features et des labels (DataFrame ou matrice creuse)
+    X, y, feature_names = split_features_labels(vectorized_df, label_col)
 
     # Split en train/test et sauvegarde
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
@@ -151,12 +221,26 @@ def train_rf(vectorized_df, save_path, label_col='label'):
     dump((X_train, X_test, y_train, y_test), split_save_path)
     print(f"Ensembles train/test sauvegardés à : {split_save_path}")
 
+    return fit_rf(X_train, X_test, y_train, y_test, feature_names, save_path, n_jobs)
+
+
+def fit_rf(X_train, X_test, y_train, y_test, feature_names, save_path, n_jobs=-1):
+    """
+    Grid Search de la Random Forest sur un découpage train/test déjà calculé (voir train_rf et training_session).
+    :return: (modèle, meilleurs paramètres, meilleur score)
+    """
+    # Initialisation du modèle Random Forest
+    rf = RandomForestClassifier(random_state=42)
+
+    # Paramètres pour la recherche d'hyperparamètres
+    param_grid = RF_PARAM_GRID
+
     # Configuration de la validation croisée
     kf = KFold(n_splits=5, shuffle=True, random_state=42)
 
     # Grid Search avec validation croisée
     grid_search = GridSearchCV(estimator=rf, param_grid=param_grid,
-                               cv=kf, scoring='accuracy', n_jobs=2, verbose=0)
+                               cv=kf, scoring='accuracy', n_jobs=n_jobs, verbose=0)
 
     try:
         # Exécution de la recherche
@@ -176,6 +260,7 @@ def train_rf(vectorized_df, save_path, label_col='label'):
             evaluate(best_model, X_test, y_test, save_path)
         except Exception as e:
             print(f"Erreur lors de l'évaluation : {e}")
+        set_feature_names(best_model, feature_names)
 
         return best_model, best_params, best_score
 
@@ -183,6 +268,63 @@ def train_rf(vectorized_df, save_path, label_col='label'):
         print(f"Erreur lors de l'entraînement : {e}")
         raise e
 
+
+def train_rf_apps(vectorized_by_app, save_paths, label_col='label', search='halving', n_jobs=-1, budget_s=None,
+                  max_samples=None, n_candidates=16):
+    """
+    Entraîne les Random Forest de plusieurs applications avec une recherche d'hyperparamètres commune :
+    les fits de toutes les applications (candidats x plis) partagent un seul pool de n_jobs workers,
+    puis chaque meilleur candidat est réentraîné sur tout le jeu d'entraînement de son application.
+    Même découpage train/test (et même sauvegarde) que train_rf.
+
+    :param vectorized_by_app: dict application -> données vectorisées (DataFrame ou tuple creux)
+    :param save_paths: dict application -> dossier de sauvegarde
+    :param search: 'random', 'halving' ou 'grid' (voir hyperparameter_search.SEARCH_MODES)
+    :param budget_s: budget de temps de la recherche (toutes applications confondues)
+    :param max_samples: nombre maximum de flux par fit pendant la recherche
+    :return: dict application -> (modèle, meilleurs paramètres, meilleur score, rapport de recherche)
+    """
+    splits = {}
+    for app, vectorized in vectorized_by_app.items():
+        X, y, feature_names = split_features_labels(vectorized, label_col)
+        if isinstance(X, pd.DataFrame):
+            # float32 : format interne des arbres sklearn, et moitié moins de données copiées vers les workers
+            X = X.to_numpy(dtype=np.float32)
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+        split_save_path = os.path.join(save_paths[app], 'train_test_split.joblib')
+        dump((X_train, X_test, y_train, y_test), split_save_path)
+        print(f"Ensembles train/test sauvegardés à : {split_save_path}")
+        splits[app] = (X_train, X_test, y_train, y_test, feature_names)
+
+    return fit_rf_apps(splits, save_paths, search, n_jobs, budget_s, max_samples, n_candidates)
+
+
+def fit_rf_apps(splits, save_paths, search='halving', n_jobs=-1, budget_s=None, max_samples=None, n_candidates=16):
+    """
+    Recherche commune et réentraînement des Random Forest sur des découpages train/test déjà calculés.
+
+    :param splits: dict application -> (X_train, X_test, y_train, y_test, feature_names)
+    :return: dict application -> (modèle, meilleurs paramètres, meilleur score, rapport de recherche)
+    """
+    rf = RandomForestClassifier(random_state=42)
+    param_distributions = RF_PARAM_DISTRIBUTIONS if search != 'grid' else RF_PARAM_GRID
+    train_sets = {app: (split[0], split[2]) for app, split in splits.items()}
+    report = search_apps(train_sets, rf, param_distributions, mode=search, n_candidates=n_candidates,
+                         max_samples=max_samples, budget_s=budget_s, n_jobs=n_jobs)
+    models = refit_apps(train_sets, rf, {app: r['best_params'] for app, r in report.items()}, n_jobs)
+
+    trained = {}
+    for app, (X_train, X_test, y_train, y_test, feature_names) in splits.items():
+        model = models[app]
+        try:
+            evaluate(model, X_test, y_test, save_paths[app])
+        except Exception as e:
+            print(f"Erreur lors de l'évaluation : {e}")
+        set_feature_names(model, feature_names)
+        trained[app] = (model, report[app]['best_params'], report[app]['best_score'], report[app])
+    return trained
+
+
 def evaluate(model, X_test, y_test, save_path):
     """
     Évalue le modèle sur plusieurs métriques et génère une courbe ROC.
@@ -231,17 +373,21 @@ def evaluate(model, X_test, y_test, save_path):
     metrics_df.to_csv(metrics_path, index=False)
     print(f"Métriques sauvegardées à : {metrics_path}")
 
-def evaluate_saved(path):
+def evaluate_saved(path, split=None):
     """
     Charge les ensembles et le modèle sauvegardés, puis évalue le modèle.
 
     Args:
         path (str): Chemin vers le dossier contenant le modèle et les ensembles sauvegardés.
+        split (tuple): (X_train, X_test, y_train, y_test) déjà chargés, ex. TrainingSession.split
+            (les modèles entraînés par une session n'ont pas de train_test_split.joblib).
     """
     # Charger les ensembles train/test
-    split_save_path = os.path.join(path, 'train_test_split.joblib')
-    X_train, X_test, y_train, y_test = load(split_save_path)
-    print(f"Ensembles train/test chargés depuis : {split_save_path}")
+    if split is None:
+        split_save_path = os.path.join(path, 'train_test_split.joblib')
+        split = load(split_save_path)
+        print(f"Ensembles train/test chargés depuis : {split_save_path}")
+    X_train, X_test, y_train, y_test = split[:4]
 
     # Charger le modèle nomme model_{app_name}.joblib
     model_path = os.path.join(path, f"model_{os.path.basename(path)}.joblib")
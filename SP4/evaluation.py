@@ -3,6 +3,8 @@ import numpy as np
 import pandas as pd
 from joblib import load
 from vectorization import vectorize_flows
+from model_bundle import score_flows
+from pcapLoader import stream_fan_features
 
 def evaluate_flows(test_csv_path,
                    train_vectorized_dir,
@@ -10,7 +12,8 @@ def evaluate_flows(test_csv_path,
                    app_names,
                    output_file,
                    categorical_cols,
-                   numeric_cols):
+                   numeric_cols,
+                   knn_index=None):
     """
     Évalue chaque flux d'un fichier CSV de test,
     applique la vectorisation et le modèle correspondant,
@@ -25,84 +28,27 @@ def evaluate_flows(test_csv_path,
         vectorize_func (callable): Fonction de vectorisation (ex. `vectorize_flows_test`).
         categorical_cols (list): Colonnes catégorielles telles qu'au moment du train.
         numeric_cols (list): Colonnes numériques telles qu'au moment du train.
+        knn_index (dict): si les modèles sont des k-NN, index de voisinage utilisé pour le scoring
+            (ex. {'index': 'ball_tree', 'n_components': 16, 'oversample': 2}, voir neighbors.approximate_knn).
+            Le rappel des voisins, et la latence, augmentent avec n_components et oversample.
     """
 
     # 1) Charger le fichier de test entier
     test_df = pd.read_csv(test_csv_path, on_bad_lines='skip')
 
-    # DataFrame final qui contiendra : index original, label prédit, proba
-    result_records = []
-
-    # 2) Pour chaque application connue, on filtre
-    for app_name in app_names:
-        # Sous-ensemble pour cette application
-        subset_df = test_df[test_df["application_name"] == app_name].copy()
-        if subset_df.empty:
-            continue  # Aucune ligne pour cette application
-
-        # 3) Charger les objets (scaler, OHE, modèle) entraînés pour cette application
-        app_vectorized_dir = os.path.join(train_vectorized_dir, app_name)
-        scaler_path = os.path.join(app_vectorized_dir, 'scaler.joblib')
-        encoder_path = os.path.join(app_vectorized_dir, 'ohe.joblib')
-        model_path = os.path.join(models_dir, app_name, f"model_{app_name}.joblib")
-
-        try:
-            model = load(model_path)
-            # 4) Vectoriser l’ensemble des lignes du subset pour cette application
-            X = vectorize_flows(
-                df=subset_df,
-                categorical_cols=categorical_cols,
-                numeric_cols=numeric_cols,
-                label_col=None,  # On n'a pas besoin de label ici
-                scaler_path=scaler_path,
-                one_hot_encoder_path=encoder_path,
-                is_test = True
-            )
-
-            # B0 bricolage, jpp il est 1h du mat
-            missing_features = {"dst2src_bytes.1", "dst2src_packets.1"}
-            for col in missing_features:
-                if col not in X.columns:
-                    X[col] = 0  # on crée la colonne en la mettant à 0
-            train_features = model.feature_names_in_
-            # B1) Ajouter les colonnes manquantes (celles que le modèle a vu au fit mais qui sont absentes dans X)
-            missing_features = [col for col in train_features if col not in X.columns]
-            for col in missing_features:
-                X[col] = 0  # on met du 0 par défaut
-
-            # B2) Supprimer les colonnes en trop (celles qui n’étaient pas connues du modèle)
-            extra_features = [col for col in X.columns if col not in train_features]
-            if extra_features:
-                X.drop(columns=extra_features, inplace=True)
-
-            # B3) Réordonner X pour qu’il soit dans le même ordre que train_features
-            X = X[train_features]
-
-            # 5) Obtenir les prédictions
-            preds = model.predict(X)
-            if len(model.classes_) == 1:
-                probas = np.zeros(len(X))  # ou np.ones(len(X)) selon la classe
-            else:
-                # Cas normal : deux classes
-                probas = model.predict_proba(X)[:, 1]
-
-            # 6) Stoker les résultats
-            #    On sauvegarde (index original, label prédit, proba)
-            for original_idx, label_pred, proba_pred in zip(subset_df.index, preds, probas):
-                result_records.append((original_idx, int(label_pred), float(proba_pred)))
-
-        except Exception as e:
-            raise e
-            print(f"Erreur lors du traitement de l'application '{app_name}': {e}")
-            # Optionnellement, on pourrait ignorer ou lever une exception ici
-            # On peut aussi affecter des prédictions par défaut
-            # pass
-
-    # 7) Remettre le tout dans l'ordre original du CSV
-    #    On trie sur l’index pour retrouver l’ordre d’apparition dans le test_df.
-    result_df = pd.DataFrame(result_records, columns=["original_idx", "label", "proba"])
-    result_df.sort_values(by="original_idx", inplace=True)
-
+    # 2) à 6) Découpage par application, vectorisation et prédiction en une passe.
+    #    Scaler, OHE et modèle de chaque application sont chargés une seule fois (registre de ModelBundle).
+    result_df = score_flows(
+        test_df,
+        app_names,
+        train_vectorized_dir,
+        models_dir,
+        categorical_cols,
+        numeric_cols,
+        knn_index=knn_index
+    )
+
+    # 7) Les résultats sont déjà dans l'ordre original du CSV (triés sur l'index)
     # 8) Sauvegarder dans un CSV final (seulement label et proba, ou plus si besoin)
     result_df[["label", "proba"]].to_csv(output_file, index=False)
     print(f"Résultats sauvegardés dans : {output_file}")
@@ -111,6 +57,55 @@ def evaluate_flows(test_csv_path,
 
 
 
+def evaluate_index(index_name,
+                   train_vectorized_dir,
+                   models_dir,
+                   app_names,
+                   output_file,
+                   categorical_cols,
+                   numeric_cols,
+                   start_ms=None,
+                   end_ms=None,
+                   applications=None,
+                   time_window=60,
+                   batch_size=5000,
+                   knn_index=None):
+    """
+    Comme evaluate_flows, mais directement sur les flux indexés dans Elasticsearch (index pcap-flows),
+    lus par blocs (OLD_SP.es_module.export_flows) sans passer par un CSV. Le fichier de sortie est écrit
+    bloc par bloc : id du flux, application, label, proba.
+
+    Args:
+        index_name (str): Index Elasticsearch des flux.
+        start_ms, end_ms (int): Période des flux à évaluer ([start_ms, end_ms[ sur bidirectional_first_seen_ms).
+        applications (list): Applications à évaluer (toutes celles de app_names si None).
+        time_window (int): Fenêtre (en secondes) de fan_in / fan_out, recalculés par blocs (stream_fan_features)
+            sur tous les flux de la période : le filtre par application est appliqué après ce calcul.
+        batch_size (int): Nombre de flux par page d'export.
+        Les autres paramètres sont ceux de evaluate_flows.
+    """
+    from OLD_SP.es_module import export_flows
+
+    applications = set(applications or app_names)
+    # Flux triés par temps (point-in-time), nécessaire au calcul de fan_in / fan_out par blocs
+    batches = export_flows(index_name, start_ms, end_ms, batch_size=batch_size, method='pit')
+
+    header = True
+    nb_flows = 0
+    for batch in stream_fan_features(batches, time_window):
+        batch = batch[batch['application_name'].isin(applications)]
+        result_df = score_flows(batch, app_names, train_vectorized_dir, models_dir,
+                                categorical_cols, numeric_cols, knn_index=knn_index)
+        result_df = batch[['id', 'application_name']].join(result_df, how='inner')
+        result_df[['id', 'application_name', 'label', 'proba']].to_csv(output_file, mode='w' if header else 'a',
+                                                                       header=header, index=False)
+        header = False
+        nb_flows += len(result_df)
+    if header:
+        pd.DataFrame(columns=['id', 'application_name', 'label', 'proba']).to_csv(output_file, index=False)
+    print(f"{nb_flows} flux évalués, résultats sauvegardés dans : {output_file}")
+
+
 def OLD_evaluate_flows(test_csv_path, train_vectorized_dir, models_dir, app_names, output_file):
     """
     Évalue chaque flux d'un fichier CSV de test, le vectorise, applique le modèle correspondant et génère un fichier de sortie.
@@ -1,60 +1,134 @@
-from SP4 import pcapLoader
+import numpy as np
 import pandas as pd
 
-def q2(csv_path: str):
-
-    # get all the csv files
-    set_of_ips = set()
-    reader = pcapLoader.csv_to_reader(csv_path)
-    for row in reader:
-        set_of_ips.add(row['src_ip'])
-        set_of_ips.add(row['dst_ip'])
-
-        # Charger le fichier CSV dans un DataFrame
-    df = pd.read_csv(csv_path)
-
-    # Convertir les timestamps en format datetime
-    df['first_seen'] = pd.to_datetime(df['bidirectional_first_seen_ms'], unit='ms')
-    df['last_seen'] = pd.to_datetime(df['bidirectional_last_seen_ms'], unit='ms')
-
-    # On utilise le timestamp de 'first_seen' comme point de départ pour l'intervalle
-    df.set_index('first_seen', inplace=True)
-
-    # construction de la structure de données de résultat
-    # {ips:[
-    #   ipi: {
-    #       intervalles: [
-    #       {nb_distinct_connected_ips: int, cumulated_payload: int}, # intervalle 1
-    #       {nb_distinct_connected_ips: int, cumulated_payload: int}, # intervalle 2
-    #       ...
-    #       ]
-    #   }
-    # ]}
-    ip_data = {}
-    i = 0
-    for ipi in set_of_ips:
-        ip_data[ipi] = {
-            "intervalles": []
+# Colonnes lues pour l'activité des IP (le reste du CSV n'est pas chargé)
+ACTIVITY_COLS = ['src_ip', 'dst_ip', 'bidirectional_first_seen_ms',
+                 'bidirectional_bytes', 'src2dst_bytes', 'dst2src_bytes']
+
+# Fenêtres des agrégations multi-échelles (ip_activity_rollups)
+DEFAULT_WINDOWS = ('1min', '5min', '1h')
+
+
+def window_ms(window) -> int:
+    """
+    Taille d'une fenêtre en millisecondes (pd.Timedelta, texte '5min', '1h'... ou entier en ms).
+    """
+    if isinstance(window, (int, np.integer)):
+        return int(window)
+    return int(pd.Timedelta(window) // pd.Timedelta(milliseconds=1))
+
+
+def flow_edges(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Éclate chaque flux en arêtes (ip, peer) : une pour la source, une pour la destination
+    (une seule si src_ip == dst_ip, le flux n'est compté qu'une fois pour cette IP).
+    Le payload d'un flux est bidirectional_bytes + src2dst_bytes + dst2src_bytes, comme dans q2.
+
+    :return: DataFrame (ip, peer, first_seen_ms, payload)
+    """
+    payload = (df['bidirectional_bytes'].fillna(0).astype(np.int64)
+               + df['src2dst_bytes'].fillna(0).astype(np.int64)
+               + df['dst2src_bytes'].fillna(0).astype(np.int64)).to_numpy()
+    first_seen = df['bidirectional_first_seen_ms'].to_numpy(dtype=np.int64)
+    src, dst = df['src_ip'].astype(str).to_numpy(), df['dst_ip'].astype(str).to_numpy()
+    other = src != dst
+    return pd.DataFrame({
+        'ip': np.concatenate([src, dst[other]]),
+        'peer': np.concatenate([dst, src[other]]),
+        'first_seen_ms': np.concatenate([first_seen, first_seen[other]]),
+        'payload': np.concatenate([payload, payload[other]]),
+    })
+
+
+def aggregate_edges(edges: pd.DataFrame, window, origin_ms: int) -> pd.DataFrame:
+    """
+    Agrège les arêtes par (ip, intervalle), l'intervalle étant (first_seen_ms - origin_ms) // fenêtre.
+
+    :return: DataFrame à plat, une ligne par couple (ip, intervalle) actif : interval, timestamp (borne haute),
+        nb_distinct_peers (hors ip elle-même), nb_distinct_connected_ips (ip comprise, comme q2),
+        cumulated_payload, nb_flows
+    """
+    size = window_ms(window)
+    interval = (edges['first_seen_ms'].to_numpy() - origin_ms) // size
+    keyed = edges.assign(interval=interval)
+    grouped = keyed.groupby(['ip', 'interval'], sort=True)
+    flat = grouped.agg(cumulated_payload=('payload', 'sum'), nb_flows=('payload', 'size'))
+    flat['nb_distinct_peers'] = keyed[keyed['peer'] != keyed['ip']].groupby(['ip', 'interval'])['peer'].nunique()
+    flat = flat.fillna({'nb_distinct_peers': 0}).astype({'nb_distinct_peers': np.int64}).reset_index()
+    # q2 comptait l'IP elle-même parmi les IP connectées
+    flat['nb_distinct_connected_ips'] = flat['nb_distinct_peers'] + 1
+    flat['timestamp'] = pd.to_datetime(origin_ms + (flat['interval'] + 1) * size, unit='ms')
+    return flat[['ip', 'interval', 'timestamp', 'nb_distinct_peers', 'nb_distinct_connected_ips',
+                 'cumulated_payload', 'nb_flows']]
+
+
+def ip_activity_rollups(df: pd.DataFrame, windows=DEFAULT_WINDOWS, origin_ms: int = None) -> dict:
+    """
+    Activité par IP et par intervalle de temps pour plusieurs tailles de fenêtre : les flux sont éclatés
+    en arêtes une seule fois, puis agrégés (groupby) pour chaque fenêtre.
+
+    :param windows: tailles de fenêtre (voir window_ms)
+    :param origin_ms: début du premier intervalle (premier first_seen des flux si None)
+    :return: dict fenêtre -> DataFrame à plat (voir aggregate_edges)
+    """
+    if origin_ms is None:
+        origin_ms = int(df['bidirectional_first_seen_ms'].min()) if len(df) else 0
+    edges = flow_edges(df)
+    return {window: aggregate_edges(edges, window, origin_ms) for window in windows}
+
+
+def to_nested(flat: pd.DataFrame, ips, window, origin_ms: int, n_intervals: int) -> dict:
+    """
+    Convertit l'agrégation à plat en la structure de q2 : pour chaque IP, la liste de tous les intervalles
+    (y compris vides : 0 IP connectée, payload nul), timestamp = borne haute de l'intervalle.
+    """
+    ips = list(ips)
+    size = window_ms(window)
+    row = pd.Index(ips).get_indexer(flat['ip'])
+    keep = (row >= 0) & (flat['interval'].to_numpy() < n_intervals)
+    counts = np.zeros((len(ips), n_intervals), dtype=np.int64)
+    payloads = np.zeros((len(ips), n_intervals), dtype=np.int64)
+    counts[row[keep], flat['interval'].to_numpy()[keep]] = flat['nb_distinct_connected_ips'].to_numpy()[keep]
+    payloads[row[keep], flat['interval'].to_numpy()[keep]] = flat['cumulated_payload'].to_numpy()[keep]
+    timestamps = list(pd.to_datetime(origin_ms + (np.arange(n_intervals) + 1) * size, unit='ms'))
+
+    return {
+        ip: {
+            "intervalles": [
+                {"nb_distinct_connected_ips": int(c), "cumulated_payload": int(p), "timestamp": t}
+                for c, p, t in zip(counts[i].tolist(), payloads[i].tolist(), timestamps)
+            ]
         }
-        borne_basse = df.index[0]
-        while borne_basse < df.index[-1]:
-            borne_haute = borne_basse + pd.Timedelta(minutes=5)
-            interval_data = df[(df.index >= borne_basse) & (df.index < borne_haute)]
-            connected_ips = set()
-            payload_size = 0
-            for index, row in interval_data.iterrows():
-                # On vérifie si l'ip est connectée à ipi
-                if row['src_ip'] == ipi or row['dst_ip'] == ipi:
-                    connected_ips.add(row['src_ip'])
-                    connected_ips.add(row['dst_ip'])
-                    payload_size += int(row['bidirectional_bytes']) + int(row['src2dst_bytes']) + int(row['dst2src_bytes'])
-            borne_basse = borne_haute
-
-            ip_data[ipi]["intervalles"].append({
-                "nb_distinct_connected_ips": len(connected_ips),
-                "cumulated_payload": payload_size,
-                "timestamp": borne_haute  # Enregistrer la borne supérieure comme timestamp
-            })
-        i += 1
-
-    return ip_data
\ No newline at end of file
+        for i, ip in enumerate(ips)
+    }
+
+
+def q2(csv_path: str, window='5min', flat=False):
+    """
+    Activité de chaque IP par intervalles de window (5 minutes par défaut) : nombre d'IP distinctes connectées
+    (l'IP elle-même comprise) et payload cumulé.
+
+    Structure de données de résultat :
+    {ipi: {
+        intervalles: [
+            {nb_distinct_connected_ips: int, cumulated_payload: int, timestamp: borne haute}, # intervalle 1
+            ...
+        ]
+    }}
+
+    :param window: taille des intervalles (voir window_ms)
+    :param flat: retourne le DataFrame à plat (intervalles actifs uniquement) au lieu de la structure imbriquée
+    """
+    df = pd.read_csv(csv_path, usecols=ACTIVITY_COLS)
+    if len(df) == 0:
+        return pd.DataFrame() if flat else {}
+
+    first_ms = int(df['bidirectional_first_seen_ms'].min())
+    last_ms = int(df['bidirectional_first_seen_ms'].max())
+    result = ip_activity_rollups(df, [window], first_ms)[window]
+    if flat:
+        return result
+
+    ips = pd.unique(np.concatenate([df['src_ip'].astype(str).to_numpy(), df['dst_ip'].astype(str).to_numpy()]))
+    n_intervals = (last_ms - first_ms) // window_ms(window) + 1
+    return to_nested(result, ips, window, first_ms, n_intervals)
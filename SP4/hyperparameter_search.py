@@ -0,0 +1,224 @@
+import math
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import KFold, ParameterGrid, ParameterSampler
+
+# Modes de recherche d'hyperparamètres :
+#   - 'grid'    : grille exhaustive (GridSearchCV, comportement historique de train_rf)
+#   - 'random'  : n_candidates combinaisons tirées au hasard, évaluées sur toutes les données
+#   - 'halving' : successive halving, les candidats sont évalués sur des sous-échantillons croissants
+#                 et seul le meilleur tiers (factor) passe au tour suivant
+SEARCH_MODES = ('grid', 'random', 'halving')
+
+# Espace de recherche de la Random Forest (la grille historique de train_rf en est un sous-ensemble)
+RF_PARAM_DISTRIBUTIONS = {
+    'n_estimators': [50, 100, 200],
+    'max_depth': [10, 20, 30, None],
+    'min_samples_split': [2, 5, 10],
+    'min_samples_leaf': [1, 2, 4],
+    'bootstrap': [True],
+}
+
+
+def _rows(X, idx):
+    return X.iloc[idx] if isinstance(X, pd.DataFrame) else X[idx]
+
+
+def _fit_and_score(app, candidate, estimator, params, X, y, train_idx, test_idx):
+    """
+    Entraîne un candidat sur un pli (exécuté dans le pool partagé).
+    :return: (application, candidat, accuracy, horodatage de fin)
+    """
+    model = clone(estimator).set_params(**params)
+    model.fit(_rows(X, train_idx), y[train_idx])
+    score = accuracy_score(y[test_idx], model.predict(_rows(X, test_idx)))
+    return app, candidate, score, time.time()
+
+
+def _fit(app, estimator, params, X, y):
+    return app, clone(estimator).set_params(**params).fit(X, y)
+
+
+def _cost(params, n_samples):
+    # Estimation grossière du coût d'un fit, pour lancer les plus longs en premier
+    return n_samples * params.get('n_estimators', 1)
+
+
+def search_apps(datasets: dict, estimator, param_distributions: dict, mode='halving', n_candidates=16, factor=3,
+                min_samples=500, max_samples=None, budget_s=None, n_splits=5, n_jobs=-1, random_state=42) -> dict:
+    """
+    Recherche d'hyperparamètres de plusieurs applications dans un seul pool de workers :
+    les fits (application, candidat, pli) de toutes les applications sont soumis ensemble, de sorte que
+    les petites applications occupent les cœurs laissés libres par les grosses.
+
+    :param datasets: dict application -> (X_train, y_train)
+    :param estimator: modèle sklearn de base (cloné pour chaque fit)
+    :param param_distributions: dict paramètre -> liste de valeurs
+    :param mode: 'random', 'halving' ou 'grid' (toute la grille, en un tour)
+    :param n_candidates: nombre de combinaisons tirées (modes 'random' et 'halving')
+    :param factor: en mode 'halving', part des candidats conservés à chaque tour (1/factor)
+        et facteur d'augmentation du nombre d'échantillons
+    :param min_samples: nombre minimum d'échantillons d'entraînement au premier tour
+    :param max_samples: budget d'échantillons : nombre maximum de flux utilisés par fit (tous si None)
+    :param budget_s: budget de temps en secondes ; un tour entamé est interrompu à l'échéance
+    :param n_splits: nombre de plis de la validation croisée
+    :param n_jobs: nombre de workers du pool partagé (-1 = tous les cœurs)
+    :return: dict application -> {best_params, best_score, time_to_best_s, n_samples, n_fits, n_rounds, history}
+    """
+    start = time.time()
+    deadline = start + budget_s if budget_s else None
+
+    if mode == 'grid':
+        candidates = list(ParameterGrid(param_distributions))
+    else:
+        candidates = list(ParameterSampler(param_distributions, n_candidates, random_state=random_state))
+    if mode == 'halving':
+        n_rounds = max(1, int(math.floor(math.log(len(candidates), factor))) + 1)
+    else:
+        n_rounds = 1
+
+    states = {}
+    for app, (X, y) in datasets.items():
+        y = np.asarray(y)
+        max_res = min(len(y), max_samples) if max_samples else len(y)
+        states[app] = {
+            'X': X,
+            'y': y,
+            'order': np.random.default_rng(random_state).permutation(len(y)),
+            'max_res': max_res,
+            'alive': list(range(len(candidates))),
+            'history': [],
+            'best': None,
+            'n_fits': 0,
+            'n_rounds': 0,
+        }
+
+    with Parallel(n_jobs=n_jobs, return_as='generator_unordered') as parallel:
+        for round_idx in range(n_rounds):
+            if deadline is not None and time.time() >= deadline:
+                break
+
+            jobs = []
+            round_info = {}
+            for app, st in states.items():
+                if len(st['alive']) == 0:
+                    continue
+                # Dernier tour sur max_res échantillons, divisé par factor à chaque tour précédent
+                n_res = max(min(min_samples, st['max_res']), st['max_res'] // factor ** (n_rounds - 1 - round_idx))
+                subset = st['order'][:n_res]
+                folds = min(n_splits, n_res)
+                if folds < 2:
+                    continue
+                round_info[app] = (n_res, folds)
+                kf = KFold(n_splits=folds, shuffle=True, random_state=random_state)
+                for train, test in kf.split(subset):
+                    for rank, candidate in enumerate(st['alive']):
+                        params = candidates[candidate]
+                        cost = _cost(params, len(train))
+                        jobs.append(((rank, cost if deadline is not None else -cost),
+                                     delayed(_fit_and_score)(app, candidate, estimator, params, st['X'], st['y'],
+                                                             subset[train], subset[test])))
+
+            # Candidat par candidat (tous les plis, toutes les applications) : sous budget de temps, les candidats
+            # se terminent un à un au lieu d'être tous entamés. À rang égal, les fits les plus coûteux d'abord
+            # (meilleur remplissage des cœurs), ou les moins coûteux d'abord sous budget (chaque application
+            # obtient au plus tôt un premier score)
+            jobs.sort(key=lambda job: job[0])
+            scores = {app: {} for app in round_info}
+            finished_at = {app: {} for app in round_info}
+            interrupted = False
+            results = parallel(job for _, job in jobs)
+            for app, candidate, score, end in results:
+                scores[app].setdefault(candidate, []).append(score)
+                finished_at[app][candidate] = max(finished_at[app].get(candidate, 0), end)
+                states[app]['n_fits'] += 1
+                if deadline is not None and time.time() >= deadline:
+                    # Arrêt du générateur : les fits restants sont annulés
+                    interrupted = True
+                    results.close()
+                    break
+
+            for app, (n_res, folds) in round_info.items():
+                st = states[app]
+                complete = {c: float(np.mean(s)) for c, s in scores[app].items() if len(s) == folds}
+                if not complete and st['best'] is None:
+                    # Budget épuisé pendant le premier tour : on retient les candidats partiellement évalués
+                    complete = {c: float(np.mean(s)) for c, s in scores[app].items()}
+                if not complete:
+                    continue
+                st['n_rounds'] += 1
+                for candidate, mean_score in complete.items():
+                    st['history'].append({
+                        'round': round_idx,
+                        'n_samples': n_res,
+                        'candidate': candidate,
+                        'score': mean_score,
+                        'elapsed_s': finished_at[app][candidate] - start,
+                    })
+                best = max(complete, key=lambda c: (complete[c], -c))
+                st['best'] = {
+                    'params': candidates[best],
+                    'score': complete[best],
+                    'n_samples': n_res,
+                    'time_to_best_s': finished_at[app][best] - start,
+                }
+                ranked = sorted(complete, key=lambda c: (-complete[c], c))
+                st['alive'] = ranked[:max(1, math.ceil(len(ranked) / factor))]
+            if interrupted:
+                break
+
+    report = {}
+    for app, st in states.items():
+        best = st['best']
+        if best is None:
+            print(f"[{app}] budget épuisé avant le premier tour complet : paramètres par défaut du premier candidat")
+            best = {'params': candidates[0], 'score': float('nan'), 'n_samples': 0, 'time_to_best_s': None}
+        report[app] = {
+            'best_params': best['params'],
+            'best_score': best['score'],
+            'time_to_best_s': best['time_to_best_s'],
+            'n_samples': best['n_samples'],
+            'n_fits': st['n_fits'],
+            'n_rounds': st['n_rounds'],
+            'history': st['history'],
+        }
+        print(f"[{app}] meilleur score {best['score']:.4f} en {best['time_to_best_s'] or 0:.1f}s "
+              f"({st['n_fits']} fits, {st['n_rounds']} tour(s)) : {best['params']}")
+    return report
+
+
+def refit_apps(datasets: dict, estimator, best_params: dict, n_jobs=-1) -> dict:
+    """
+    Réentraîne le meilleur candidat de chaque application sur tout son jeu d'entraînement, dans un pool partagé
+    (les plus grosses applications en premier).
+    :return: dict application -> modèle entraîné
+    """
+    apps = sorted(datasets, key=lambda app: _cost(best_params[app], len(datasets[app][1])), reverse=True)
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_fit)(app, estimator, best_params[app], datasets[app][0], np.asarray(datasets[app][1]))
+        for app in apps
+    )
+    return dict(results)
+
+
+def search_report_df(report: dict) -> pd.DataFrame:
+    """
+    Résumé de search_apps, une ligne par application (temps pour atteindre le meilleur score, nombre de fits...).
+    """
+    return pd.DataFrame([
+        {
+            'application': app,
+            'best_score': r['best_score'],
+            'time_to_best_s': r['time_to_best_s'],
+            'n_samples': r['n_samples'],
+            'n_fits': r['n_fits'],
+            'n_rounds': r['n_rounds'],
+            'best_params': r['best_params'],
+        }
+        for app, r in report.items()
+    ])
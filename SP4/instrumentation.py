@@ -0,0 +1,184 @@
+import cProfile
+import csv
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Rapport en cours (voir RunReport.stage) : run_stage y ajoute les mesures de chaque tâche
+_active_report = None
+
+TASK_FIELDS = ['etape', 'tache', 'statut', 'wall_s', 'cpu_s', 'peak_rss_mb',
+               'rows_in', 'rows_out', 'bytes_read', 'bytes_written']
+
+
+def peak_rss_mb():
+    """
+    Pic de mémoire résidente du processus courant (depuis son démarrage), en Mo ; None si indisponible.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss est en Ko sous Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_report():
+    return _active_report
+
+
+def _path_sizes(paths) -> int:
+    if isinstance(paths, str):
+        paths = [paths]
+    return sum(os.path.getsize(p) for p in paths or [] if isinstance(p, str) and os.path.isfile(p))
+
+
+def measure_task(func, args, io_stats, profile_path=None):
+    """
+    Exécute func(*args) en mesurant temps réel, temps CPU, pic de RSS et entrées/sorties.
+    Les lignes et octets lus/écrits proviennent des compteurs de storage (io_stats) ; à défaut
+    (ex. pcap lu par nfstream), on retient la taille du fichier d'entrée et des fichiers produits.
+
+    :param io_stats: dict des compteurs d'entrées/sorties du processus, remis à zéro avant la tâche
+    :param profile_path: si renseigné, la tâche est exécutée sous cProfile et les stats y sont écrites
+    :return: (résultat, mesures)
+    """
+    for counter in io_stats:
+        io_stats[counter] = 0
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    if profile_path is not None:
+        profiler = cProfile.Profile()
+        try:
+            result = profiler.runcall(func, *args)
+        finally:
+            os.makedirs(os.path.dirname(profile_path) or ".", exist_ok=True)
+            profiler.dump_stats(profile_path)
+    else:
+        result = func(*args)
+
+    metrics = {
+        'wall_s': time.perf_counter() - wall_start,
+        'cpu_s': time.process_time() - cpu_start,
+        'peak_rss_mb': peak_rss_mb(),
+        'rows_in': io_stats['rows_read'],
+        'rows_out': io_stats['rows_written'],
+        'bytes_read': io_stats['bytes_read'] or _path_sizes(args[0] if args else None),
+        'bytes_written': io_stats['bytes_written'] or _path_sizes(result),
+    }
+    return result, metrics
+
+
+class RunReport:
+    """
+    Rapport d'exécution du pipeline : mesures par étape et par fichier (temps réel, temps CPU, pic de RSS,
+    lignes lues/écrites, octets lus/écrits), exportées en JSON et CSV, avec un tableau récapitulatif.
+    Le profilage cProfile est activé étape par étape (profile_stages).
+    """
+
+    def __init__(self, profile_stages=(), profile_dir="profiles"):
+        self.profile_stages = {str(etape) for etape in profile_stages}
+        self.profile_dir = profile_dir
+        self.started_at = datetime.now()
+        self._start = time.perf_counter()
+        self.stages = []
+        self.tasks = []
+
+    def profile_path(self, etape, task_name):
+        """
+        :return: chemin du fichier .prof d'une tâche, ou None si l'étape n'est pas profilée
+        """
+        if str(etape) not in self.profile_stages:
+            return None
+        name = os.path.splitext(os.path.basename(str(task_name)))[0]
+        return os.path.join(self.profile_dir, f"etape_{etape}_{name}.prof")
+
+    def add_task(self, etape, task_name, status, metrics=None):
+        row = {field: 0 for field in TASK_FIELDS}
+        row.update(metrics or {})
+        row.update({'etape': str(etape), 'tache': str(task_name), 'statut': status})
+        self.tasks.append(row)
+
+    @contextmanager
+    def stage(self, etape):
+        """
+        Mesure une étape ; les tâches exécutées par run_stage pendant le bloc lui sont rattachées.
+        """
+        global _active_report
+        etape = str(etape)
+        first_task = len(self.tasks)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        previous, _active_report = _active_report, self
+        try:
+            yield self
+        finally:
+            _active_report = previous
+            wall = time.perf_counter() - wall_start
+            tasks = self.tasks[first_task:]
+            task_rss = [t['peak_rss_mb'] for t in tasks if t['peak_rss_mb']]
+            own_rss = peak_rss_mb()
+            stage_row = {
+                'etape': etape,
+                'wall_s': wall,
+                # CPU du processus principal + CPU mesuré dans les tâches (workers compris)
+                'cpu_s': time.process_time() - cpu_start
+                         + sum(t['cpu_s'] for t in tasks if t['statut'] == 'ok' and t.get('worker')),
+                'peak_rss_mb': max(task_rss + ([own_rss] if own_rss else []), default=None),
+                'nb_taches': len(tasks),
+                'nb_cache': sum(t['statut'] == 'cache' for t in tasks),
+                'nb_erreurs': sum(t['statut'] == 'erreur' for t in tasks),
+            }
+            for field in ('rows_in', 'rows_out', 'bytes_read', 'bytes_written'):
+                stage_row[field] = sum(t[field] for t in tasks)
+            self.stages.append(stage_row)
+            print("Temps étape : ", timedelta(seconds=wall))
+            print("Temps total : ", timedelta(seconds=time.perf_counter() - self._start))
+
+    def total_wall_s(self) -> float:
+        return time.perf_counter() - self._start
+
+    def to_dict(self) -> dict:
+        return {
+            'debut': self.started_at.strftime("%Y-%m-%d %H:%M:%S"),
+            'wall_s': self.total_wall_s(),
+            'etapes': self.stages,
+            'taches': [{k: t[k] for k in TASK_FIELDS} for t in self.tasks],
+        }
+
+    def write(self, prefix: str) -> tuple[str, str]:
+        """
+        Écrit <prefix>.json (rapport complet) et <prefix>.csv (une ligne par tâche).
+        :return: (chemin JSON, chemin CSV)
+        """
+        json_path, csv_path = prefix + ".json", prefix + ".csv"
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=TASK_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(self.tasks)
+        return json_path, csv_path
+
+    def summary(self) -> str:
+        """
+        Tableau récapitulatif par étape.
+        """
+        header = f"{'etape':>6} {'wall':>10} {'cpu':>10} {'rss Mo':>8} {'taches':>7} {'cache':>6} {'err':>4} " \
+                 f"{'lignes in':>11} {'lignes out':>11} {'Mo lus':>9} {'Mo écrits':>9}"
+        lines = [header, "-" * len(header)]
+        for s in self.stages:
+            rss = f"{s['peak_rss_mb']:.0f}" if s['peak_rss_mb'] else "-"
+            lines.append(
+                f"{s['etape']:>6} {s['wall_s']:>9.1f}s {s['cpu_s']:>9.1f}s {rss:>8} {s['nb_taches']:>7} "
+                f"{s['nb_cache']:>6} {s['nb_erreurs']:>4} {s['rows_in']:>11} {s['rows_out']:>11} "
+                f"{s['bytes_read'] / 1e6:>9.1f} {s['bytes_written'] / 1e6:>9.1f}"
+            )
+        lines.append(f"Temps d'exécution : {timedelta(seconds=self.total_wall_s())}")
+        return "\n".join(lines)
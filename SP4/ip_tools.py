@@ -0,0 +1,114 @@
+import ipaddress
+
+import numpy as np
+import pandas as pd
+
+# Bit marquant les clés d'adresses non IPv4 (IPv6 ou invalides), hors de la plage uint32 des IPv4
+NON_IPV4_FLAG = np.int64(1) << 62
+# Clé des valeurs manquantes
+MISSING_IP = -1
+
+
+def _parse_unique_ips(uniques) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Analyse une seule fois chaque adresse distincte.
+    :return: (entiers uint32 des IPv4 (0 sinon), version IP par adresse : 4, 6 ou 0 si invalide)
+    """
+    values = np.zeros(len(uniques), dtype=np.uint32)
+    versions = np.zeros(len(uniques), dtype=np.int8)
+    for i, ip in enumerate(uniques):
+        try:
+            address = ipaddress.ip_address(str(ip).strip())
+        except ValueError:
+            continue
+        versions[i] = address.version
+        if address.version == 4:
+            values[i] = int(address)
+    return values, versions
+
+
+def _take(unique_values: np.ndarray, codes: np.ndarray, fill):
+    """
+    Propage une valeur par adresse distincte à toutes les lignes (fill pour les valeurs manquantes).
+    """
+    if len(unique_values) == 0:
+        return np.full(len(codes), fill, dtype=unique_values.dtype)
+    return np.where(codes >= 0, unique_values[np.maximum(codes, 0)], fill)
+
+
+def ip_to_uint32(ips) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Convertit une colonne d'adresses IP en uint32, en analysant chaque adresse distincte une seule fois.
+
+    :param ips: Series (ou tableau) d'adresses IP sous forme de texte
+    :return: (tableau uint32, masque des adresses IPv4 valides)
+    """
+    codes, uniques = pd.factorize(pd.Series(ips))
+    values, versions = _parse_unique_ips(uniques)
+    is_ipv4 = _take(versions == 4, codes, False)
+    return np.where(is_ipv4, _take(values, codes, 0), 0).astype(np.uint32), is_ipv4
+
+
+def ip_to_int(ips) -> np.ndarray:
+    """
+    Clé entière stable (d'un fichier à l'autre) pour chaque adresse, utilisable pour les comparaisons et jointures :
+      - IPv4 : valeur uint32 de l'adresse
+      - IPv6 ou texte invalide : hash de l'adresse normalisée, marqué par NON_IPV4_FLAG (hors plage IPv4)
+      - valeur manquante : MISSING_IP
+    """
+    codes, uniques = pd.factorize(pd.Series(ips))
+    values, versions = _parse_unique_ips(uniques)
+
+    normalized = np.array([
+        str(ipaddress.ip_address(str(ip).strip())) if version == 6 else str(ip)
+        for ip, version in zip(uniques, versions)
+    ], dtype=object)
+    hashes = pd.util.hash_array(normalized) if len(normalized) else np.zeros(0, dtype=np.uint64)
+    other_keys = (hashes >> np.uint64(2)).astype(np.int64) | NON_IPV4_FLAG
+
+    unique_keys = np.where(versions == 4, values.astype(np.int64), other_keys)
+    return _take(unique_keys, codes, MISSING_IP)
+
+
+def ip_int_column(df: pd.DataFrame, col: str) -> np.ndarray:
+    """
+    Retourne la clé entière d'une colonne IP, en réutilisant la colonne '<col>_int' si elle existe déjà
+    (ajoutée par add_ip_int_columns lors d'une étape précédente).
+    """
+    int_col = f"{col}_int"
+    if int_col in df.columns:
+        return df[int_col].to_numpy(dtype=np.int64)
+    return ip_to_int(df[col])
+
+
+def add_ip_int_columns(df: pd.DataFrame, cols=('src_ip', 'dst_ip')) -> pd.DataFrame:
+    """
+    Ajoute (si absentes) les colonnes '<col>_int' : clés entières des IP, calculées une fois et
+    conservées dans les sorties d'étapes pour être réutilisées par les étapes suivantes.
+    """
+    for col in cols:
+        if f"{col}_int" not in df.columns:
+            df[f"{col}_int"] = ip_to_int(df[col])
+    return df
+
+
+def ip_classes(ips) -> np.ndarray:
+    """
+    Classe d'adresse de chaque IP, calculée sur des colonnes entières :
+      - 'A' : 10.0.0.0/8
+      - 'B' : 172.16.0.0/12
+      - 'C' : 192.168.0.0/16
+      - 'V6' : adresse IPv6
+      - 'D' : toute autre adresse (y compris texte invalide ou manquant)
+    """
+    codes, uniques = pd.factorize(pd.Series(ips))
+    values, versions = _parse_unique_ips(uniques)
+
+    is_ipv4 = versions == 4
+    classes = np.full(len(uniques), 'D', dtype=object)
+    classes[is_ipv4 & ((values >> 24) == 10)] = 'A'
+    classes[is_ipv4 & ((values >> 20) == ((172 << 4) | 1))] = 'B'
+    classes[is_ipv4 & ((values >> 16) == ((192 << 8) | 168))] = 'C'
+    classes[versions == 6] = 'V6'
+
+    return _take(classes, codes, 'D')
@@ -1,81 +1,159 @@
-import csv
 import os
 
+import numpy as np
 import pandas as pd
 
+from ip_tools import MISSING_IP, ip_int_column
+from storage import read_table, write_table
+
+
+# Index de ground truth compilé, partagé par load_ground_truth et label_flows (une compilation par run)
+_gt_index_cache = {}
+
+GT_KEY_COLS = ['src_ip', 'dst_ip', 'src_port', 'dst_port', 'protocol']
+
+# Horodatages d'un flux comparés aux intervalles de la GT
+FLOW_TIME_COLS = [
+    'bidirectional_first_seen_ms', 'bidirectional_last_seen_ms',
+    'src2dst_first_seen_ms', 'src2dst_last_seen_ms',
+    'dst2src_first_seen_ms', 'dst2src_last_seen_ms'
+]
+
+
+def _normalize_keys(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Normalise les colonnes du 5-tuple (IP, ports et protocole en entiers) pour la jointure.
+    Les clés entières des IP (ip_tools) sont réutilisées si l'étape fan les a déjà calculées.
+    """
+    keys = pd.DataFrame(index=df.index)
+    for col in ['src_ip', 'dst_ip']:
+        ip_ints = pd.array(ip_int_column(df, col), dtype='Int64')
+        keys[col] = pd.Series(ip_ints, index=df.index).where(ip_ints != MISSING_IP)
+    for col in ['src_port', 'dst_port', 'protocol']:
+        keys[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+    return keys
+
+
+def compile_ground_truth(gt_path: str) -> dict:
+    """
+    Compile la ground truth en un index d'intervalles trié, mis en cache par chemin.
+
+    Chaque 5-tuple (src_ip, dst_ip, src_port, dst_port, protocol) reçoit un identifiant key_id.
+    Les intervalles sont triés par (key_id, start) et encodés en un seul tableau croissant
+    composite = key_id * (nb_starts + 1) + rang(start), ce qui permet de retrouver par searchsorted
+    le dernier intervalle d'une clé commençant avant un instant t. Le maximum cumulé des 'end'
+    au sein de chaque clé indique alors si t est couvert par au moins un intervalle.
+
+    :param gt_path: chemin du fichier TRAIN.gt.csv
+    :return: dict de l'index compilé
+    """
+    gt_path = os.path.abspath(gt_path)
+    if gt_path in _gt_index_cache:
+        return _gt_index_cache[gt_path]
+
+    gt_data = pd.read_csv(gt_path, dtype={'src_ip': str, 'dst_ip': str})
+    gt_data = gt_data.rename(columns={'first_timestamp_ms': 'start', 'last_timestamp_ms': 'end'})
+    gt_data['start'] = gt_data['start'].astype(float)
+    gt_data['end'] = gt_data['end'].astype(float)
+
+    keys = _normalize_keys(gt_data)
+    key_ids, _ = pd.MultiIndex.from_frame(keys).factorize()
+    key_table = keys.assign(key_id=key_ids).drop_duplicates('key_id')
+
+    # Tri par (clé, début d'intervalle)
+    order = np.lexsort((gt_data['start'].to_numpy(), key_ids))
+    sorted_keys = key_ids[order]
+    sorted_starts = gt_data['start'].to_numpy()[order]
+    sorted_ends = gt_data['end'].to_numpy()[order]
+
+    # Rang des débuts parmi les débuts distincts (1..nb_starts)
+    unique_starts = np.unique(sorted_starts)
+    start_ranks = np.searchsorted(unique_starts, sorted_starts, side='left') + 1
+    composite = sorted_keys.astype(np.int64) * (len(unique_starts) + 1) + start_ranks
+
+    # Fin maximale des intervalles déjà ouverts, clé par clé
+    cummax_ends = pd.Series(sorted_ends).groupby(sorted_keys).cummax().to_numpy()
+
+    index = {
+        'gt_data': gt_data,
+        'key_table': key_table,
+        'unique_starts': unique_starts,
+        'composite': composite,
+        'sorted_keys': sorted_keys,
+        'cummax_ends': cummax_ends,
+        'ip_sources': set(gt_data['src_ip']),
+        'ip_destinations': set(gt_data['dst_ip']),
+    }
+    _gt_index_cache[gt_path] = index
+    return index
+
+
+def match_ground_truth(data: pd.DataFrame, gt_index: dict) -> np.ndarray:
+    """
+    Calcule le label (0/1) de chaque flux : 1 si le 5-tuple est dans la GT et qu'au moins un des
+    horodatages du flux (bidirectionnel, src->dst, dst->src ; début ou fin) tombe dans un intervalle
+    [first_timestamp_ms, last_timestamp_ms] de ce 5-tuple.
+
+    :param data: DataFrame des flux
+    :param gt_index: index retourné par compile_ground_truth
+    :return: np.ndarray d'entiers 0/1, dans l'ordre de data
+    """
+    keys = _normalize_keys(data).reset_index(drop=True)
+    key_ids = keys.merge(gt_index['key_table'], on=GT_KEY_COLS, how='left')['key_id']
+    has_key = key_ids.notna().to_numpy() & keys.notna().all(axis=1).to_numpy()
+    key_ids = key_ids.fillna(-1).to_numpy(dtype=np.int64)
+
+    unique_starts = gt_index['unique_starts']
+    composite = gt_index['composite']
+    labels = np.zeros(len(data), dtype=bool)
+
+    for col in FLOW_TIME_COLS:
+        t = pd.to_numeric(data[col], errors='coerce').to_numpy(dtype=float)
+        # Nombre de débuts distincts <= t, puis dernier intervalle de la clé commençant avant t
+        t_ranks = np.searchsorted(unique_starts, t, side='right')
+        pos = np.searchsorted(composite, key_ids * (len(unique_starts) + 1) + t_ranks, side='right') - 1
+        valid = has_key & (pos >= 0) & ~np.isnan(t)
+        pos = np.where(valid, pos, 0)
+        valid &= gt_index['sorted_keys'][pos] == key_ids
+        labels |= valid & (t <= gt_index['cummax_ends'][pos])
+
+    return labels.astype(int)
+
+
 def load_ground_truth(gt_path: str)->tuple[list[dict], set[str], set[str]]:
     """
     Charge la ground truth dans une structure
     Format attendu: first_timestamp, last_timestamp, ip_src, ip_dst, port_src, port_dst, protocol
+    S'appuie sur l'index compilé (compile_ground_truth), construit une seule fois par run.
     :param gt_path:
     :return: list[dict] : la gt
     set[str] : les ip sources
     set[str] : les ip destinations
     """
+    gt_index = compile_ground_truth(gt_path)
+    gt_df = gt_index['gt_data']
 
-    gt_data = []
-    ip_sources = set()
-    ip_destinations = set()
-    with open(gt_path, 'r', newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f, delimiter=',')
-        for row in reader:
-            gt_data.append({
-                'start': float(row['first_timestamp_ms']),
-                'end': float(row['last_timestamp_ms']),
-                'src_ip': row['src_ip'],
-                'dst_ip': row['dst_ip'],
-                'src_port': row['src_port'],
-                'dst_port': row['dst_port'],
-                'protocol': row['protocol']
-            })
-            ip_sources.add(row['src_ip'])
-            ip_destinations.add(row['dst_ip'])
-    return gt_data, ip_sources, ip_destinations
-
-def label_flows(csv_path: str, destination: str, gt_path: str) -> str:
+    gt_data = gt_df[['start', 'end']].assign(
+        src_ip=gt_df['src_ip'],
+        dst_ip=gt_df['dst_ip'],
+        src_port=gt_df['src_port'].astype(str),
+        dst_port=gt_df['dst_port'].astype(str),
+        protocol=gt_df['protocol'].astype(str)
+    ).to_dict('records')
+    return gt_data, set(gt_index['ip_sources']), set(gt_index['ip_destinations'])
+
+def label_flows(csv_path: str, destination: str, gt_path: str, fmt: str = None) -> str:
     """
         Ajoute une colonne 'label' aux flows en fonction de la ground truth.
+        Jointure sur le 5-tuple et recherche d'intervalle vectorisée (voir compile_ground_truth).
+        La sortie est écrite au format fmt (celui de l'entrée si None).
         """
     # Charger les données
-    data = pd.read_csv(csv_path)
-    gt_data = pd.read_csv(gt_path)
-
-    # Filtrer les GT pertinents par IP
-    gt_dict = {}
-    for _, row in gt_data.iterrows():
-        key = (row['src_ip'], row['dst_ip'])
-        if key not in gt_dict:
-            gt_dict[key] = []
-        gt_dict[key].append(row)
-
-    # Ajouter une colonne 'label' avec des valeurs par défaut à 0
-    data['label'] = 0
-
-    # Vectorisation avec pandas
-    def check_match(row):
-        key = (row['src_ip'], row['dst_ip'])
-        if key in gt_dict:
-            for gt in gt_dict[key]:
-                if (row['src_port'] == gt['src_port'] and
-                        row['dst_port'] == gt['dst_port'] and
-                        row['protocol'] == gt['protocol'] and (
-                        # Comparaison bidirectionnelle
-                        (gt['first_timestamp_ms'] <= row['bidirectional_first_seen_ms'] <= gt['last_timestamp_ms'] or
-                         gt['first_timestamp_ms'] <= row['bidirectional_last_seen_ms'] <= gt['last_timestamp_ms']) or
-                        # Comparaison directionnelle source vers destination
-                        (gt['first_timestamp_ms'] <= row['src2dst_first_seen_ms'] <= gt['last_timestamp_ms'] or
-                         gt['first_timestamp_ms'] <= row['src2dst_last_seen_ms'] <= gt['last_timestamp_ms']) or
-                        # Comparaison directionnelle destination vers source
-                        (gt['first_timestamp_ms'] <= row['dst2src_first_seen_ms'] <= gt['last_timestamp_ms'] or
-                         gt['first_timestamp_ms'] <= row['dst2src_last_seen_ms'] <= gt['last_timestamp_ms'])
-                        )):
-                    return 1
-        return 0
-
-    # Appliquer la fonction de matching
-    data['label'] = data.apply(check_match, axis=1)
+    data = read_table(csv_path)
+    gt_index = compile_ground_truth(gt_path)
+
+    data['label'] = match_ground_truth(data, gt_index)
 
     # Sauvegarder le fichier avec les labels
     output_csv = os.path.join(destination, os.path.basename(csv_path))
-    data.to_csv(output_csv, index=False)
-    return output_csv
\ No newline at end of file
+    return write_table(data, output_csv, fmt)
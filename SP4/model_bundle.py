@@ -0,0 +1,140 @@
+import os
+
+import numpy as np
+import pandas as pd
+from joblib import load
+
+from compiled_forest import COMPILED_MAX_ROWS, load_compiled
+from neighbors import approximate_knn
+from vectorization import vectorize_flows
+
+# Registre des bundles déjà chargés : (dossier vectorisé, dossier modèles, application, index k-NN) -> ModelBundle
+_bundles = {}
+
+
+class ModelBundle:
+    """
+    Scaler, OneHotEncoder et modèle d'une application, chargés une seule fois,
+    avec la correspondance précalculée entre les colonnes produites par vectorize_flows
+    et les features attendues par le modèle (model.feature_names_in_).
+    Un modèle k-NN peut être réindexé au chargement (knn_index, voir neighbors.approximate_knn).
+    Une forêt est aussi chargée sous forme compilée (compiled_forest), utilisée pour les petits lots.
+    """
+
+    def __init__(self, app_name, scaler_path, encoder_path, model_path, categorical_cols, numeric_cols,
+                 knn_index=None):
+        self.app_name = app_name
+        self.categorical_cols = list(categorical_cols)
+        self.numeric_cols = list(numeric_cols)
+        self.scaler = load(scaler_path)
+        self.one_hot_encoder = load(encoder_path)
+        self.model = load(model_path)
+        if knn_index is not None:
+            self.model = approximate_knn(self.model, **knn_index)
+        self.forest = load_compiled(model_path, self.model)
+
+        # Colonnes produites par vectorize_flows, dans l'ordre
+        vectorized_cols = self.numeric_cols + list(self.one_hot_encoder.get_feature_names_out(self.categorical_cols))
+        col_positions = {col: i for i, col in enumerate(vectorized_cols)}
+
+        # Pour chaque feature du modèle : position dans la sortie de vectorize_flows, ou -1 (feature absente -> 0)
+        self.feature_names = np.asarray(self.model.feature_names_in_)
+        self.positions = np.array([col_positions.get(col, -1) for col in self.feature_names], dtype=np.int64)
+        self.present = self.positions >= 0
+
+    def vectorize(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Vectorise les flux et aligne les colonnes sur celles du modèle.
+        Les lignes supprimées par le nettoyage de vectorize_flows sont absentes du résultat (voir son index).
+        """
+        X = vectorize_flows(
+            df=df,
+            categorical_cols=self.categorical_cols,
+            numeric_cols=self.numeric_cols,
+            label_col=None,
+            is_test=True,
+            scaler=self.scaler,
+            one_hot_encoder=self.one_hot_encoder
+        )
+        values = X.to_numpy(dtype=float)
+        aligned = np.zeros((len(X), len(self.feature_names)))
+        aligned[:, self.present] = values[:, self.positions[self.present]]
+        return pd.DataFrame(aligned, columns=self.feature_names, index=X.index)
+
+    def predict(self, X: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Label et probabilité de la classe 1, en un seul appel au modèle.
+        :return: (labels, probas)
+        """
+        if len(X) == 0:
+            return np.zeros(0, dtype=int), np.zeros(0)
+        if len(self.model.classes_) == 1:
+            # Modèle entraîné sur une seule classe : proba forcée à 0
+            return self.model.predict(X), np.zeros(len(X))
+        if self.forest is not None and len(X) <= COMPILED_MAX_ROWS:
+            preds, probas = self.forest.predict_with_proba(X)
+            return preds, probas[:, 1]
+        probas = self.model.predict_proba(X)
+        preds = self.model.classes_[np.argmax(probas, axis=1)]
+        return preds, probas[:, 1]
+
+    def score(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Vectorise et prédit un sous-ensemble de flux.
+        :return: DataFrame (index d'origine, label, proba)
+        """
+        X = self.vectorize(df)
+        preds, probas = self.predict(X)
+        return pd.DataFrame({'label': preds.astype(int), 'proba': probas.astype(float)}, index=X.index)
+
+
+def get_bundle(app_name, train_vectorized_dir, models_dir, categorical_cols, numeric_cols, knn_index=None):
+    """
+    Retourne le ModelBundle d'une application, chargé au premier appel puis conservé dans le registre.
+    :param knn_index: paramètres d'index appliqués si le modèle est un k-NN (ex. {'index': 'ball_tree', 'oversample': 2})
+    :return: ModelBundle, ou None si aucun modèle n'existe pour cette application
+    """
+    key = (os.path.abspath(train_vectorized_dir), os.path.abspath(models_dir), app_name,
+           tuple(sorted(knn_index.items())) if knn_index else None)
+    if key not in _bundles:
+        app_vectorized_dir = os.path.join(train_vectorized_dir, app_name)
+        model_path = os.path.join(models_dir, app_name, f"model_{app_name}.joblib")
+        if not os.path.exists(model_path):
+            return None
+        _bundles[key] = ModelBundle(
+            app_name,
+            os.path.join(app_vectorized_dir, 'scaler.joblib'),
+            os.path.join(app_vectorized_dir, 'ohe.joblib'),
+            model_path,
+            categorical_cols,
+            numeric_cols,
+            knn_index
+        )
+    return _bundles[key]
+
+
+def clear_bundles():
+    _bundles.clear()
+
+
+def score_flows(df, app_names, train_vectorized_dir, models_dir, categorical_cols, numeric_cols,
+                field="application_name", knn_index=None):
+    """
+    Score en une passe tous les flux d'un DataFrame : un seul découpage par application (groupby),
+    puis chaque sous-ensemble passe dans le bundle (chargé une seule fois) de son application.
+
+    :return: DataFrame (index d'origine, label, proba) des flux des applications connues, trié par index
+    """
+    results = []
+    app_names = set(app_names)
+    for app_name, subset_df in df.groupby(field, sort=False):
+        if app_name not in app_names:
+            continue
+        bundle = get_bundle(app_name, train_vectorized_dir, models_dir, categorical_cols, numeric_cols, knn_index)
+        if bundle is None:
+            raise FileNotFoundError(f"Aucun modèle pour l'application '{app_name}' dans {models_dir}")
+        results.append(bundle.score(subset_df.copy()))
+
+    if not results:
+        return pd.DataFrame({'label': pd.Series(dtype=int), 'proba': pd.Series(dtype=float)})
+    return pd.concat(results).sort_index()
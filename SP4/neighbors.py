@@ -0,0 +1,251 @@
+import numpy as np
+import scipy.sparse as sp
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.cluster import KMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.neighbors import KNeighborsClassifier, NearestNeighbors
+from sklearn.utils.validation import check_array, check_is_fitted
+
+# Index de voisinage disponibles :
+#   - 'brute'     : recherche exacte, O(n_train) par flux (comportement historique de KNeighborsClassifier)
+#   - 'ivf'       : flux d'entraînement répartis en n_lists groupes (k-means) ; chaque flux n'est comparé
+#                   qu'aux membres des n_probes groupes les plus proches (distances exactes, par produits matriciels)
+#   - 'ball_tree' : arbre sur une projection en n_components dimensions, puis re-classement exact des candidats
+#   - 'kd_tree'   : idem avec un kd-tree (plus rapide que le ball tree en très petite dimension)
+KNN_INDEXES = ('brute', 'ivf', 'ball_tree', 'kd_tree')
+
+# Index utilisé par défaut pour l'entraînement du k-NN (voir cross_validation_setup.fit_knn)
+DEFAULT_KNN_INDEX = {'index': 'ivf', 'n_probes': 8}
+
+# Paramètres modifiables sans reconstruire l'index (compromis rappel / latence au moment de la prédiction)
+QUERY_PARAMS = ('n_probes', 'oversample', 'batch_size')
+
+# Nombre maximum de flux utilisés pour apprendre les groupes de l'index 'ivf' (tous les flux y sont ensuite affectés)
+IVF_TRAIN_SAMPLES = 50_000
+
+# Taille maximale (en valeurs) d'un groupe densifié pour le calcul des distances sur matrice creuse
+DENSE_BLOCK_SIZE = 1 << 23
+
+
+def _row_sq_norms(X) -> np.ndarray:
+    if sp.issparse(X):
+        return np.asarray(X.multiply(X).sum(axis=1)).ravel()
+    return np.einsum('ij,ij->i', X, X)
+
+
+class ApproxKNeighborsClassifier(ClassifierMixin, BaseEstimator):
+    """
+    Classificateur k-NN à index de voisinage interchangeable, utilisable dans GridSearchCV.
+
+    Avec index='ivf', les flux d'entraînement sont répartis en n_lists groupes (sqrt(n_train) par défaut) ;
+    un flux à prédire n'est comparé qu'aux membres de ses n_probes groupes les plus proches. Le rappel
+    augmente avec n_probes (n_probes = n_lists : recherche exacte), la latence aussi.
+
+    Avec index='ball_tree' ou 'kd_tree', les flux d'entraînement sont projetés en n_components dimensions
+    (TruncatedSVD, qui accepte les matrices creuses du one-hot) et indexés dans un arbre.
+    Pour chaque flux à prédire, oversample * n_neighbors candidats sont extraits de l'arbre puis re-classés
+    par distance euclidienne exacte dans l'espace complet. Le rappel (part des vrais k plus proches voisins
+    retrouvés) augmente avec n_components et oversample, la latence aussi.
+    """
+
+    def __init__(self, n_neighbors=5, weights='uniform', metric='euclidean', index='ivf', n_lists=None, n_probes=8,
+                 n_components=16, oversample=4, leaf_size=40, batch_size=4096, random_state=42):
+        self.n_neighbors = n_neighbors
+        self.weights = weights
+        self.metric = metric
+        self.index = index
+        self.n_lists = n_lists
+        self.n_probes = n_probes
+        self.n_components = n_components
+        self.oversample = oversample
+        self.leaf_size = leaf_size
+        self.batch_size = batch_size
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        if self.index not in KNN_INDEXES:
+            raise ValueError(f"Index inconnu : {self.index} (index disponibles : {list(KNN_INDEXES)})")
+        if self.index != 'brute' and self.metric != 'euclidean':
+            raise ValueError(f"L'index '{self.index}' ne supporte que la distance euclidienne")
+        if self.weights not in ('uniform', 'distance'):
+            raise ValueError(f"Pondération inconnue : {self.weights}")
+
+        # float32 : moitié moins de mémoire pour les flux d'entraînement conservés
+        X = check_array(X, accept_sparse='csr', dtype=np.float32)
+        self.classes_, self._y = np.unique(np.asarray(y), return_inverse=True)
+        self._fit_X = X
+        self.n_features_in_ = X.shape[1]
+
+        self._sq_norms = _row_sq_norms(X)
+        self.projection_ = None
+        if self.index == 'brute':
+            self.tree_ = NearestNeighbors(algorithm='brute', metric=self.metric).fit(X)
+            return self
+        if self.index == 'ivf':
+            self._fit_ivf(X)
+            return self
+
+        if self.n_components < X.shape[1]:
+            self.projection_ = TruncatedSVD(self.n_components, random_state=self.random_state).fit(X)
+            Z = self.projection_.transform(X)
+        else:
+            Z = X.toarray() if sp.issparse(X) else X
+        self.tree_ = NearestNeighbors(algorithm=self.index, leaf_size=self.leaf_size).fit(Z)
+        return self
+
+    def _fit_ivf(self, X):
+        n = X.shape[0]
+        n_lists = min(self.n_lists or max(1, int(np.sqrt(n))), n)
+        sample = np.random.default_rng(self.random_state).permutation(n)[:IVF_TRAIN_SAMPLES]
+        kmeans = KMeans(n_lists, n_init=1, max_iter=20, random_state=self.random_state).fit(X[np.sort(sample)])
+        assignment = kmeans.predict(X)
+        self.centroids_ = kmeans.cluster_centers_.astype(np.float32)
+        self._centroid_sq_norms = _row_sq_norms(self.centroids_)
+        # Membres de chaque groupe, contigus : members[offsets[c]:offsets[c + 1]]
+        self._members = np.argsort(assignment, kind='stable')
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))])
+
+    def _ivf_kneighbors(self, Q, k, n_probes=None):
+        """
+        Recherche dans les n_probes groupes les plus proches de chaque flux : pour chaque groupe, un seul
+        produit matriciel entre les flux qui le sondent et ses membres, puis fusion des k meilleurs par sonde.
+        Les flux dont les groupes sondés comptent moins de k membres au total sont recherchés à nouveau
+        avec deux fois plus de sondes (jusqu'à tous les groupes) : seuls de vrais voisins sont retournés.
+        """
+        nq = Q.shape[0]
+        q_norms = _row_sq_norms(Q)
+        n_lists = len(self.centroids_)
+        n_probes = min(n_probes or self.n_probes, n_lists)
+        to_centroids = self._centroid_sq_norms[None, :] - 2 * np.asarray(Q @ self.centroids_.T)
+        probes = np.argpartition(to_centroids, n_probes - 1, axis=1)[:, :n_probes] if n_probes < n_lists \
+            else np.tile(np.arange(n_lists), (nq, 1))
+
+        best_d = np.full((nq, n_probes * k), np.inf, dtype=np.float32)
+        best_i = np.zeros((nq, n_probes * k), dtype=np.int64)
+        # Couples (flux, rang de la sonde) regroupés par groupe sondé
+        rows = np.repeat(np.arange(nq), n_probes)
+        ranks = np.tile(np.arange(n_probes), nq)
+        clusters = probes.ravel()
+        order = np.argsort(clusters, kind='stable')
+        rows, ranks, clusters = rows[order], ranks[order], clusters[order]
+        bounds = np.flatnonzero(np.diff(clusters)) + 1
+        for start, stop in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(clusters)]])):
+            c = clusters[start]
+            members = self._members[self._offsets[c]:self._offsets[c + 1]]
+            if len(members) == 0:
+                continue
+            q_rows = rows[start:stop]
+            X_members = self._fit_X[members]
+            if sp.issparse(X_members) and X_members.shape[0] * X_members.shape[1] <= DENSE_BLOCK_SIZE:
+                # creux x dense : bien plus rapide que le produit de deux matrices creuses
+                X_members = X_members.toarray()
+            dots = Q[q_rows] @ X_members.T
+            d2 = q_norms[q_rows, None] + self._sq_norms[members][None, :] - 2 * np.asarray(
+                dots.toarray() if sp.issparse(dots) else dots)
+            kk = min(k, len(members))
+            top = np.argpartition(d2, kk - 1, axis=1)[:, :kk] if kk < len(members) \
+                else np.tile(np.arange(len(members)), (len(q_rows), 1))
+            slots = ranks[start:stop, None] * k + np.arange(kk)[None, :]
+            best_d[q_rows[:, None], slots] = np.take_along_axis(d2, top, axis=1)
+            best_i[q_rows[:, None], slots] = members[top]
+
+        order = np.argsort(best_d, axis=1, kind='stable')[:, :k]
+        d2 = np.maximum(np.take_along_axis(best_d, order, axis=1), 0)
+        distances, indices = np.sqrt(d2), np.take_along_axis(best_i, order, axis=1)
+        # Emplacements restés vides (distance infinie) : moins de k membres dans les groupes sondés
+        short = np.flatnonzero(np.isinf(distances[:, -1]))
+        if len(short) and n_probes < n_lists:
+            distances[short], indices[short] = self._ivf_kneighbors(Q[short], k, 2 * n_probes)
+        return distances, indices
+
+    def _exact_sq_distances(self, Q, candidates) -> np.ndarray:
+        """
+        Distances euclidiennes au carré entre chaque flux de Q et ses candidats (||q||² + ||x||² - 2 q.x).
+        """
+        nq, m = candidates.shape
+        flat = candidates.ravel()
+        if sp.issparse(self._fit_X):
+            Q = sp.csr_matrix(Q)
+            dots = np.asarray(self._fit_X[flat].multiply(Q[np.repeat(np.arange(nq), m)]).sum(axis=1)).reshape(nq, m)
+        else:
+            Q = Q.toarray() if sp.issparse(Q) else Q
+            dots = np.einsum('qd,qmd->qm', Q, self._fit_X[flat].reshape(nq, m, -1))
+        d2 = _row_sq_norms(Q)[:, None] + self._sq_norms[candidates] - 2 * dots
+        return np.maximum(d2, 0)
+
+    def _kneighbors_batch(self, Q, k):
+        if self.index == 'brute':
+            return self.tree_.kneighbors(Q, k)
+        if self.index == 'ivf':
+            return self._ivf_kneighbors(Q, k)
+        m = min(max(k, k * self.oversample), self._fit_X.shape[0])
+        Z = self.projection_.transform(Q) if self.projection_ is not None else (Q.toarray() if sp.issparse(Q) else Q)
+        _, candidates = self.tree_.kneighbors(Z, m)
+        d2 = self._exact_sq_distances(Q, candidates)
+        order = np.argsort(d2, axis=1, kind='stable')[:, :k]
+        return np.sqrt(np.take_along_axis(d2, order, axis=1)), np.take_along_axis(candidates, order, axis=1)
+
+    def kneighbors(self, X, n_neighbors=None):
+        """
+        :return: (distances, indices) des n_neighbors plus proches flux d'entraînement, par lots de batch_size
+        """
+        check_is_fitted(self, 'classes_')
+        k = min(n_neighbors or self.n_neighbors, self._fit_X.shape[0])
+        Q = check_array(X, accept_sparse='csr', dtype=np.float32)
+        distances, indices = [], []
+        for start in range(0, Q.shape[0], self.batch_size):
+            d, i = self._kneighbors_batch(Q[start:start + self.batch_size], k)
+            distances.append(d)
+            indices.append(i)
+        if not distances:
+            return np.zeros((0, k)), np.zeros((0, k), dtype=np.int64)
+        return np.vstack(distances), np.vstack(indices)
+
+    def predict_proba(self, X) -> np.ndarray:
+        distances, indices = self.kneighbors(X)
+        if self.weights == 'distance':
+            # Comme KNeighborsClassifier : un voisin à distance nulle l'emporte sur tous les autres
+            with np.errstate(divide='ignore'):
+                weights = 1.0 / distances
+            exact = np.isinf(weights)
+            rows = exact.any(axis=1)
+            weights[rows] = exact[rows]
+        else:
+            weights = np.ones(distances.shape)
+        # Emplacement sans voisin (distance infinie) : aucun vote
+        weights[np.isinf(distances)] = 0
+        labels = self._y[indices]
+        proba = np.stack([(weights * (labels == c)).sum(axis=1) for c in range(len(self.classes_))], axis=1)
+        total = proba.sum(axis=1, keepdims=True)
+        total[total == 0] = 1
+        return proba / total
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def approximate_knn(model, **index_params):
+    """
+    Remplace un modèle k-NN chargé par un ApproxKNeighborsClassifier utilisant l'index demandé
+    (ex. index='ball_tree', n_components=16, oversample=4) ; les autres modèles sont retournés tels quels.
+    Un KNeighborsClassifier (modèle exact historique) est réindexé à partir de ses flux d'entraînement ;
+    pour un ApproxKNeighborsClassifier, seuls les paramètres hors QUERY_PARAMS imposent de reconstruire l'index.
+    """
+    if isinstance(model, ApproxKNeighborsClassifier):
+        params = {key: value for key, value in index_params.items() if model.get_params()[key] != value}
+        model.set_params(**params)
+        if any(key not in QUERY_PARAMS for key in params):
+            model.fit(model._fit_X, model.classes_[model._y])
+        return model
+    if not isinstance(model, KNeighborsClassifier):
+        return model
+
+    metric = model.metric
+    if metric == 'minkowski' and model.p == 2:
+        metric = 'euclidean'
+    approx = ApproxKNeighborsClassifier(n_neighbors=model.n_neighbors, weights=model.weights, metric=metric,
+                                        **index_params)
+    approx.fit(model._fit_X, model.classes_[model._y])
+    if hasattr(model, 'feature_names_in_'):
+        approx.feature_names_in_ = model.feature_names_in_
+    return approx
@@ -1,20 +1,37 @@
-import nfstream
+import codecs
 import csv
+import itertools
 import os
+
+import nfstream
+import numpy as np
 import pandas as pd
+
+from ip_tools import add_ip_int_columns
+from storage import read_table, write_table
 ############
+# Paramètres de NFStreamer pour le pipeline (font aussi partie de la clé du cache des étapes 1 et 1-2)
+STREAMER_SETTINGS = {
+    'decode_tunnels': True,
+    'idle_timeout': 60,
+    'active_timeout': 120,
+    'statistical_analysis': True,
+}
+
+
+def get_streamer(pcap_path: str) -> nfstream.NFStreamer:
+    """
+    NFStreamer configuré pour le pipeline (mêmes paramètres pour l'export CSV et l'ingestion en mémoire).
+    """
+    return nfstream.NFStreamer(source=pcap_path, **STREAMER_SETTINGS)
+
+
 def pcap_to_csv(pcap_path:str, dest_folder:str, cleaning=False)->str:
     # read pcap file with nfstream
     # and write the flows to a CSV file
     # id,expiration_id,src_ip,src_mac,src_oui,src_port,dst_ip,dst_mac,dst_oui,dst_port,protocol,ip_version,vlan_id,tunnel_id,bidirectional_first_seen_ms,bidirectional_last_seen_ms,bidirectional_duration_ms,bidirectional_packets,bidirectional_bytes,src2dst_first_seen_ms,src2dst_last_seen_ms,src2dst_duration_ms,src2dst_packets,src2dst_bytes,dst2src_first_seen_ms,dst2src_last_seen_ms,dst2src_duration_ms,dst2src_packets,dst2src_bytes,application_name,application_category_name,application_is_guessed,application_confidence,requested_server_name,client_fingerprint,server_fingerprint,user_agent,content_type
     csv_name = os.path.join(dest_folder, os.path.basename(pcap_path).replace(".pcap", ".csv.temp"))
-    nfstream.NFStreamer(
-        source=pcap_path,
-        decode_tunnels=True,
-        idle_timeout=60,
-        active_timeout=120,
-        statistical_analysis=True
-    ).to_csv(csv_name)
+    get_streamer(pcap_path).to_csv(csv_name)
     if cleaning:
         csv_name = csv_cleaner(csv_name)
     else:
@@ -23,59 +40,124 @@ def pcap_to_csv(pcap_path:str, dest_folder:str, cleaning=False)->str:
     return csv_name
 
 
-def csv_cleaner(csv_path_in: str):
+def pcap_to_df(pcap_path: str, batch_size: int = 100_000) -> pd.DataFrame:
+    """
+    Lit un pcap avec nfstream et construit directement le DataFrame des flux, sans passer par un CSV temporaire.
+    Les flux sont accumulés par lots de batch_size pour limiter les objets Python vivants.
+
+    :param pcap_path: chemin du pcap
+    :param batch_size: nombre de flux par lot
+    :return: DataFrame des flux (mêmes colonnes que pcap_to_csv)
+    """
+    columns = None
+    batches = []
+    batch = []
+    for flow in get_streamer(pcap_path):
+        if columns is None:
+            columns = flow.keys()
+        batch.append(flow.values())
+        if len(batch) >= batch_size:
+            batches.append(pd.DataFrame.from_records(batch, columns=columns))
+            batch = []
+    if batch or not batches:
+        batches.append(pd.DataFrame.from_records(batch, columns=columns))
+    return pd.concat(batches, ignore_index=True)
+
+
+def clean_flows_df(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Nettoie un fichier CSV en supprimant les lign
+    Équivalent de csv_cleaner sur un DataFrame typé :
+      - une ligne à qui il manque au moins un tiers des champs est supprimée
+      - sinon, les champs manquants sont remplacés par 0 (colonnes numériques) ou '0' (colonnes texte),
+        de même que les champs texte vides
+    """
+    none_count = df.isna().sum(axis=1)
+    df = df[none_count < len(df.columns) / 3].copy()
+
+    for col in df.columns:
+        if pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = df[col].fillna(0)
+        else:
+            df[col] = df[col].fillna('0').replace('', '0')
+    return df
+
+
+def pcap_to_fan(pcap_path: str, dest_folder: str, time_window: int = 60, fmt: str = 'csv', pur_folder: str = None) -> str:
+    """
+    Phases 1 et 2 en mémoire : pcap -> flux nettoyés -> fan_in/fan_out, sans sérialisation texte intermédiaire.
+
+    :param pcap_path: chemin du pcap
+    :param dest_folder: dossier des fichiers enrichis (2.fan)
+    :param time_window: taille de la fenêtre temporelle en secondes
+    :param fmt: format de stockage de la sortie (voir storage.FORMATS)
+    :param pur_folder: si renseigné, les flux nettoyés (1.pur) y sont aussi sauvegardés
+    :return: chemin du fichier enrichi
+    """
+    csv_name = os.path.basename(pcap_path).replace(".pcap", ".csv")
+    df = clean_flows_df(pcap_to_df(pcap_path))
+    if pur_folder is not None:
+        write_table(df, os.path.join(pur_folder, csv_name), fmt)
+
+    df = compute_fan_features(df, time_window)
+    return write_table(df, os.path.join(dest_folder, csv_name), fmt)
+
+
+def detect_encoding(csv_path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Détecte une seule fois l'encodage d'un fichier : 'utf-8' s'il se décode entièrement, sinon 'latin-1'.
+    Le fichier est lu par blocs binaires (mémoire constante).
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        with open(csv_path, 'rb') as f:
+            while True:
+                block = f.read(chunk_size)
+                if not block:
+                    decoder.decode(b'', final=True)
+                    return 'utf-8'
+                decoder.decode(block)
+    except UnicodeDecodeError:
+        print("------   Erreur d'encodage UTF-8, essai avec latin-1  ------")
+        return 'latin-1'
+
+
+def csv_cleaner(csv_path_in: str, chunk_rows: int = 50_000):
+    """
+    Nettoie un fichier CSV en supprimant les lignes incomplètes, par blocs de chunk_rows lignes (mémoire constante) :
+      - une ligne à qui il manque au moins un tiers des champs est supprimée
+      - sinon, les champs manquants ou vides sont remplacés par '0'
     """
     csv_path_out = csv_path_in.replace(".temp", "")
-    reader = csv_to_reader(csv_path_in)
-    with open(csv_path_out, 'w+', encoding='utf-8', newline='') as outfile:
-
-        writer = csv.writer(outfile)
-
-        list_of_fields = reader[0].keys()
-        writer.writerow(list_of_fields)
-
-        r = 0
-        for row in reader:
-            r += 1
-            row_has_error = False
-            for field in list_of_fields:
-                #### RÉPARATION DE LIGNE INCOMPLETE
-                if row[field] == '':
-                    row[field] = '0'
-
-                # si ce n'est pas un nombre
-                # elif not row[field].isnumeric():
-                #     # si il manque un guillemet à la fin
-                #     if row[field][-1] != "'":
-                #         row[field] = row[field] + "'"
-                #     # si il manque un guillemet au début
-                #     if row[field][0] != "'":
-                #         row[field] = "'" + row[field]
-
-
-                ### VERIFICATION DU NOMBRE DE CHAMPS NONE
-                if row[field] is None:
-                    none_fields = []
-                    for _field in list_of_fields:
-                        if row[_field] is None:
-                            none_fields.append(_field)
-
-                    if len(none_fields) >= len(row)/3: # si plus d'un tiers des champs sont vides
-                        # on considère que la ligne est pourrie
-                        row_has_error = True
-                        # on arrête de chercher pour sortir plus vite
-                        break # break de : "for field in list_of_fields:"
-                    else:
-                        # on remplace les champs vides par des 0, car la ligne présente juste quelques valeurs vides
-                        for none_field in none_fields:
-                            row[none_field] = '0'
-
-            if not row_has_error:
-                writer.writerow([row[field] for field in list_of_fields])
-    # close the files
-    outfile.close()
+    encoding = detect_encoding(csv_path_in)
+
+    with open(csv_path_in, 'r', encoding=encoding, newline='') as infile, \
+            open(csv_path_out, 'w+', encoding='utf-8', newline='') as outfile:
+        reader = csv.reader(infile)
+        list_of_fields = next(reader, None)
+        if list_of_fields is None:
+            return csv_path_out
+        n_fields = len(list_of_fields)
+        csv.writer(outfile).writerow(list_of_fields)
+
+        while True:
+            # les lignes vides sont ignorées, comme avec csv.DictReader
+            rows = [row for row in itertools.islice(reader, chunk_rows) if row]
+            if not rows:
+                break
+
+            # les lignes trop courtes sont complétées par None, les champs en trop sont ignorés
+            chunk = pd.DataFrame(rows).reindex(columns=range(n_fields))
+
+            ### VERIFICATION DU NOMBRE DE CHAMPS NONE
+            none_count = chunk.isna().sum(axis=1)
+            # si plus d'un tiers des champs sont vides, on considère que la ligne est pourrie
+            chunk = chunk[none_count < n_fields / 3]
+
+            #### RÉPARATION DE LIGNE INCOMPLETE
+            chunk = chunk.fillna('0').replace('', '0')
+
+            chunk.to_csv(outfile, header=False, index=False, lineterminator='\r\n')
+
     # remove the temp file
     # os.remove(csv_path_in)
     return csv_path_out
@@ -105,9 +187,158 @@ def get_values(reader: list, key: str)->list:
 
 
 
-def add_fan_features(csv_path: str, destination,time_window: int = 60) -> str:
+def add_fan_features(csv_path: str, destination,time_window: int = 60, fmt: str = None) -> str:
+    """
+    Ajoute les colonnes fan-in et fan-out à un fichier CSV existant.
+
+    Args :
+        csv_path (str): Chemin vers le fichier CSV existant.
+        time_window (int): Taille de la fenêtre temporelle en secondes (par défaut 60).
+        fmt (str): Format de stockage de la sortie (voir storage.FORMATS), celui de l'entrée si None.
+
+    Returns :
+        str : Chemin vers le fichier enrichi avec fan-in et fan-out.
+    """
+    output_csv = os.path.join(destination, os.path.basename(csv_path))
+
+    # Charger le fichier CSV en DataFrame
+    df = read_table(csv_path)
+
+    df = compute_fan_features(df, time_window)
+
+    # Sauvegarder le fichier enrichi
+    return write_table(df, output_csv, fmt)
+
+
+def compute_fan_features(df: pd.DataFrame, time_window: int = 60) -> pd.DataFrame:
+    """
+    Calcule fan_in / fan_out par balayage (sweep-line) au lieu de re-filtrer le DataFrame pour chaque flux.
+
+    Pour un flux à l'instant t, la fenêtre est [t - time_window, t + time_window] (bornes incluses) :
+      - fan_out : nombre d'IP destination distinctes contactées par sa src_ip dans la fenêtre
+      - fan_in : nombre d'IP source distinctes ayant contacté sa dst_ip dans la fenêtre
+    Les résultats sont identiques à OLD_add_fan_features, en O(n log n) (tri) + O(n) (balayage).
+
+    :param df: DataFrame des flux (colonnes src_ip, dst_ip, bidirectional_first_seen_ms)
+    :param time_window: Taille de la fenêtre temporelle en secondes
+    :return: DataFrame trié par temps avec les colonnes fan_out et fan_in
+    """
+    time_window_ms = time_window * 1000
+
+    # Trier les données par temps (même tri que l'ancienne version pour un ordre de sortie identique)
+    df = df.sort_values(by='bidirectional_first_seen_ms')
+
+    times = df['bidirectional_first_seen_ms'].to_numpy()
+    n = len(times)
+
+    # Bornes de la fenêtre de chaque flux : [lo, hi[ en indices dans l'ordre trié
+    lo = np.searchsorted(times, times - time_window_ms, side='left')
+    hi = np.searchsorted(times, times + time_window_ms, side='right')
+
+    # Encodage des IP en entiers (NaN garde son propre code, comme dans unique()).
+    # Les clés entières sont conservées dans la sortie pour être réutilisées par les étapes suivantes.
+    df = add_ip_int_columns(df)
+    src_codes, src_uniques = pd.factorize(df['src_ip_int'].to_numpy())
+    dst_codes, dst_uniques = pd.factorize(df['dst_ip_int'].to_numpy())
+    n_dst = len(dst_uniques)
+    # Un identifiant par couple (src, dst)
+    pair_codes, pair_uniques = pd.factorize(src_codes.astype(np.int64) * n_dst + dst_codes)
+
+    src = src_codes.tolist()
+    dst = dst_codes.tolist()
+    pair = pair_codes.tolist()
+    lo = lo.tolist()
+    hi = hi.tolist()
+
+    # Compteurs de la fenêtre courante
+    pair_count = [0] * len(pair_uniques)  # occurrences de chaque couple (src, dst)
+    distinct_dst = [0] * len(src_uniques)  # nombre de dst distinctes par src
+    distinct_src = [0] * n_dst  # nombre de src distinctes par dst
+
+    fan_out = [0] * n
+    fan_in = [0] * n
+    enter = 0  # prochain flux à faire entrer dans la fenêtre
+    leave = 0  # prochain flux à faire sortir de la fenêtre
+    for i in range(n):
+        # Entrées : flux dont le temps est <= t + time_window
+        while enter < hi[i]:
+            p = pair[enter]
+            if pair_count[p] == 0:
+                distinct_dst[src[enter]] += 1
+                distinct_src[dst[enter]] += 1
+            pair_count[p] += 1
+            enter += 1
+        # Sorties : flux dont le temps est < t - time_window
+        while leave < lo[i]:
+            p = pair[leave]
+            pair_count[p] -= 1
+            if pair_count[p] == 0:
+                distinct_dst[src[leave]] -= 1
+                distinct_src[dst[leave]] -= 1
+            leave += 1
+
+        fan_out[i] = distinct_dst[src[i]]
+        fan_in[i] = distinct_src[dst[i]]
+
+    df['fan_out'] = fan_out
+    df['fan_in'] = fan_in
+
+    # Une IP ou un temps manquant ne correspond à aucun flux (NaN != NaN dans l'ancienne version)
+    no_time = df['bidirectional_first_seen_ms'].isna()
+    df.loc[df['src_ip'].isna() | no_time, 'fan_out'] = 0
+    df.loc[df['dst_ip'].isna() | no_time, 'fan_in'] = 0
+
+    return df
+
+
+def stream_fan_features(batches, time_window: int = 60):
+    """
+    compute_fan_features appliqué bloc par bloc à une suite de DataFrames triés par bidirectional_first_seen_ms
+    (ex. export paginé d'Elasticsearch), sans charger tous les flux : un flux est émis dès que tous les flux
+    de sa fenêtre ont été lus, avec les mêmes fan_in / fan_out que compute_fan_features sur l'ensemble.
+    Seuls les flux à moins d'une fenêtre des flux en attente sont conservés d'un bloc à l'autre.
+
+    :param batches: itérable de DataFrames, chacun commençant au plus tôt à la fin du précédent
+    :param time_window: Taille de la fenêtre temporelle en secondes
+    :return: générateur de DataFrames (flux enrichis de fan_out et fan_in, triés par temps)
+    """
+    time_window_ms = time_window * 1000
+    carry = None  # flux du bloc précédent : en attente, ou déjà émis et gardés comme contexte
+    last_time = None
+    for batch in batches:
+        if len(batch) == 0:
+            continue
+        first_time = batch['bidirectional_first_seen_ms'].min()
+        if last_time is not None and first_time < last_time:
+            raise ValueError("Les blocs de flux doivent être triés par bidirectional_first_seen_ms")
+        batch = batch.assign(_emitted=False)
+        df = batch if carry is None else pd.concat([carry, batch])
+        df = df.reset_index(drop=True)
+        last_time = df['bidirectional_first_seen_ms'].max()
+
+        fan = compute_fan_features(df, time_window)
+        times = fan['bidirectional_first_seen_ms']
+        # Fenêtre complète : les flux suivants commencent au plus tôt à last_time > t + time_window
+        # (sans horodatage : fan_in / fan_out nuls, émis tout de suite)
+        ready = ~fan['_emitted'] & (times.isna() | (times + time_window_ms < last_time))
+        if ready.any():
+            yield fan[ready].drop(columns='_emitted').reset_index(drop=True)
+
+        pending = ~fan['_emitted'] & ~ready
+        start = times[pending].min() if pending.any() else last_time
+        keep = times >= start - time_window_ms
+        carry = df.loc[fan.index[keep]].assign(_emitted=~pending[keep].to_numpy())
+
+    if carry is not None and not carry['_emitted'].all():
+        fan = compute_fan_features(carry, time_window)
+        yield fan[~fan['_emitted']].drop(columns='_emitted').reset_index(drop=True)
+
+
+def OLD_add_fan_features(csv_path: str, destination,time_window: int = 60) -> str:
     """
     Ajoute les colonnes fan-in et fan-out à un fichier CSV existant.
+    Ancienne version en O(n²) (re-filtrage du DataFrame pour chaque flux),
+    conservée comme référence pour le benchmark.
 
     Args :
         csv_path (str): Chemin vers le fichier CSV existant.
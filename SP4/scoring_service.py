@@ -0,0 +1,361 @@
+import argparse
+import json
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from model_bundle import get_bundle, score_flows
+from tools import get_app_list, get_categorical_cols, get_numeric_cols
+
+
+class MicroBatcher:
+    """
+    Regroupe les requêtes reçues dans une courte fenêtre (max_wait_ms) ou jusqu'à max_batch_rows flux,
+    pour amortir le coût de predict_proba sur un lot plus gros.
+    Les modèles restent en mémoire (registre de ModelBundle) pendant toute la durée du service.
+    """
+
+    def __init__(self, train_vectorized_dir, models_dir, app_names=None, max_batch_rows=5000, max_wait_ms=10,
+                 latency_window=10000):
+        self.train_vectorized_dir = train_vectorized_dir
+        self.models_dir = models_dir
+        self.categorical_cols = get_categorical_cols()
+        self.numeric_cols = get_numeric_cols()
+        self.max_batch_rows = max_batch_rows
+        self.max_wait_ms = max_wait_ms
+
+        self._pending = queue.Queue()
+        self._latencies_ms = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+        self._started_at = time.perf_counter()
+        self._nb_flows = 0
+        self._nb_requests = 0
+        self._nb_batches = 0
+
+        # Chargement des modèles au démarrage (et non à la première requête) ;
+        # les flux des applications sans modèle reçoivent label = -1
+        self.app_names = [
+            app_name for app_name in (app_names or get_app_list())
+            if get_bundle(app_name, train_vectorized_dir, models_dir, self.categorical_cols, self.numeric_cols)
+        ]
+        print(f"Modèles chargés : {self.app_names}")
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, flows: list[dict]) -> list[dict]:
+        """
+        Soumet une requête (liste de flux au format nfstream) et attend son résultat.
+        :return: une entrée {label, proba} par flux, dans l'ordre ; label = -1 si le flux n'a pas pu être scoré
+        """
+        check_flows(flows)
+        request = {
+            'flows': flows,
+            'done': threading.Event(),
+            'result': None,
+            'error': None,
+            'start': time.perf_counter(),
+        }
+        self._pending.put(request)
+        request['done'].wait()
+        if request['error'] is not None:
+            raise request['error']
+        return request['result']
+
+    def _collect(self) -> list[dict]:
+        batch = [self._pending.get()]
+        nb_rows = len(batch[0]['flows'])
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while nb_rows < self.max_batch_rows:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            nb_rows += len(request['flows'])
+        return batch
+
+    def _run(self):
+        # Aucune requête ne doit pouvoir arrêter la boucle : sans elle, toutes les requêtes suivantes attendent
+        while True:
+            batch = []
+            try:
+                batch = self._collect()
+                self._score_isolated(batch)
+            except Exception as e:
+                for request in batch:
+                    request['error'] = e
+            finally:
+                end = time.perf_counter()
+                with self._lock:
+                    self._nb_batches += 1
+                    for request in batch:
+                        self._nb_requests += 1
+                        self._nb_flows += len(request['flows'])
+                        self._latencies_ms.append((end - request['start']) * 1000)
+                for request in batch:
+                    request['done'].set()
+
+    def _score_isolated(self, batch: list[dict]):
+        """
+        Score un lot ; si le lot échoue, chaque requête est scorée seule : seule la requête en cause reçoit l'erreur.
+        """
+        try:
+            self._score_batch(batch)
+        except Exception:
+            if len(batch) == 1:
+                raise
+            for request in batch:
+                try:
+                    self._score_batch([request])
+                except Exception as e:
+                    request['error'] = e
+
+    def _request_frame(self, flows: list[dict]) -> pd.DataFrame:
+        """
+        Flux d'une requête réduits aux colonnes utilisées par les modèles : les champs supplémentaires d'un client
+        ne créent pas de colonnes (NaN) pour les autres requêtes du lot. Les valeurs numériques invalides
+        (ex. texte) deviennent manquantes ; les flux incomplets sont retirés ici, requête par requête
+        (ils reçoivent label = -1).
+        """
+        columns = list(dict.fromkeys(["application_name"] + self.categorical_cols + self.numeric_cols))
+        df = pd.DataFrame.from_records(flows, columns=columns)
+        df[self.numeric_cols] = df[self.numeric_cols].apply(pd.to_numeric, errors='coerce')
+        return df.dropna(how='any')
+
+    def _score_batch(self, batch: list[dict]):
+        frames = [self._request_frame(request['flows']) for request in batch]
+        offsets = np.cumsum([0] + [len(request['flows']) for request in batch])
+        # Index du lot : position du flux dans la concaténation des requêtes
+        df = pd.concat([frame.set_axis(frame.index + offset) for frame, offset in zip(frames, offsets)])
+
+        labels = np.full(offsets[-1], -1, dtype=int)
+        probas = np.zeros(offsets[-1])
+        if len(df):
+            # Un même flux envoyé plusieurs fois (par une ou plusieurs requêtes) n'est scoré qu'une fois :
+            # le nettoyage de vectorize_flows (drop_duplicates) ne retire donc aucune ligne du lot
+            groups = df.groupby(list(df.columns), sort=False, dropna=False).ngroup().to_numpy()
+            unique_df = df[~df.duplicated()].reset_index(drop=True)
+            scores = score_flows(unique_df, self.app_names, self.train_vectorized_dir, self.models_dir,
+                                 self.categorical_cols, self.numeric_cols)
+            group_labels = np.full(len(unique_df), -1, dtype=int)
+            group_probas = np.zeros(len(unique_df))
+            group_labels[scores.index.to_numpy()] = scores['label'].to_numpy()
+            group_probas[scores.index.to_numpy()] = scores['proba'].to_numpy()
+            labels[df.index.to_numpy()] = group_labels[groups]
+            probas[df.index.to_numpy()] = group_probas[groups]
+
+        for request, start, end in zip(batch, offsets[:-1], offsets[1:]):
+            request['result'] = [
+                {'label': int(label), 'proba': float(proba)}
+                for label, proba in zip(labels[start:end], probas[start:end])
+            ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = np.array(self._latencies_ms)
+            elapsed = time.perf_counter() - self._started_at
+            return {
+                'requests': self._nb_requests,
+                'batches': self._nb_batches,
+                'flows': self._nb_flows,
+                'throughput_flows_s': self._nb_flows / elapsed if elapsed > 0 else 0.0,
+                'latency_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                'latency_p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+            }
+
+
+def check_flows(flows) -> list[dict]:
+    """
+    Vérifie qu'une requête est une liste de flux (objets JSON).
+    :raise ValueError: sinon
+    """
+    if not isinstance(flows, list):
+        raise ValueError(f"liste de flux attendue, {type(flows).__name__} reçu")
+    for position, flow in enumerate(flows):
+        if not isinstance(flow, dict):
+            raise ValueError(f"flux {position} : objet attendu, {type(flow).__name__} reçu")
+    return flows
+
+
+def parse_flows(body: bytes, content_type: str = "") -> list[dict]:
+    """
+    Décode une requête : tableau JSON de flux, objet {"flows": [...]}, ou NDJSON (un flux par ligne).
+    :raise ValueError: si le contenu n'est pas une liste de flux
+    """
+    text = body.decode('utf-8')
+    if 'ndjson' in content_type:
+        return check_flows([json.loads(line) for line in text.splitlines() if line.strip()])
+    try:
+        payload = json.loads(text)
+    except json.JSONDecodeError:
+        return check_flows([json.loads(line) for line in text.splitlines() if line.strip()])
+    if isinstance(payload, dict):
+        payload = payload.get('flows', [payload])
+    return check_flows(payload)
+
+
+def make_handler(batcher: MicroBatcher):
+    class ScoringHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._send_json(200, batcher.stats())
+            elif self.path == '/health':
+                self._send_json(200, {'status': 'ok'})
+            else:
+                self._send_json(404, {'error': f"route inconnue : {self.path}"})
+
+        def do_POST(self):
+            if self.path != '/score':
+                self._send_json(404, {'error': f"route inconnue : {self.path}"})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                flows = parse_flows(self.rfile.read(length), self.headers.get('Content-Type', ''))
+            except (ValueError, json.JSONDecodeError) as e:
+                self._send_json(400, {'error': f"requête invalide : {e}"})
+                return
+            try:
+                self._send_json(200, {'results': batcher.submit(flows)})
+            except Exception as e:
+                self._send_json(500, {'error': f"{type(e).__name__}: {e}"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return ScoringHandler
+
+
+def start_service(train_vectorized_dir, models_dir, host="127.0.0.1", port=0, max_batch_rows=5000, max_wait_ms=10):
+    """
+    Démarre le service de scoring dans un thread (port 0 : port libre choisi par le système), ex. pour le tester
+    avec le client local.
+    :return: (serveur, url)
+    """
+    batcher = MicroBatcher(train_vectorized_dir, models_dir, max_batch_rows=max_batch_rows, max_wait_ms=max_wait_ms)
+    server = ThreadingHTTPServer((host, port), make_handler(batcher))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def serve(train_vectorized_dir, models_dir, host="127.0.0.1", port=8765, max_batch_rows=5000, max_wait_ms=10):
+    """
+    Lance le service de scoring (bloquant) :
+      - POST /score : flux au format JSON ou NDJSON -> {"results": [{label, proba}, ...]}
+      - GET /stats : latence p50/p99 et débit
+    """
+    batcher = MicroBatcher(train_vectorized_dir, models_dir, max_batch_rows=max_batch_rows, max_wait_ms=max_wait_ms)
+    server = ThreadingHTTPServer((host, port), make_handler(batcher))
+    print(f"Service de scoring à l'écoute sur http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def score_client(url: str, flows: list[dict], ndjson=False) -> list[dict]:
+    """
+    Client local : envoie des flux au service et retourne les résultats.
+    """
+    if ndjson:
+        body = "\n".join(json.dumps(flow) for flow in flows).encode('utf-8')
+        content_type = 'application/x-ndjson'
+    else:
+        body = json.dumps(flows).encode('utf-8')
+        content_type = 'application/json'
+    request = urllib.request.Request(url.rstrip('/') + '/score', data=body, headers={'Content-Type': content_type})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())['results']
+
+
+def get_stats(url: str) -> dict:
+    with urllib.request.urlopen(url.rstrip('/') + '/stats') as response:
+        return json.loads(response.read())
+
+
+def check_batch_isolation(url: str, flows: list[dict]) -> dict:
+    """
+    Test avec le client local : le résultat d'une requête ne doit pas dépendre des autres requêtes du même lot.
+    Les flux sont d'abord scorés seuls, puis envoyés en même temps par quatre clients : deux avec les mêmes flux,
+    un troisième avec un champ supplémentaire, un quatrième avec des valeurs numériques invalides (texte) ;
+    les trois premiers doivent recevoir les résultats de la requête seule, le quatrième label = -1.
+    Le service doit regrouper les requêtes (max_wait_ms de quelques dizaines de ms).
+    :return: dict (nombre de flux, résultats différents par client, parité)
+    """
+    reference = score_client(url, flows)
+    requests = {
+        'same_flows_1': flows,
+        'same_flows_2': flows,
+        'extra_field': [{**flow, 'extra_field': 'x'} for flow in flows],
+        'bad_types': [{**flow, 'bidirectional_bytes': 'abc'} for flow in flows],
+    }
+    results = {}
+
+    def send(name):
+        try:
+            results[name] = score_client(url, requests[name])
+        except urllib.error.HTTPError as e:
+            results[name] = [{'error': e.code}] * len(requests[name])
+
+    threads = [threading.Thread(target=send, args=(name,)) for name in requests]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    expected = {name: reference for name in requests}
+    expected['bad_types'] = [{'label': -1, 'proba': 0.0}] * len(flows)
+    mismatches = {name: sum(r != ref for r, ref in zip(results.get(name, []), expected[name]))
+                  + abs(len(results.get(name, [])) - len(flows)) for name in requests}
+    return {'flows': len(flows), 'mismatches': mismatches, 'ok': not any(mismatches.values())}
+
+
+def replay_csv(url: str, csv_path: str, batch_size: int = 200) -> dict:
+    """
+    Rejoue un CSV de flux (ex. dataset_test/2.fan) vers le service par requêtes de batch_size flux.
+    :return: statistiques du service après le rejeu
+    """
+    df = pd.read_csv(csv_path, on_bad_lines='skip')
+    records = json.loads(df.to_json(orient='records'))
+    for start in range(0, len(records), batch_size):
+        score_client(url, records[start:start + batch_size])
+    return get_stats(url)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Service de scoring des flux")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--models-dir", default="../models/rf")
+    parser.add_argument("--vectorized-dir", default="../dataset_train/csv/5.vectorized")
+    parser.add_argument("--max-batch-rows", type=int, default=5000)
+    parser.add_argument("--max-wait-ms", type=float, default=10)
+    parser.add_argument("--check", metavar="CSV", help="lance check_batch_isolation sur les flux du CSV puis s'arrête")
+    args = parser.parse_args()
+
+    if args.check:
+        server, url = start_service(args.vectorized_dir, args.models_dir, args.host, 0, args.max_batch_rows,
+                                    max(args.max_wait_ms, 50))
+        records = json.loads(pd.read_csv(args.check, on_bad_lines='skip').to_json(orient='records'))
+        print(check_batch_isolation(url, records[:200]))
+        server.shutdown()
+    else:
+        serve(args.vectorized_dir, args.models_dir, args.host, args.port, args.max_batch_rows, args.max_wait_ms)
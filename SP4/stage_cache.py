@@ -0,0 +1,156 @@
+import hashlib
+import inspect
+import json
+import os
+import sys
+from functools import partial
+
+# Manifeste du cache, écrit dans le dossier de sortie de chaque étape (ignoré par storage.list_tables)
+MANIFEST_NAME = ".stage_manifest.json"
+
+_BLOCK_SIZE = 1 << 20
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _sha256_json(obj) -> str:
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def code_version(func, modules=()) -> str:
+    """
+    Version du code d'une étape : hash des sources du module de func et des modules dont elle dépend.
+
+    :param func: fonction de l'étape (éventuellement un functools.partial)
+    :param modules: noms des modules supplémentaires (ex. 'pcapLoader', 'storage')
+    :return: hash hexadécimal
+    """
+    while isinstance(func, partial):
+        func = func.func
+    sources = {inspect.getsourcefile(func)}
+    for name in modules:
+        module = sys.modules.get(name) or __import__(name)
+        sources.add(inspect.getsourcefile(module))
+    digest = hashlib.sha256()
+    for source in sorted(os.path.abspath(s) for s in sources):
+        with open(source, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class StageCache:
+    """
+    Cache incrémental d'une étape du pipeline, adressé par contenu.
+
+    La clé d'une tâche combine le hash du contenu de ses entrées (fichiers ou dossiers),
+    les paramètres de l'étape et la version du code. Si la clé est identique à celle du manifeste
+    et que les sorties enregistrées sont toujours présentes et inchangées, la tâche n'est pas relancée.
+
+    Les hash de fichiers sont mémorisés avec (taille, date de modification) : un fichier inchangé n'est pas relu.
+    """
+
+    def __init__(self, output_dir, etape, params, version, input_of=None):
+        """
+        :param output_dir: dossier de sortie de l'étape (contient le manifeste)
+        :param etape: nom ou numéro de l'étape
+        :param params: dict des paramètres influençant les sorties (fenêtre, colonnes, format...)
+        :param version: version du code (voir code_version)
+        :param input_of: fonction args -> chemin ou liste de chemins d'entrée de la tâche (args[0] par défaut)
+        """
+        self.manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+        self.etape = str(etape)
+        self.params_key = _sha256_json({'params': params, 'version': version})
+        self.input_of = input_of or (lambda args: args[0])
+        self.nb_hits = 0
+        self.nb_misses = 0
+
+        self.manifest = {'digests': {}, 'stages': {}}
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, encoding='utf-8') as f:
+                    self.manifest = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                print(f"Manifeste illisible, ignoré : {self.manifest_path}")
+        self.entries = self.manifest['stages'].setdefault(self.etape, {})
+
+    def file_digest(self, path: str) -> str:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        known = self.manifest['digests'].get(path)
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            return known['sha256']
+        digest = _sha256_file(path)
+        self.manifest['digests'][path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+        return digest
+
+    def path_digest(self, path: str) -> str:
+        """
+        Hash d'un fichier, ou d'un dossier (noms relatifs et contenus de tous ses fichiers, hors manifeste).
+        """
+        if not os.path.exists(path):
+            return "absent"
+        if os.path.isfile(path):
+            return self.file_digest(path)
+        entries = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name == MANIFEST_NAME:
+                    continue
+                file_path = os.path.join(root, name)
+                entries.append((os.path.relpath(file_path, path), self.file_digest(file_path)))
+        return _sha256_json(entries)
+
+    def task_key(self, args) -> str:
+        inputs = self.input_of(args)
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        return _sha256_json([self.params_key] + [self.path_digest(path) for path in inputs])
+
+    def lookup(self, args):
+        """
+        :return: (clé de la tâche, résultat enregistré si les sorties sont valides sinon None)
+        """
+        key = self.task_key(args)
+        entry = self.entries.get(str(args[0]))
+        if entry is not None and entry['key'] == key and self._outputs_valid(entry['outputs']):
+            self.nb_hits += 1
+            return key, entry['result']
+        self.nb_misses += 1
+        return key, None
+
+    def _outputs_valid(self, outputs: dict) -> bool:
+        for path, digest in outputs.items():
+            if not os.path.isfile(path) or self.file_digest(path) != digest:
+                return False
+        return True
+
+    def record(self, args, key, result):
+        """
+        Enregistre le résultat d'une tâche réussie (chemin ou liste de chemins des fichiers produits).
+        """
+        paths = [result] if isinstance(result, str) else list(result or [])
+        outputs = {os.path.abspath(p): self.file_digest(p) for p in paths if isinstance(p, str) and os.path.isfile(p)}
+        self.entries[str(args[0])] = {'key': key, 'result': result, 'outputs': outputs}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+        temp_path = self.manifest_path + ".temp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(temp_path, self.manifest_path)
+
+
+def get_stage_cache(enabled, output_dir, etape, func, params, modules=(), input_of=None):
+    """
+    Construit le StageCache d'une étape, ou None si le cache est désactivé.
+    """
+    if not enabled:
+        return None
+    return StageCache(output_dir, etape, params, code_version(func, modules), input_of)
@@ -0,0 +1,108 @@
+import csv
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from instrumentation import current_report, measure_task
+from storage import io_stats
+
+
+def _run_task(func, args, profile_path=None):
+    """
+    Exécute une tâche, mesure son coût et capture son erreur éventuelle (exécuté dans le processus worker).
+    :return: (succès, résultat, message d'erreur, mesures)
+    """
+    try:
+        result, metrics = measure_task(func, args, io_stats, profile_path)
+        return True, result, "", metrics
+    except Exception as e:
+        traceback.print_exc()
+        return False, None, f"{type(e).__name__}: {e}", None
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def jobs_per_worker(n_jobs=-1, workers=1) -> int:
+    """
+    n_jobs (joblib) d'une tâche exécutée par run_stage : avec workers > 1, au plus cpu_count // workers,
+    pour que les tâches simultanées n'utilisent pas chacune tous les cœurs (workers x cœurs processus).
+    :param n_jobs: valeur demandée (négative ou None : tous les cœurs disponibles pour la tâche)
+    """
+    if workers is None or workers <= 0:
+        workers = default_workers()
+    if workers <= 1:
+        return n_jobs
+    cap = max(1, default_workers() // workers)
+    return cap if n_jobs is None or n_jobs < 0 else min(n_jobs, cap)
+
+
+def run_stage(func, tasks, etape, log_file=None, workers=1, cache=None):
+    """
+    Exécute une étape du pipeline sur une liste de tâches indépendantes (un fichier ou une application par tâche).
+    Avec workers > 1, les tâches sont réparties sur un pool de processus.
+    Chaque tâche est tracée dans log_file (date,etape,fichier,statut,erreur), dans l'ordre des tâches.
+
+    :param func: fonction de l'étape (doit être définie au niveau module pour être envoyée aux workers)
+    :param tasks: liste de tuples d'arguments ; le premier argument identifie la tâche dans le log
+    :param etape: numéro de l'étape (pour le log)
+    :param log_file: fichier de log ouvert en écriture (ou None)
+    :param workers: nombre de processus (1 = exécution séquentielle dans le processus courant)
+    :param cache: StageCache de l'étape (ou None) : les tâches dont les sorties sont à jour ne sont pas relancées
+    :return: liste des résultats des tâches réussies, dans l'ordre des tâches
+    """
+    tasks = [tuple(args) for args in tasks]
+    if workers is None or workers <= 0:
+        workers = default_workers()
+    # Mesures par tâche ajoutées au rapport en cours (voir instrumentation.RunReport)
+    report = current_report()
+
+    # Résultats déjà en cache (statut "cache"), les autres tâches sont à exécuter
+    outcomes = [None] * len(tasks)
+    keys = [None] * len(tasks)
+    if cache is not None:
+        for i, args in enumerate(tasks):
+            keys[i], cached = cache.lookup(args)
+            if cached is not None:
+                outcomes[i] = (True, cached, "", None)
+    todo = [i for i, outcome in enumerate(outcomes) if outcome is None]
+    todo_tasks = [tasks[i] for i in todo]
+    profile_paths = [report.profile_path(etape, args[0]) if report is not None else None for args in todo_tasks]
+
+    in_workers = not (workers == 1 or len(todo_tasks) <= 1)
+    if not in_workers:
+        todo_outcomes = [_run_task(func, args, path) for args, path in zip(todo_tasks, profile_paths)]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo_tasks))) as executor:
+            todo_outcomes = list(executor.map(_run_task, [func] * len(todo_tasks), todo_tasks, profile_paths))
+    for i, outcome in zip(todo, todo_outcomes):
+        outcomes[i] = outcome
+        if cache is not None and outcome[0]:
+            cache.record(tasks[i], keys[i], outcome[1])
+
+    if cache is not None:
+        cache.save()
+        print(f"Cache étape {etape} : {cache.nb_hits} tâche(s) à jour, {len(todo)} recalculée(s)")
+
+    todo = set(todo)
+    writer = csv.writer(log_file) if log_file is not None else None
+    results = []
+    for i, (args, (success, result, error, metrics)) in enumerate(zip(tasks, outcomes)):
+        date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if success:
+            results.append(result)
+            status = "ok" if i in todo else "cache"
+        else:
+            print(f"{date},{etape},{args[0]},{error}")
+            status = "erreur"
+        if writer is not None:
+            writer.writerow([date, etape, args[0], status, error])
+        if report is not None:
+            report.add_task(etape, args[0], status, dict(metrics or {}, worker=in_workers))
+
+    if log_file is not None:
+        log_file.flush()
+
+    return results
@@ -0,0 +1,186 @@
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+# Formats de stockage des sorties d'étapes : nom -> extension
+FORMATS = {
+    'csv': '.csv',
+    'parquet': '.parquet',
+}
+DEFAULT_FORMAT = 'csv'
+
+# Extension des matrices creuses vectorisées (voir write_sparse)
+SPARSE_EXT = '.npz'
+
+# Compression du format colonnaire (les matrices one-hot, très creuses, se compressent très bien)
+PARQUET_COMPRESSION = 'zstd'
+
+# Compteurs d'entrées/sorties du processus courant (remis à zéro et relevés par tâche, voir instrumentation)
+io_stats = {
+    'rows_read': 0,
+    'rows_written': 0,
+    'bytes_read': 0,
+    'bytes_written': 0,
+}
+
+
+def _count_io(direction: str, path: str, nb_rows: int):
+    io_stats[f'rows_{direction}'] += nb_rows
+    io_stats[f'bytes_{direction}'] += os.path.getsize(path)
+
+
+def format_of(path: str) -> str:
+    """
+    Retourne le format d'un fichier d'après son extension.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    for fmt, fmt_ext in FORMATS.items():
+        if ext == fmt_ext:
+            return fmt
+    raise ValueError(f"Format de fichier non supporté : {path}")
+
+
+def with_format(path: str, fmt: str) -> str:
+    """
+    Remplace l'extension de path par celle du format fmt.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Format inconnu : {fmt} (formats disponibles : {list(FORMATS)})")
+    return os.path.splitext(path)[0] + FORMATS[fmt]
+
+
+def is_table(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in FORMATS.values()
+
+
+def list_tables(folder: str, fmt: str = None) -> list[str]:
+    """
+    Liste (triés) les fichiers de sortie d'étape d'un dossier.
+    :param fmt: format de l'exécution en cours (seuls ses fichiers sont listés), tous formats confondus si None
+    """
+    if fmt is not None:
+        ext = with_format('', fmt)
+        return [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.lower().endswith(ext)]
+    return [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if is_table(f)]
+
+
+def resolve_table(path: str, fmt: str = None) -> str:
+    """
+    Retrouve un fichier de sortie (path avec ou sans extension).
+    :param fmt: format attendu ; si None, le premier format trouvé dans l'ordre de FORMATS
+    """
+    formats = [fmt] if fmt is not None else list(FORMATS)
+    if is_table(path) and format_of(path) in formats and os.path.exists(path):
+        return path
+    for candidate_fmt in formats:
+        candidate = with_format(path, candidate_fmt)
+        if os.path.exists(candidate):
+            return candidate
+    raise FileNotFoundError(f"Aucun fichier trouvé pour {path} (formats : {formats})")
+
+
+def _check_parquet():
+    if importlib.util.find_spec("pyarrow") is None:
+        raise ImportError("Le format 'parquet' nécessite pyarrow (pip install pyarrow)")
+
+
+def _prepare_for_parquet(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Les colonnes 'object' de pd.read_csv peuvent mélanger str et nombres (ex. '0' de remplissage) :
+    on les convertit en str (hors valeurs manquantes) pour obtenir une colonne typée.
+    """
+    object_cols = [col for col in df.columns if df[col].dtype == object]
+    if not object_cols:
+        return df
+    df = df.copy()
+    for col in object_cols:
+        df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def read_table(path: str, columns=None, **csv_kwargs) -> pd.DataFrame:
+    """
+    Lit une sortie d'étape, le format étant déduit de l'extension.
+
+    :param path: chemin du fichier
+    :param columns: colonnes à lire (projection), toutes si None
+    :param csv_kwargs: options supplémentaires de pd.read_csv (ignorées pour les formats binaires)
+    :return: DataFrame
+    """
+    fmt = format_of(path)
+    if fmt == 'parquet':
+        _check_parquet()
+        df = pd.read_parquet(path, columns=columns, engine='pyarrow')
+    else:
+        df = pd.read_csv(path, usecols=columns, **csv_kwargs)
+    _count_io('read', path, len(df))
+    return df
+
+
+def write_table(df: pd.DataFrame, path: str, fmt: str = None) -> str:
+    """
+    Écrit une sortie d'étape dans le format demandé. La même sortie dans un autre format (exécution précédente)
+    est supprimée : elle serait sinon relue à la place de la nouvelle (resolve_table, list_tables).
+
+    :param df: DataFrame à écrire
+    :param path: chemin de destination (l'extension est remplacée selon fmt)
+    :param fmt: format ('csv', 'parquet'), déduit de l'extension de path si None
+    :return: chemin du fichier écrit
+    """
+    if fmt is None:
+        fmt = format_of(path) if is_table(path) else DEFAULT_FORMAT
+    path = with_format(path, fmt)
+    if fmt == 'parquet':
+        _check_parquet()
+        _prepare_for_parquet(df).to_parquet(path, index=False, engine='pyarrow', compression=PARQUET_COMPRESSION)
+    else:
+        df.to_csv(path, index=False)
+    for other_fmt in FORMATS:
+        stale = with_format(path, other_fmt)
+        if other_fmt != fmt and os.path.exists(stale):
+            os.remove(stale)
+    _count_io('written', path, len(df))
+    return path
+
+
+def write_sparse(x, feature_names, y, path: str) -> str:
+    """
+    Sauvegarde une matrice vectorisée creuse (CSR), les noms de ses colonnes et les labels
+    dans un seul fichier binaire compressé (.npz).
+
+    :param x: matrice creuse SciPy
+    :param feature_names: noms des colonnes de x
+    :param y: labels (ou None)
+    :param path: chemin de destination (l'extension est remplacée par .npz)
+    :return: chemin du fichier écrit
+    """
+    path = os.path.splitext(path)[0] + SPARSE_EXT
+    x = sp.csr_matrix(x)
+    arrays = {
+        'data': x.data,
+        'indices': x.indices,
+        'indptr': x.indptr,
+        'shape': np.array(x.shape),
+        'feature_names': np.array(feature_names, dtype=str),
+    }
+    if y is not None:
+        arrays['label'] = np.asarray(y)
+    np.savez_compressed(path, **arrays)
+    _count_io('written', path, x.shape[0])
+    return path
+
+
+def read_sparse(path: str) -> tuple:
+    """
+    Relit un fichier écrit par write_sparse.
+    :return: (matrice CSR, noms des colonnes, labels ou None)
+    """
+    with np.load(path, allow_pickle=False) as arrays:
+        x = sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(arrays['shape']))
+        feature_names = list(arrays['feature_names'])
+        y = arrays['label'] if 'label' in arrays else None
+    _count_io('read', path, x.shape[0])
+    return x, feature_names, y
@@ -1,6 +1,8 @@
+import argparse
 import json
 import os
 from datetime import datetime
+from functools import partial
 import sys
 from evaluation import evaluate_flows
 
@@ -13,15 +15,24 @@ from tools import *
 from SP4.pcapLoader import *
 from SP4.labeling import *
 from SP4.vectorization import *
-from labeling import label_flows
+from labeling import label_flows, compile_ground_truth
 from vectorization import vectorize_flows
-from cross_validation_setup import train_rf, train_naive_bayes, train_knn
-
-
-def pipeline(limit, start_at_phase, stop_at_phase, is_test=False, model_type='rf'):
+from cross_validation_setup import train_rf, train_rf_apps, train_naive_bayes, train_knn
+from hyperparameter_search import SEARCH_MODES
+from stage_executor import jobs_per_worker, run_stage
+from stage_cache import get_stage_cache
+from instrumentation import RunReport
+from training_session import (MODEL_TYPES, TrainingSession, charger_vectorise, sauvegarder_modele,
+                              sauvegarder_rf_partage, search_cache_params)
+from storage import FORMATS, list_tables, read_table, write_sparse, write_table
+
+
+def pipeline(limit, start_at_phase, stop_at_phase, is_test=False, model_type='rf', workers=1,
+             storage_format='csv', in_memory=False, persist_pur=False, sparse=False, multi_match='first',
+             use_cache=True, report_prefix="run_report", profile_stages=(), rf_search=None):
     # create or clear if exists the log file
-    log_file = open("log_file.csv", "w")
-    log_file.write("date,etape,fichier,erreur\n")
+    log_file = open("log_file.csv", "w", newline="")
+    log_file.write("date,etape,fichier,statut,erreur\n")
 
     time_window = 60
 
@@ -50,235 +61,359 @@ def pipeline(limit, start_at_phase, stop_at_phase, is_test=False, model_type='rf
         csv_sep_protocol_dir = "../dataset_train/csv/4.sep_protocol"
         csv_vectorized_dir = "../dataset_train/csv/5.vectorized"
 
-    start_time = datetime.now()
-    last_etape_end_time = datetime.now()
+    # Mesures par étape et par fichier (voir instrumentation.RunReport)
+    report = RunReport(profile_stages)
+
+    # phases 1 et 2 enchaînées en mémoire, sans CSV intermédiaire
+    fused_1_2 = in_memory and start_at_phase <= 1 and stop_at_phase >= 2
+    if fused_1_2:
+        with report.stage("1-2"):
+            etape_1_2_en_memoire(limit, pcap_dir, csv_fan_dir, time_window, workers, log_file, storage_format,
+                                 csv_pur_dir if persist_pur else None, use_cache)
 
-    if start_at_phase <= 1 <= stop_at_phase:
-        etape_1_transformation(limit, pcap_dir, csv_pur_dir)
-        print("Temps étape : ", datetime.now() - last_etape_end_time)
-        last_etape_end_time = datetime.now()
+    if start_at_phase <= 1 <= stop_at_phase and not fused_1_2:
+        with report.stage(1):
+            etape_1_transformation(limit, pcap_dir, csv_pur_dir, workers, log_file, use_cache)
 
-    if start_at_phase <= 2 <= stop_at_phase:
-        etape_2_fan(csv_pur_dir, csv_fan_dir, time_window)
-        print("Temps étape : ", datetime.now() - last_etape_end_time)
-        print("Temps total : ", datetime.now() - start_time)
+    if start_at_phase <= 2 <= stop_at_phase and not fused_1_2:
+        with report.stage(2):
+            etape_2_fan(csv_pur_dir, csv_fan_dir, time_window, workers, log_file, storage_format, use_cache)
     if (start_at_phase <= 3 <= stop_at_phase) and not is_test:
-        etape_3_label(csv_fan_dir, csv_labeled_dir, train_gt_path)
-        print("Temps étape : ", datetime.now() - last_etape_end_time)
-        print("Temps total : ", datetime.now() - start_time)
+        with report.stage(3):
+            etape_3_label(csv_fan_dir, csv_labeled_dir, train_gt_path, workers, log_file, storage_format,
+                          use_cache)
     if start_at_phase <= 4 <= stop_at_phase:
-        if not is_test:
-            etape_4_separation(csv_labeled_dir, csv_sep_protocol_dir, is_test)
-        else:
-            etape_4_separation(csv_fan_dir, csv_sep_protocol_dir, is_test)
-        print("Temps étape : ", datetime.now() - last_etape_end_time)
-        print("Temps total : ", datetime.now() - start_time)
+        with report.stage(4):
+            if not is_test:
+                etape_4_separation(csv_labeled_dir, csv_sep_protocol_dir, is_test, workers, log_file,
+                                   storage_format, multi_match, use_cache)
+            else:
+                etape_4_separation(csv_fan_dir, csv_sep_protocol_dir, is_test, workers, log_file, storage_format,
+                                   multi_match, use_cache)
     if start_at_phase <= 5 <= stop_at_phase:
-        etape_5_vectorisation(csv_sep_protocol_dir, csv_vectorized_dir, is_test=is_test)
-        print("Temps étape : ", datetime.now() - last_etape_end_time)
-        print("Temps total : ", datetime.now() - start_time)
+        with report.stage(5):
+            etape_5_vectorisation(csv_sep_protocol_dir, csv_vectorized_dir, is_test, workers, log_file,
+                                  storage_format, sparse, use_cache)
     if (start_at_phase <= 6 <= stop_at_phase) and not is_test:
-        etape_6_entrainement(csv_vectorized_dir, models_path, model_type)
-        print("Temps étape : ", datetime.now() - last_etape_end_time)
-        print("Temps total : ", datetime.now() - start_time)
+        with report.stage(6):
+            etape_6_entrainement(csv_vectorized_dir, models_path, model_type, workers, log_file, sparse,
+                                 use_cache, rf_search)
     if (start_at_phase <= 7 <= stop_at_phase) and not is_test:
-        etape_7_entrainement(csv_vectorized_dir, models_path)
-        print("Temps étape : ", datetime.now() - last_etape_end_time)
-        print("Temps total : ", datetime.now() - start_time)
+        with report.stage(7):
+            etape_7_entrainement(csv_vectorized_dir, models_path, workers, log_file, sparse, use_cache, rf_search)
 
     log_file.close()
-    print("Temps d'exécution : ", datetime.now() - start_time)
+    json_report, csv_report = report.write(report_prefix)
+    print(report.summary())
+    print(f"Rapport d'exécution : {json_report}, {csv_report}")
+    return report
 
 
-def etape_1_transformation(limit, pcap_dir, csv_pur_dir):
+def etape_1_transformation(limit, pcap_dir, csv_pur_dir, workers=1, log_file=None, use_cache=False):
     print("1. Transformation des pcap en csv")
     etape = 1
-    pcap_files = [f for f in os.listdir(pcap_dir) if f.endswith(".pcap")]
-    csv_files = []
-    i = 0
-    for pcap in pcap_files:
-        if i >= limit: break
-        try:
-            pcap_path = os.path.join(pcap_dir, pcap)
-            csv_path = pcap_to_csv(pcap_path, csv_pur_dir, cleaning=True)
-            csv_files.append(csv_path)
-        except Exception as e:
-            print("exception")
-            date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        i += 1
+    pcap_files = sorted(f for f in os.listdir(pcap_dir) if f.endswith(".pcap"))[:limit]
+    tasks = [(os.path.join(pcap_dir, pcap), csv_pur_dir) for pcap in pcap_files]
+    func = partial(pcap_to_csv, cleaning=True)
+    cache = get_stage_cache(use_cache, csv_pur_dir, etape, func, {'cleaning': True, 'nfstream': STREAMER_SETTINGS},
+                            ['pcapLoader'])
+    return run_stage(func, tasks, etape, log_file, workers, cache)
 
 
-def etape_2_fan(csv_pur_dir, csv_fan_dir, time_window):
+def etape_2_fan(csv_pur_dir, csv_fan_dir, time_window, workers=1, log_file=None, storage_format='csv',
+                use_cache=False):
     print("2. Enrichissement avec fan_in/fan_out")
     etape = 2
-    csv_files = [os.path.join(csv_pur_dir, f) for f in os.listdir(csv_pur_dir) if f.endswith(".csv")]
-    enriched_csv_files = []
-    for csv_file in csv_files:
-        try:
-            enriched_csv = add_fan_features(csv_file, csv_fan_dir, time_window=time_window)
-            enriched_csv_files.append(enriched_csv)
-        except Exception as e:
-            date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            txt_error = f"{date},{etape},{csv_file},{e}\n"
-            print(txt_error)
-
-
-def etape_3_label(csv_fan_dir, csv_labeled_dir, train_gt_path):
+    csv_files = list_tables(csv_pur_dir)
+    tasks = [(csv_file, csv_fan_dir) for csv_file in csv_files]
+    func = partial(add_fan_features, time_window=time_window, fmt=storage_format)
+    cache = get_stage_cache(use_cache, csv_fan_dir, etape, func,
+                            {'time_window': time_window, 'format': storage_format},
+                            ['pcapLoader', 'ip_tools', 'storage'])
+    return run_stage(func, tasks, etape, log_file, workers, cache)
+
+
+def etape_1_2_en_memoire(limit, pcap_dir, csv_fan_dir, time_window, workers=1, log_file=None, storage_format='csv',
+                         csv_pur_dir=None, use_cache=False):
+    print("1-2. Transformation des pcap et enrichissement fan_in/fan_out en mémoire")
+    etape = "1-2"
+    pcap_files = sorted(f for f in os.listdir(pcap_dir) if f.endswith(".pcap"))[:limit]
+    tasks = [(os.path.join(pcap_dir, pcap), csv_fan_dir) for pcap in pcap_files]
+    func = partial(pcap_to_fan, time_window=time_window, fmt=storage_format, pur_folder=csv_pur_dir)
+    cache = get_stage_cache(use_cache, csv_fan_dir, etape, func,
+                            {'time_window': time_window, 'format': storage_format, 'nfstream': STREAMER_SETTINGS,
+                             'pur_folder': csv_pur_dir},
+                            ['pcapLoader', 'ip_tools', 'storage'])
+    return run_stage(func, tasks, etape, log_file, workers, cache)
+
+
+def etape_3_label(csv_fan_dir, csv_labeled_dir, train_gt_path, workers=1, log_file=None, storage_format='csv',
+                  use_cache=False):
     print("3. Labeling des flux avec TRAIN.gt.csv")
     etape = 3
-    enriched_csv_files = [os.path.join(csv_fan_dir, f) for f in os.listdir(csv_fan_dir) if f.endswith(".csv")]
-    labeled_csvs = []
-    for enriched_csv in enriched_csv_files:
-        try:
-            labeled_csv = label_flows(enriched_csv, csv_labeled_dir, train_gt_path)
-            labeled_csvs.append(labeled_csv)
-        except Exception as e:
-            date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            txt_error = f"{date},{etape},{enriched_csv},{e}\n"
-            print(txt_error)
+    enriched_csv_files = list_tables(csv_fan_dir, storage_format)
+    # Compilée avant la création du pool : les workers héritent de l'index
+    compile_ground_truth(train_gt_path)
+    tasks = [(enriched_csv, csv_labeled_dir, train_gt_path, storage_format) for enriched_csv in enriched_csv_files]
+    # Le fichier de vérité terrain fait partie des entrées : le modifier invalide tout le labeling
+    cache = get_stage_cache(use_cache, csv_labeled_dir, etape, label_flows, {'format': storage_format},
+                            ['ip_tools', 'storage'], input_of=lambda args: [args[0], args[2]])
+    return run_stage(label_flows, tasks, etape, log_file, workers, cache)
+
+
+def separer_fichier(labeled_csv, csv_sep_protocol_dir, is_test=False, storage_format='csv', multi_match='first'):
+    """
+    Sépare un fichier CSV en sous-ensembles par application (voir etape_4_separation).
+    :return: liste des fichiers écrits
+    """
+    apps_sous_ensembles = get_app_list()
+    separated_csvs = []
+
+    df = read_table(labeled_csv)
+
+    # Diviser en sous-ensembles par application_name (une seule passe, voir split_by_application)
+    dict_sub_df = subset_divizor(df, apps_sous_ensembles, 'application_name', multi_match=multi_match)
+
+    filename = os.path.basename(labeled_csv).split(".")[0]
+
+    for app_name, sub_df in dict_sub_df.items():
+        # Créer un sous-dossier pour l'application
+        app_dir = os.path.join(csv_sep_protocol_dir, app_name)
+        os.makedirs(app_dir, exist_ok=True)
 
+        # Sauvegarder le fichier dans le sous-dossier
+        sub_csv_path = os.path.join(app_dir, f"{filename}_{app_name}.csv")
+        separated_csvs.append(write_table(sub_df, sub_csv_path, storage_format))
 
-def etape_4_separation(from_dir, csv_sep_protocol_dir, is_test=False):
+    return separated_csvs
+
+
+def etape_4_separation(from_dir, csv_sep_protocol_dir, is_test=False, workers=1, log_file=None,
+                       storage_format='csv', multi_match='first', use_cache=False):
     """
         Sépare les fichiers CSV étiquetés en sous-ensembles basés sur le champ 'application_name',
         et stocke chaque sous-ensemble dans un sous-dossier nommé selon l'application.
         :param
             from_dir: dossier contenant les fichiers CSV étiquetés OU les fichiers CSV à évaluer
             to_dir: dossier de destination où stocker les sous-ensembles
+            multi_match: règle pour les flux correspondant à plusieurs applications (voir tools.MULTI_MATCH_RULES)
         """
     print("4. Séparation en sous-ensembles")
     etape = 4
-    labeled_csvs = [os.path.join(from_dir, f) for f in os.listdir(from_dir) if f.endswith(".csv")]
-
-    apps_sous_ensembles = get_app_list()
-    separated_csvs = []
+    labeled_csvs = list_tables(from_dir, storage_format)
 
     # Vérifier s'il existe des fichiers étiquetés
     if not labeled_csvs:
         print(f"Aucun fichier trouvé dans {from_dir}.")
-        return
+        return []
 
-    for labeled_csv in labeled_csvs:
-        try:
-            df = pd.read_csv(labeled_csv)
+    tasks = [(labeled_csv, csv_sep_protocol_dir, is_test, storage_format, multi_match) for labeled_csv in labeled_csvs]
+    cache = get_stage_cache(use_cache, csv_sep_protocol_dir, etape, separer_fichier,
+                            {'is_test': is_test, 'format': storage_format, 'multi_match': multi_match,
+                             'apps': get_app_list()},
+                            ['tools', 'storage'])
+    return run_stage(separer_fichier, tasks, etape, log_file, workers, cache)
 
-            # Diviser en sous-ensembles par application_name
-            dict_sub_df = subset_divizor(df, apps_sous_ensembles, 'application_name')
 
-            filename = os.path.basename(labeled_csv).split(".")[0]
-
-            for app_name, sub_df in dict_sub_df.items():
-                try:
-                    # Créer un sous-dossier pour l'application
-                    app_dir = os.path.join(csv_sep_protocol_dir, app_name)
-                    os.makedirs(app_dir, exist_ok=True)
-
-                    # Sauvegarder le fichier dans le sous-dossier
-                    sub_csv_path = os.path.join(app_dir, f"{filename}_{app_name}.csv")
-                    sub_df.to_csv(sub_csv_path, index=False)
-                    separated_csvs.append(sub_csv_path)
-
-                except Exception as e:
-                    date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    txt_error = f"{date},{etape},{app_name},{e}\n"
-                    print(txt_error)
+def vectoriser_app(app_name, csv_sep_protocol_dir, csv_vectorized_dir, is_test=False, storage_format='csv',
+                   sparse=False):
+    """
+    Vectorise l'ensemble des sous-ensembles d'une application (voir etape_5_vectorisation).
+    En mode sparse, la matrice creuse est sauvegardée telle quelle (<APP>_vectorized.npz).
+    :return: chemin du fichier vectorisé
+    """
+    separated_csvs = list_tables(os.path.join(csv_sep_protocol_dir, app_name), storage_format)
+    dataset = pd.concat([read_table(f, on_bad_lines='skip') for f in separated_csvs], ignore_index=True)
 
+    if is_test: # test
+        label_col = None
+        trained_scaler_ohe_dir = "../dataset_train/csv/5.vectorized"
 
-        except Exception as e:
-            date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            txt_error = f"{date},{etape},{labeled_csv},{e}\n"
-            print(txt_error)
+        scaler_path = os.path.join(trained_scaler_ohe_dir, app_name, "scaler.joblib")
+        ohe_path = os.path.join(trained_scaler_ohe_dir, app_name, "ohe.joblib")
 
 
-def etape_5_vectorisation(csv_sep_protocol_dir, csv_vectorized_dir, is_test=False):
+    else: # train
+        label_col = 'label'
+        scaler_path = os.path.join(csv_vectorized_dir, app_name, "scaler.joblib")
+        ohe_path = os.path.join(csv_vectorized_dir, app_name, "ohe.joblib")
+
+    vectorized_df = vectorize_flows(
+        dataset,
+        get_categorical_cols(),
+        get_numeric_cols(),
+        label_col=label_col,
+        scaler_path=scaler_path,
+        one_hot_encoder_path=ohe_path,
+        is_test=is_test,
+        sparse=sparse
+    )
+
+    # enregister le fichier vectorisé dans 5.vectorized/app_name/app_name_vectorized.csv
+    vectorized_csv_path = os.path.join(csv_vectorized_dir, app_name, f"{app_name}_vectorized.csv")
+    if sparse:
+        x, feature_names, y = vectorized_df
+        return write_sparse(x, feature_names, y, vectorized_csv_path)
+    return write_table(vectorized_df, vectorized_csv_path, storage_format)
+
+
+def etape_5_vectorisation(csv_sep_protocol_dir, csv_vectorized_dir, is_test=False, workers=1, log_file=None,
+                          storage_format='csv', sparse=False, use_cache=False):
     print("5. Vectorisation des flux")
 
     etape = 5
 
-    for app_name in get_app_list():
-        try:
-            separated_csvs = [os.path.join(csv_sep_protocol_dir, app_name, f) for f in
-                              os.listdir(os.path.join(csv_sep_protocol_dir, app_name)) if f.endswith(".csv")]
-            dataset = pd.concat([pd.read_csv(f, on_bad_lines='skip') for f in separated_csvs], ignore_index=True)
+    tasks = [(app_name, csv_sep_protocol_dir, csv_vectorized_dir, is_test, storage_format, sparse)
+             for app_name in get_app_list()]
 
-            if is_test: # test
-                label_col = None
-                trained_scaler_ohe_dir = "../dataset_train/csv/5.vectorized"
+    def inputs_vectorisation(args):
+        # Tous les sous-ensembles de l'application (et, en test, le scaler/encodeur entraînés)
+        inputs = [os.path.join(csv_sep_protocol_dir, args[0])]
+        if is_test:
+            inputs.append(os.path.join("../dataset_train/csv/5.vectorized", args[0]))
+        return inputs
 
-                scaler_path = os.path.join(trained_scaler_ohe_dir, app_name, "scaler.joblib")
-                ohe_path = os.path.join(trained_scaler_ohe_dir, app_name, "ohe.joblib")
+    cache = get_stage_cache(use_cache, csv_vectorized_dir, etape, vectoriser_app,
+                            {'is_test': is_test, 'format': storage_format, 'sparse': sparse,
+                             'categorical_cols': get_categorical_cols(), 'numeric_cols': get_numeric_cols()},
+                            ['vectorization', 'ip_tools', 'tools', 'storage'], input_of=inputs_vectorisation)
+    return run_stage(vectoriser_app, tasks, etape, log_file, workers, cache)
 
 
-            else: # train
-                label_col = 'label'
-                scaler_path = os.path.join(csv_vectorized_dir, app_name, "scaler.joblib")
-                ohe_path = os.path.join(csv_vectorized_dir, app_name, "ohe.joblib")
+def entrainer_app(app_name, csv_vectorized_dir, models_path, model_type, sparse=False, n_jobs=-1):
+    """
+    Entraîne et sauvegarde le modèle d'une application (voir etape_6_entrainement).
+    :param n_jobs: workers de la recherche de la Random Forest
+    :return: chemin du modèle sauvegardé
+    """
+    save_path = os.path.join(models_path,model_type, app_name)
+    if not os.path.exists(save_path):
+        os.makedirs(save_path, exist_ok=True)
 
-            vectorized_df = vectorize_flows(
-                dataset,
-                get_categorical_cols(),
-                get_numeric_cols(),
-                label_col=label_col,
-                scaler_path=scaler_path,
-                one_hot_encoder_path=ohe_path,
-                is_test=is_test
-            )
+    dataset = charger_vectorise(app_name, csv_vectorized_dir, sparse)
+    print(app_name)
 
+    if(model_type == 'rf'):
+        model, best_params, best_score = train_rf(dataset, save_path, n_jobs=n_jobs)
+    elif(model_type == 'nb'):
+        model, best_params, best_score = train_naive_bayes(dataset, save_path)
+    elif(model_type == 'knn'):
+        model, best_params, best_score = train_knn(dataset, save_path)
+    else:
+        raise ValueError(f"Type de modèle inconnu : {model_type}")
 
+    model_path = sauvegarder_modele(model, best_params, app_name, save_path, model_type)
+    print("\n\n")
+    return model_path
 
-            # enregister le fichier vectorisé dans 5.vectorized/app_name/app_name_vectorized.csv
-            vectorized_csv_path = os.path.join(csv_vectorized_dir, app_name, f"{app_name}_vectorized.csv")
-            vectorized_df.to_csv(vectorized_csv_path, index=False)
 
-        except Exception as e:
-            raise e
-            date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            txt_error = f"{date},{etape},{app_name},{e}\n"
-            print(txt_error)
+def entrainer_rf_partage(csv_vectorized_dir, models_path, sparse=False, rf_search=None):
+    """
+    Entraîne les Random Forest de toutes les applications avec une recherche d'hyperparamètres commune
+    (un seul pool de workers pour toutes les applications, voir train_rf_apps).
+    Le temps nécessaire pour atteindre le meilleur score de chaque application est écrit dans
+    models/rf/search_report.csv.
 
+    :param rf_search: options de train_rf_apps (search, n_jobs, budget_s, max_samples, n_candidates)
+    :return: chemins des modèles sauvegardés
+    """
+    datasets = {}
+    save_paths = {}
+    for app_name in get_app_list():
+        try:
+            datasets[app_name] = charger_vectorise(app_name, csv_vectorized_dir, sparse)
+        except FileNotFoundError as e:
+            print(f"{app_name} ignorée : {e}")
+            continue
+        save_paths[app_name] = os.path.join(models_path, 'rf', app_name)
+        os.makedirs(save_paths[app_name], exist_ok=True)
+
+    trained = train_rf_apps(datasets, save_paths, **(rf_search or {}))
+    return sauvegarder_rf_partage(trained, save_paths, models_path)
 
-def etape_6_entrainement(csv_vectorized_dir, models_path, model_type):
+
+def etape_6_entrainement(csv_vectorized_dir, models_path, model_type, workers=1, log_file=None, sparse=False,
+                         use_cache=False, rf_search=None):
+    """
+    Entraîne un modèle par application.
+    Pour la Random Forest avec rf_search['search'] = 'random' ou 'halving', toutes les applications partagent
+    un seul pool de rf_search['n_jobs'] workers (une seule tâche), au lieu d'un processus par application.
+    """
     print("6. Entrainement et sauvegarde du modèle " + model_type)
     etape = 6
 
-    for app_name in get_app_list():
-        try:
-            save_path = os.path.join(models_path,model_type, app_name)
-            if not os.path.exists(save_path):
-                os.makedirs(save_path)
-
-            dataset = pd.read_csv(os.path.join(csv_vectorized_dir, app_name, f"{app_name}_vectorized.csv"))
-            print(app_name)
-
-            if(model_type == 'rf'):
-                model, best_params, best_score = train_rf(dataset, save_path)
-            elif(model_type == 'nb'):
-                model, best_params, best_score = train_naive_bayes(dataset, save_path)
-            elif(model_type == 'knn'):
-                model, best_params, best_score = train_knn(dataset, save_path)
-
-            # enregistrement du modèle
-            model_path = os.path.join(save_path, f"model_{app_name}.joblib")
-            # enregistrement des best_params en csv
-            best_params_path = os.path.join(save_path, f"{model_type}best_params_{app_name}.csv")
-            with open(best_params_path, 'w') as f:
-                for key in best_params.keys():
-                    f.write("%s,%s\n" % (key, best_params[key]))
-            joblib.dump(model, model_path)
-            print("\n\n")
-
-        except Exception as e:
-            date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            txt_error = f"{date},{etape},{app_name},{e}\n"
-            print(txt_error)
-
-def etape_7_entrainement(csv_vectorized_dir, models_path):
+    if model_type == 'rf' and rf_search and rf_search.get('search', 'grid') != 'grid':
+        cache = get_stage_cache(use_cache, models_path, f"{etape}-{model_type}-partage", entrainer_rf_partage,
+                                {'sparse': sparse, 'rf_search': search_cache_params(rf_search), 'apps': get_app_list()},
+                                ['cross_validation_setup', 'hyperparameter_search', 'storage'])
+        results = run_stage(entrainer_rf_partage, [(csv_vectorized_dir, models_path, sparse, rf_search)],
+                            etape, log_file, 1, cache)
+        return results[0] if results else []
+
+    # Les applications s'entraînent en parallèle sur les workers : cœurs partagés entre leurs recherches
+    n_jobs = jobs_per_worker((rf_search or {}).get('n_jobs', -1), workers)
+    tasks = [(app_name, csv_vectorized_dir, models_path, model_type, sparse, n_jobs) for app_name in get_app_list()]
+    cache = get_stage_cache(use_cache, models_path, f"{etape}-{model_type}", entrainer_app,
+                            {'model_type': model_type, 'sparse': sparse},
+                            ['cross_validation_setup', 'storage'],
+                            input_of=lambda args: os.path.join(csv_vectorized_dir, args[0]))
+    return run_stage(entrainer_app, tasks, etape, log_file, workers, cache)
+
+def etape_7_entrainement(csv_vectorized_dir, models_path, workers=1, log_file=None, sparse=False, use_cache=False,
+                         rf_search=None):
+    """
+    Entraîne toutes les familles de modèles (rf, knn, nb) sur une session d'entraînement commune :
+    chaque jeu vectorisé est lu une seule fois et toutes les familles utilisent le même découpage train/test
+    (voir training_session.TrainingSession). Les tâches de toutes les familles se répartissent sur les workers.
+    """
     print("7. Entrainement et sauvegarde de tout les modèles")
-    models = ["rf", "nb", "knn"]
-    for model in models:
-        etape_6_entrainement(csv_vectorized_dir, models_path, model)
+    etape = 7
+    session = TrainingSession(os.path.join(models_path, "session"), get_app_list(), sparse)
+    session.prepare(csv_vectorized_dir, workers, log_file, use_cache, etape)
+    return session.train(models_path, MODEL_TYPES, workers, log_file, use_cache, rf_search, etape)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pipeline de détection d'intrusion")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="nombre de processus par étape (0 = tous les coeurs)")
+    parser.add_argument("--pipeline", nargs=2, type=int, metavar=("START", "STOP"),
+                        help="lance pipeline() de la phase START à la phase STOP")
+    parser.add_argument("--limit", type=int, default=54, help="nombre maximum de pcap traités")
+    parser.add_argument("--test", action="store_true", help="traite le dataset de test")
+    parser.add_argument("--model", default="rf", choices=["rf", "nb", "knn"])
+    parser.add_argument("--format", default="csv", choices=list(FORMATS),
+                        help="format de stockage des sorties des étapes 2 à 5")
+    parser.add_argument("--in-memory", action="store_true",
+                        help="enchaîne les phases 1 et 2 en mémoire (sans CSV intermédiaire)")
+    parser.add_argument("--persist-pur", action="store_true",
+                        help="avec --in-memory, sauvegarde aussi les flux nettoyés dans 1.pur")
+    parser.add_argument("--sparse", action="store_true",
+                        help="vectorisation et entraînement sur matrices creuses (étapes 5 à 7)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="recalcule toutes les tâches sans consulter le manifeste des étapes")
+    parser.add_argument("--report", default="run_report",
+                        help="préfixe du rapport d'exécution (<préfixe>.json et <préfixe>.csv)")
+    parser.add_argument("--profile", nargs="*", default=[], metavar="ETAPE",
+                        help="étapes exécutées sous cProfile (fichiers .prof dans profiles/)")
+    parser.add_argument("--search", default="grid", choices=list(SEARCH_MODES),
+                        help="recherche d'hyperparamètres de la Random Forest (random/halving : pool partagé)")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="workers de la recherche (-1 = tous les cœurs)")
+    parser.add_argument("--budget-s", type=float, default=None, help="budget de temps de la recherche")
+    parser.add_argument("--max-samples", type=int, default=None, help="nombre maximum de flux par fit")
+    parser.add_argument("--multi-match", default="first", choices=list(MULTI_MATCH_RULES),
+                        help="étape 4 : affectation des flux correspondant à plusieurs applications")
+    args = parser.parse_args()
+
+    if args.pipeline:
+        pipeline(args.limit, args.pipeline[0], args.pipeline[1], is_test=args.test,
+                 model_type=args.model, workers=args.workers, storage_format=args.format,
+                 in_memory=args.in_memory, persist_pur=args.persist_pur, sparse=args.sparse,
+                 multi_match=args.multi_match, use_cache=not args.no_cache, report_prefix=args.report,
+                 profile_stages=args.profile,
+                 rf_search={'search': args.search, 'n_jobs': args.n_jobs, 'budget_s': args.budget_s,
+                            'max_samples': args.max_samples})
+        sys.exit(0)
+
     # pipeline(54, 6, 6, is_test=False, model_type='nb')
 
     # pipeline(28, 0, 2, is_test=True)
@@ -1,6 +1,8 @@
+import re
 from datetime import datetime
 
 from pcapLoader import csv_to_reader
+import numpy as np
 import pandas as pd
 ########### tool temporaire
 def quels_champs_sont_constants(csv_path: str)->dict:
@@ -128,7 +130,95 @@ def fix_ligne10000(csv_path: str)->str:
 
 # fix_ligne10000("C:\\Projets_GIT_C\\ENSIBS\\ia_detection\\IADI_LagPey\\pcap_folder\\dataset_train\\csv\\all_data_with_fan_labeled.csv")
 
-def subset_divizor(df, list_of_values, field, is_evaluating_challenge):
+# Règles d'affectation d'un flux dont application_name correspond à plusieurs applications (ex. "TLS.HTTP") :
+#   - 'first'    : l'application trouvée le plus à gauche (protocole maître nDPI)
+#   - 'last'     : l'application trouvée le plus à droite (la plus spécifique)
+#   - 'priority' : l'application qui apparaît en premier dans la liste des applications
+#   - 'all'      : le flux est placé dans tous les sous-ensembles correspondants (ancien comportement)
+MULTI_MATCH_RULES = ('first', 'last', 'priority', 'all')
+
+
+def compile_app_pattern(list_of_values) -> re.Pattern:
+    """
+    Expression régulière unique reconnaissant toutes les applications (les plus longues d'abord).
+    """
+    alternatives = sorted({str(value) for value in list_of_values}, key=len, reverse=True)
+    return re.compile("|".join(re.escape(value) for value in alternatives))
+
+
+def match_applications(name, pattern: re.Pattern, app_ids: dict[str, int]) -> list[int]:
+    """
+    Découpe un application_name sur "." et retourne, dans l'ordre d'apparition,
+    les identifiants des applications reconnues dans ses composantes.
+    """
+    matches = []
+    for token in str(name).split("."):
+        for app in pattern.findall(token):
+            app_id = app_ids[app]
+            if app_id not in matches:
+                matches.append(app_id)
+    return matches
+
+
+def split_by_application(df, list_of_values, field, multi_match='first', with_unknown=False) -> dict[str, np.ndarray]:
+    """
+    Répartit les lignes d'un DataFrame par application en une seule passe :
+    chaque valeur distincte du champ est analysée une fois (factorize), puis les lignes sont
+    regroupées par identifiant d'application (groupby).
+
+    :param df: pandas DataFrame
+    :param list_of_values: liste des applications
+    :param field: champ (colonne) contenant le nom d'application
+    :param multi_match: règle appliquée aux lignes correspondant à plusieurs applications (voir MULTI_MATCH_RULES)
+    :param with_unknown: ajoute la clé 'unknown' pour les lignes ne correspondant à aucune application
+    :return: dict application -> positions (iloc) des lignes, pour toutes les applications de la liste
+    """
+    if multi_match not in MULTI_MATCH_RULES:
+        raise ValueError(f"Règle inconnue : {multi_match} (règles disponibles : {list(MULTI_MATCH_RULES)})")
+
+    list_of_values = list(list_of_values)
+    app_ids = {str(app): i for i, app in enumerate(list_of_values)}
+    pattern = compile_app_pattern(list_of_values)
+    unknown_id = len(list_of_values)
+
+    # Une seule analyse par valeur distincte (les valeurs manquantes ont le code -1)
+    codes, uniques = pd.factorize(df[field])
+    unique_matches = [match_applications(name, pattern, app_ids) for name in uniques]
+
+    if multi_match == 'all':
+        # Forme longue : une ligne (position, application) par correspondance
+        pairs = pd.DataFrame(
+            [(code, app_id) for code, m in enumerate(unique_matches) for app_id in (m or [unknown_id])]
+            + [(-1, unknown_id)],
+            columns=['code', 'app_id']
+        )
+        rows = pd.DataFrame({'code': codes, 'position': np.arange(len(codes))}).merge(pairs, on='code')
+        positions = rows['position'].to_numpy()
+        row_ids = rows['app_id'].to_numpy()
+    else:
+        if multi_match == 'first':
+            chosen = [m[0] if m else unknown_id for m in unique_matches]
+        elif multi_match == 'last':
+            chosen = [m[-1] if m else unknown_id for m in unique_matches]
+        else:
+            chosen = [min(m) if m else unknown_id for m in unique_matches]
+        # Le dernier élément sert aux valeurs manquantes (code -1)
+        unique_ids = np.array(chosen + [unknown_id], dtype=np.int64)
+        positions = np.arange(len(codes))
+        row_ids = unique_ids[codes]
+
+    groups = pd.Series(positions).groupby(row_ids).indices
+    empty = np.zeros(0, dtype=np.int64)
+    split = {
+        app: positions[groups[i]] if i in groups else empty
+        for i, app in enumerate(list_of_values)
+    }
+    if with_unknown:
+        split["unknown"] = positions[groups[unknown_id]] if unknown_id in groups else empty
+    return split
+
+
+def subset_divizor(df, list_of_values, field, is_evaluating_challenge=False, multi_match='first'):
     """
     Divise un dataframe en sous-dataframes selon les valeurs d'un champ.
     Si une ligne ne correspond à aucune valeur ou ne contient aucune des valeurs, elle est mise dans 'unknown'.
@@ -136,19 +226,12 @@ def subset_divizor(df, list_of_values, field, is_evaluating_challenge):
     :param df: pandas DataFrame
     :param list_of_values: Liste des valeurs à utiliser pour diviser le DataFrame
     :param field: Nom du champ (colonne) utilisé pour la division
+    :param is_evaluating_challenge: ajoute le sous-dataframe 'unknown'
+    :param multi_match: règle pour les lignes correspondant à plusieurs valeurs (voir MULTI_MATCH_RULES)
     :return: dict de sous-dataframes
     """
-    dict_apps = {}
-
-    # Initialise les sous-dataframes pour les valeurs de la liste
-    for app in list_of_values:
-        dict_apps[app] = df[(df[field] == app) | (df[field].str.contains(app, na=False))]
-    if is_evaluating_challenge :
-        # Trouve les lignes qui ne correspondent à aucune valeur de la liste
-        matched_indexes = pd.concat(dict_apps.values()).index
-        dict_apps["unknown"] = df.loc[~df.index.isin(matched_indexes)]
-
-    return dict_apps
+    split = split_by_application(df, list_of_values, field, multi_match, with_unknown=is_evaluating_challenge)
+    return {app: df.iloc[positions] for app, positions in split.items()}
 
 
 def json_set_int_encoder(obj):
@@ -280,5 +363,6 @@ def get_params_for_model(model_path):
 
     return params
 
-for app in get_app_list():
-    print(app, get_params_for_model(f"../models/rf/{app}/model_{app}.joblib"))
\ No newline at end of file
+if __name__ == '__main__':
+    for app in get_app_list():
+        print(app, get_params_for_model(f"../models/rf/{app}/model_{app}.joblib"))
@@ -0,0 +1,275 @@
+import json
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.model_selection import train_test_split
+
+from compiled_forest import CompiledForest, compiled_path, is_forest
+from cross_validation_setup import (fit_knn, fit_naive_bayes, fit_rf, fit_rf_apps, prepare_naive_bayes,
+                                    split_features_labels)
+from hyperparameter_search import search_report_df
+from stage_cache import get_stage_cache
+from stage_executor import jobs_per_worker, run_stage
+from storage import SPARSE_EXT, read_sparse, read_table, resolve_table
+
+# Familles de modèles entraînées par l'étape 7, dans l'ordre de lancement (les plus coûteuses d'abord)
+MODEL_TYPES = ('rf', 'knn', 'nb')
+
+# Découpage train/test commun à toutes les familles (mêmes valeurs que les train_*)
+TEST_SIZE = 0.2
+RANDOM_STATE = 42
+
+# Au-delà de cette taille, les tableaux de la session sont ouverts en memory-map plutôt que chargés :
+# les workers lisent alors les mêmes pages du cache disque au lieu de recevoir chacun une copie
+MMAP_MIN_BYTES = 64 << 20
+
+# Parties du découpage train/test, écrites chacune en tableaux contigus (voir preparer_app)
+PARTS = ('train', 'test')
+
+META_NAME = "meta.json"
+
+
+def charger_vectorise(app_name, csv_vectorized_dir, sparse=False):
+    """
+    Relit le jeu vectorisé d'une application (DataFrame, ou tuple creux en mode sparse).
+    """
+    vectorized_path = os.path.join(csv_vectorized_dir, app_name, f"{app_name}_vectorized")
+    if sparse:
+        # tuple (matrice creuse, noms des colonnes, labels), accepté directement par les train_*
+        return read_sparse(vectorized_path + SPARSE_EXT)
+    return read_table(resolve_table(vectorized_path))
+
+
+def sauvegarder_modele(model, best_params, app_name, save_path, model_type):
+    """
+    Enregistre le modèle et ses meilleurs hyperparamètres (csv), ainsi que la forêt compilée d'une Random Forest.
+    :return: chemin du modèle sauvegardé
+    """
+    # enregistrement du modèle
+    model_path = os.path.join(save_path, f"model_{app_name}.joblib")
+    # enregistrement des best_params en csv
+    best_params_path = os.path.join(save_path, f"{model_type}best_params_{app_name}.csv")
+    with open(best_params_path, 'w') as f:
+        for key in best_params.keys():
+            f.write("%s,%s\n" % (key, best_params[key]))
+    joblib.dump(model, model_path)
+    if is_forest(model):
+        # version compilée pour le scoring des petits lots (voir compiled_forest)
+        CompiledForest.from_sklearn(model).save(compiled_path(model_path))
+    return model_path
+
+
+def sauvegarder_rf_partage(trained, save_paths, models_path):
+    """
+    Enregistre les Random Forest d'une recherche commune (voir fit_rf_apps) et le rapport de recherche
+    models/rf/search_report.csv (temps nécessaire pour atteindre le meilleur score de chaque application).
+    :return: chemins des modèles sauvegardés
+    """
+    model_paths = [
+        sauvegarder_modele(model, best_params, app_name, save_paths[app_name], 'rf')
+        for app_name, (model, best_params, best_score, report) in trained.items()
+    ]
+    report_path = os.path.join(models_path, 'rf', 'search_report.csv')
+    search_report_df({app_name: t[3] for app_name, t in trained.items()}).to_csv(report_path, index=False)
+    print(f"Rapport de recherche : {report_path}")
+    return model_paths
+
+
+def preparer_app(app_name, csv_vectorized_dir, session_dir, sparse=False):
+    """
+    Lit une seule fois le jeu vectorisé d'une application et l'écrit dans la session en tableaux .npy, une série
+    par partie du découpage train/test commun (identique à celui de train_test_split(X, y, test_size=0.2,
+    random_state=42)) : features en float32 (X_<partie>.npy, ou <partie>_data/indices/indptr.npy en mode
+    sparse) et labels (y_<partie>.npy). Chaque partie est contiguë sur disque, elle s'ouvre en memory-map
+    sans copie.
+    :return: chemins des fichiers écrits
+    """
+    X, y, feature_names = split_features_labels(charger_vectorise(app_name, csv_vectorized_dir, sparse))
+    if sp.issparse(X):
+        X = sp.csr_matrix(X, dtype=np.float32)
+    else:
+        X = X.to_numpy(dtype=np.float32) if isinstance(X, pd.DataFrame) else np.asarray(X, dtype=np.float32)
+    y = np.asarray(y)
+    indices = dict(zip(PARTS, train_test_split(np.arange(len(y)), test_size=TEST_SIZE, random_state=RANDOM_STATE)))
+    arrays = {}
+    for part, rows in indices.items():
+        X_part = X[rows]
+        if sp.issparse(X_part):
+            arrays.update({f'{part}_data': X_part.data, f'{part}_indices': X_part.indices,
+                           f'{part}_indptr': X_part.indptr})
+        else:
+            arrays[f'X_{part}'] = X_part
+        arrays[f'y_{part}'] = y[rows]
+
+    app_dir = os.path.join(session_dir, app_name)
+    os.makedirs(app_dir, exist_ok=True)
+    paths = []
+    for name, array in arrays.items():
+        path = os.path.join(app_dir, f"{name}.npy")
+        np.save(path, np.ascontiguousarray(array))
+        paths.append(path)
+    meta_path = os.path.join(app_dir, META_NAME)
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({'sparse': sp.issparse(X), 'n_features': X.shape[1],
+                   'rows': {part: len(rows) for part, rows in indices.items()}, 'feature_names': feature_names}, f)
+    paths.append(meta_path)
+    print(f"{app_name} : {X.shape[0]} flux, {X.shape[1]} colonnes")
+    return paths
+
+
+def search_cache_params(rf_search) -> dict:
+    """
+    Options de recherche Random Forest entrant dans la clé du cache d'étape : n_jobs ne change que la
+    répartition sur les cœurs, pas le modèle obtenu, et dépend du nombre de workers (voir jobs_per_worker).
+    """
+    return {key: value for key, value in (rf_search or {}).items() if key != 'n_jobs'}
+
+
+def entrainer_modele(save_path, model_type, app_name, session_dir, apps=None, rf_search=None):
+    """
+    Tâche d'entraînement d'une session (exécutée dans un worker de run_stage) : les tableaux de la session
+    sont ouverts depuis le disque (memory-map pour les gros jeux), aucune donnée n'est envoyée au worker.
+
+    :param save_path: dossier du modèle (identifie la tâche dans le log)
+    :param app_name: application, ou None pour la recherche Random Forest commune à toutes les applications (apps)
+    :param rf_search: options de la recherche Random Forest (search, n_jobs, budget_s, max_samples, n_candidates)
+    :return: chemin du modèle sauvegardé (liste des chemins pour la recherche commune)
+    """
+    session = TrainingSession(session_dir, apps or [app_name])
+    rf_search = dict(rf_search or {})
+
+    if app_name is None:
+        models_path = os.path.dirname(os.path.normpath(save_path))
+        save_paths = {app: os.path.join(save_path, app) for app in session.apps}
+        for path in save_paths.values():
+            os.makedirs(path, exist_ok=True)
+        trained = fit_rf_apps({app: session.split(app) for app in session.apps}, save_paths, **rf_search)
+        return sauvegarder_rf_partage(trained, save_paths, models_path)
+
+    os.makedirs(save_path, exist_ok=True)
+    print(model_type, app_name)
+    if model_type == 'rf':
+        model, best_params, best_score = fit_rf(*session.split(app_name), save_path,
+                                                n_jobs=rf_search.get('n_jobs', -1))
+    elif model_type == 'nb':
+        model, best_params, best_score = fit_naive_bayes(*session.split(app_name, prepare_naive_bayes), save_path)
+    elif model_type == 'knn':
+        model, best_params, best_score = fit_knn(*session.split(app_name), save_path)
+    else:
+        raise ValueError(f"Type de modèle inconnu : {model_type}")
+    return sauvegarder_modele(model, best_params, app_name, save_path, model_type)
+
+
+class TrainingSession:
+    """
+    Données d'entraînement partagées par toutes les familles de modèles de l'étape 7.
+
+    Le jeu vectorisé de chaque application est lu une seule fois (prepare), converti en float32 et écrit
+    en .npy, une série de tableaux contigus par partie du découpage train/test commun. Chaque tâche
+    d'entraînement rouvre ces tableaux, en memory-map au-delà de mmap_min_bytes : les parties train et test
+    sont passées telles quelles aux estimateurs, les workers de run_stage partagent donc les pages du cache
+    disque au lieu de relire les CSV ou de recevoir des copies (seule une transformation, ex. Naive Bayes,
+    crée une copie privée).
+    """
+
+    def __init__(self, session_dir, apps, sparse=False, mmap_min_bytes=MMAP_MIN_BYTES):
+        self.session_dir = session_dir
+        self.apps = list(apps)
+        self.sparse = sparse
+        self.mmap_min_bytes = mmap_min_bytes
+
+    def app_dir(self, app_name):
+        return os.path.join(self.session_dir, app_name)
+
+    def prepare(self, csv_vectorized_dir, workers=1, log_file=None, use_cache=False, etape=7):
+        """
+        Écrit les tableaux de la session (une tâche par application, sautée si le jeu vectorisé n'a pas changé).
+        Les applications dont la préparation a échoué sont retirées de la session.
+        """
+        tasks = [(app_name, csv_vectorized_dir, self.session_dir, self.sparse) for app_name in self.apps]
+        cache = get_stage_cache(use_cache, self.session_dir, f"{etape}-session", preparer_app,
+                                {'sparse': self.sparse, 'test_size': TEST_SIZE, 'random_state': RANDOM_STATE},
+                                ['cross_validation_setup', 'storage'],
+                                input_of=lambda args: os.path.join(csv_vectorized_dir, args[0]))
+        results = run_stage(preparer_app, tasks, etape, log_file, workers, cache)
+        prepared = {os.path.basename(os.path.dirname(paths[0])) for paths in results}
+        self.apps = [app_name for app_name in self.apps if app_name in prepared]
+        return self
+
+    def _load_array(self, app_name, name):
+        path = os.path.join(self.app_dir(app_name), f"{name}.npy")
+        mmap_mode = 'r' if os.path.getsize(path) >= self.mmap_min_bytes else None
+        return np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+
+    def meta(self, app_name) -> dict:
+        with open(os.path.join(self.app_dir(app_name), META_NAME), encoding='utf-8') as f:
+            return json.load(f)
+
+    def load(self, app_name, part):
+        """
+        :param part: partie du découpage ('train' ou 'test')
+        :return: (X, y) de la partie, en memory-map au-delà de mmap_min_bytes (aucune copie)
+        """
+        meta = self.meta(app_name)
+        if meta['sparse']:
+            X = sp.csr_matrix((self._load_array(app_name, f'{part}_data'),
+                               self._load_array(app_name, f'{part}_indices'),
+                               self._load_array(app_name, f'{part}_indptr')),
+                              shape=(meta['rows'][part], meta['n_features']), copy=False)
+        else:
+            X = self._load_array(app_name, f'X_{part}')
+        return X, self._load_array(app_name, f'y_{part}')
+
+    def split(self, app_name, transform=None):
+        """
+        Découpage train/test commun d'une application.
+        :param transform: transformation appliquée à X entier (train puis test) avant le découpage,
+            ex. prepare_naive_bayes
+        :return: (X_train, X_test, y_train, y_test, noms des colonnes)
+        """
+        (X_train, y_train), (X_test, y_test) = (self.load(app_name, part) for part in PARTS)
+        if transform is not None:
+            n_train = X_train.shape[0]
+            X = transform(sp.vstack([X_train, X_test], format='csr') if sp.issparse(X_train)
+                          else np.concatenate([X_train, X_test]))
+            X_train, X_test = X[:n_train], X[n_train:]
+        return X_train, X_test, y_train, y_test, self.meta(app_name)['feature_names']
+
+    def nbytes(self, app_name) -> int:
+        app_dir = self.app_dir(app_name)
+        return sum(os.path.getsize(os.path.join(app_dir, f)) for f in os.listdir(app_dir))
+
+    def train(self, models_path, model_types=MODEL_TYPES, workers=1, log_file=None, use_cache=False,
+              rf_search=None, etape=7):
+        """
+        Entraîne toutes les familles de modèles sur les données de la session, en une seule étape run_stage :
+        avec workers > 1, les tâches (famille, application) de toutes les familles se répartissent sur le pool.
+        Avec rf_search['search'] = 'random' ou 'halving', les Random Forest de toutes les applications forment
+        une seule tâche (recherche commune, voir fit_rf_apps).
+
+        :return: chemins des modèles sauvegardés
+        """
+        # Les plus gros jeux d'abord dans chaque famille : les tâches longues ne finissent pas seules en fin d'étape
+        apps = sorted(self.apps, key=self.nbytes, reverse=True)
+        shared_rf = rf_search and rf_search.get('search', 'grid') != 'grid'
+        # Tâches simultanées sur les workers : cœurs partagés entre leurs recherches (voir jobs_per_worker)
+        task_search = {**(rf_search or {}), 'n_jobs': jobs_per_worker((rf_search or {}).get('n_jobs', -1), workers)}
+        tasks = []
+        for model_type in model_types:
+            if model_type == 'rf' and shared_rf:
+                tasks.append((os.path.join(models_path, 'rf'), 'rf', None, self.session_dir, apps, task_search))
+                continue
+            tasks.extend((os.path.join(models_path, model_type, app_name), model_type, app_name, self.session_dir,
+                          None, task_search) for app_name in apps)
+
+        def inputs_entrainement(args):
+            return [self.app_dir(app_name) for app_name in (args[4] or [args[2]])]
+
+        cache = get_stage_cache(use_cache, models_path, f"{etape}-session", entrainer_modele,
+                                {'model_types': list(model_types), 'rf_search': search_cache_params(rf_search)},
+                                ['cross_validation_setup', 'hyperparameter_search'], input_of=inputs_entrainement)
+        results = run_stage(entrainer_modele, tasks, etape, log_file, workers, cache)
+        return [path for result in results for path in ([result] if isinstance(result, str) else result)]
@@ -1,8 +1,10 @@
 import pandas as pd
 import joblib
+import scipy.sparse as sp
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 
 from tools import *
+from ip_tools import ip_classes
 
 def vectorize_flows(
     df,
@@ -11,7 +13,10 @@ def vectorize_flows(
     label_col=None,
     scaler_path=None,
     one_hot_encoder_path=None,
-    is_test=False
+    is_test=False,
+    scaler=None,
+    one_hot_encoder=None,
+    sparse=False
 ):
     """
     Vectorise les flux réseau (train ou test) :
@@ -28,12 +33,19 @@ def vectorize_flows(
       :param scaler_path: Chemin du StandardScaler sauvegardé (ou à sauvegarder).
       :param one_hot_encoder_path: Chemin du OneHotEncoder sauvegardé (ou à sauvegarder).
       :param is_test: Booléen, False pour l'entraînement (fit), True pour le test (transform).
+      :param scaler: StandardScaler déjà chargé (test uniquement), évite de le relire depuis scaler_path.
+      :param one_hot_encoder: OneHotEncoder déjà chargé (test uniquement), évite de le relire depuis one_hot_encoder_path.
+      :param sparse: Si True, le one-hot reste une matrice creuse SciPy (CSR) de bout en bout.
 
     Retourne :
       Un DataFrame contenant :
         - Les colonnes numériques normalisées
         - Les colonnes catégorielles encodées en one-hot
         - Optionnellement la colonne 'label' (si label_col existe dans df)
+      En mode sparse, un tuple (X, feature_names, y) :
+        - X : matrice CSR (colonnes numériques puis colonnes one-hot, même ordre que le DataFrame)
+        - feature_names : noms des colonnes de X
+        - y : labels (ou None)
     """
     df = clean_df(df)
 
@@ -45,8 +57,8 @@ def vectorize_flows(
 
     # 2) Conversion IP en classes
 
-    df['src_ip'] = df['src_ip'].apply(ip_to_class)
-    df['dst_ip'] = df['dst_ip'].apply(ip_to_class)
+    df['src_ip'] = ip_classes(df['src_ip'])
+    df['dst_ip'] = ip_classes(df['dst_ip'])
 
     # 3) Extraction éventuelle du label
     y = df[label_col].values if label_col and label_col in df.columns else None
@@ -62,7 +74,7 @@ def vectorize_flows(
         # === PHASE D'ENTRAÎNEMENT ===
         # Initialiser le scaler et le OHE avec handle_unknown='ignore'
         scaler = StandardScaler()
-        one_hot_encoder = OneHotEncoder(sparse_output=False, handle_unknown='ignore')
+        one_hot_encoder = OneHotEncoder(sparse_output=sparse, handle_unknown='ignore')
 
         # Fit + transform sur l'entraînement
         categorical_encoded = one_hot_encoder.fit_transform(categorical_data)
@@ -75,9 +87,11 @@ def vectorize_flows(
         print(scaler_path)
     else:
         # === PHASE DE TEST ===
-        # Charger les objets de normalisation et d'encodage
-        scaler = joblib.load(scaler_path)
-        one_hot_encoder = joblib.load(one_hot_encoder_path)
+        # Charger les objets de normalisation et d'encodage (sauf s'ils sont fournis)
+        if scaler is None:
+            scaler = joblib.load(scaler_path)
+        if one_hot_encoder is None:
+            one_hot_encoder = joblib.load(one_hot_encoder_path)
 
         # Transform uniquement (pas de fit)
         categorical_encoded = one_hot_encoder.transform(categorical_data)
@@ -85,6 +99,19 @@ def vectorize_flows(
 
 
 
+    # Le OHE chargé peut avoir été entraîné dans l'autre mode (dense / creux)
+    if sparse:
+        # 6 bis) Mode creux : empilement horizontal creux, sans jamais densifier le one-hot
+        categorical_columns = one_hot_encoder.get_feature_names_out(categorical_cols)
+        x = sp.hstack([
+            sp.csr_matrix(numeric_normalized),
+            sp.csr_matrix(categorical_encoded)
+        ], format='csr')
+        feature_names = list(numeric_cols) + list(categorical_columns)
+        return x, feature_names, y
+    if sp.issparse(categorical_encoded):
+        categorical_encoded = categorical_encoded.toarray()
+
     # 6) Recréer un DataFrame pour les données catégorielles encodées
     #    On récupère les noms de features générés par le OHE.
     categorical_columns = one_hot_encoder.get_feature_names_out(categorical_cols)
@@ -115,6 +142,7 @@ def vectorize_flows(
 def ip_to_class(ip:str)->str:
     """
     Convertit une adresse IP en classe d'adresse.
+    Version ligne à ligne : vectorize_flows utilise ip_tools.ip_classes, qui traite aussi l'IPv6 ('V6').
     """
     ip = ip.split(".")
     if ip[0] == "10":